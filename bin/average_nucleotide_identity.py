@@ -152,7 +152,6 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
-import json
 import logging
 import logging.handlers
 import os
@@ -160,14 +159,14 @@ import pandas as pd
 import random
 import shutil
 import sys
-import tarfile
 import time
 import traceback
 
 from argparse import ArgumentParser
 
-from pyani import (anib, anim, tetra, pyani_config, pyani_files,
-                   pyani_graphics, pyani_tools)
+from pyani import (anib, anim, tetra, pyani_archive, pyani_cache,
+                   pyani_config, pyani_files, pyani_graphics, pyani_store,
+                   pyani_tools)
 from pyani import run_multiprocessing as run_mp
 from pyani import run_sge
 from pyani.pyani_config import params_mpl, ALIGNDIR, FRAGSIZE, TETRA_FILESTEMS
@@ -184,8 +183,17 @@ def parse_cmdline():
                         action="store", default=None, required=True,
                         help="Output directory (required)")
     parser.add_argument("-i", "--indir", dest="indirname",
-                        action="store", default=None, required=True,
-                        help="Input directory name (required)")
+                        action="store", default=None,
+                        help="Input directory name (required, unless " +
+                        "--query_dir and --reference_dir are given)")
+    parser.add_argument("--query_dir", dest="query_dir",
+                        action="store", default=None,
+                        help="Directory of query genomes, compared only " +
+                        "against the genomes in --reference_dir")
+    parser.add_argument("--reference_dir", dest="reference_dir",
+                        action="store", default=None,
+                        help="Directory of reference genomes, compared " +
+                        "only against the genomes in --query_dir")
     parser.add_argument("-v", "--verbose", dest="verbose",
                         action="store_true", default=False,
                         help="Give verbose output")
@@ -214,6 +222,10 @@ def parse_cmdline():
     parser.add_argument("--nocompress", dest="nocompress",
                         action="store_true", default=False,
                         help="Don't compress/delete the comparison output")
+    parser.add_argument("--nosidecar", dest="nosidecar",
+                        action="store_true", default=False,
+                        help="Don't read or write binary sidecars of " +
+                        "parsed comparison output files")
     parser.add_argument("-g", "--graphics", dest="graphics",
                         action="store_true", default=False,
                         help="Generate heatmap of ANI")
@@ -243,6 +255,16 @@ def parse_cmdline():
                         action="store", default=None, type=int,
                         help="Number of worker processes for multiprocessing "
                         "(default zero, meaning use all available cores)")
+    parser.add_argument("--threads_per_job", dest="threads_per_job",
+                        action="store", default=None, type=int,
+                        help="Number of threads for each BLAST or NUCmer "
+                        "(MUMmer 4 only) job (default: with multiprocessing, "
+                        "share available cores between jobs; with SGE, one)")
+    parser.add_argument("--ingest_chunksize", dest="ingest_chunksize",
+                        action="store", default=None, type=int,
+                        help="Number of comparison output files passed to "
+                        "each worker process at a time when parsing results "
+                        "(default chosen automatically)")
     parser.add_argument("--SGEgroupsize", dest="sgegroupsize",
                         action="store", default=10000, type=int,
                         help="Number of jobs to place in an SGE array group "
@@ -259,6 +281,31 @@ def parse_cmdline():
     parser.add_argument("--filter_exe", dest="filter_exe",
                         action="store", default=pyani_config.FILTER_DEFAULT,
                         help="Path to delta-filter executable")
+    parser.add_argument("--filter_engine", dest="filter_engine",
+                        action="store",
+                        default=pyani_config.FILTER_ENGINE_DEFAULT,
+                        choices=pyani_config.FILTER_ENGINES,
+                        help="Engine for ANIm 1-to-1 alignment filter " +
+                        "(default delta-filter)")
+    parser.add_argument("--nucmer_batchsize", dest="nucmer_batchsize",
+                        action="store", default=None, type=int,
+                        help="Align each reference genome against batches " +
+                        "of up to this many query genomes in a single " +
+                        "NUCmer run (default one NUCmer run per comparison)")
+    parser.add_argument("--combined_blastdb", dest="combined_blastdb",
+                        action="store_true", default=False,
+                        help="ANIb only: build a single BLAST database of " +
+                        "all genomes, and run one BLASTN job per query " +
+                        "genome (default one BLASTN job per comparison)")
+    parser.add_argument("--reduce_blast", dest="reduce_blast",
+                        action="store_true", default=False,
+                        help="ANIb/ANIblastall: reduce BLAST output to " +
+                        "totals for each comparison as it is written, " +
+                        "rather than writing full .blast_tab files")
+    parser.add_argument("--keep_best_hits", dest="keep_best_hits",
+                        action="store_true", default=False,
+                        help="With --reduce_blast, also write the best " +
+                        "hit for each query fragment to .blast_tab files")
     parser.add_argument("--blastn_exe", dest="blastn_exe",
                         action="store", default=pyani_config.BLASTN_DEFAULT,
                         help="Path to BLASTN+ executable")
@@ -277,6 +324,11 @@ def parse_cmdline():
                         action="store_true",
                         default=False,
                         help="Write Excel format output tables")
+    parser.add_argument("--write_dataframes", dest="write_dataframes",
+                        action="store_true",
+                        default=False,
+                        help="Write the best BLAST hits for each ANIb " +
+                        "comparison to a .dataframe file (for debugging)")
     parser.add_argument("--rerender", dest="rerender",
                         action="store_true",
                         default=False,
@@ -291,6 +343,29 @@ def parse_cmdline():
     parser.add_argument("--jobprefix", dest="jobprefix",
                         action="store", default="ANI",
                         help="Prefix for SGE jobs (default ANI).")
+    parser.add_argument("--cache_dir", dest="cache_dir",
+                        action="store", default=None,
+                        help="Directory for a cache of pairwise comparison " +
+                        "results and TETRA signatures, reused between runs " +
+                        "(default no cache)")
+    parser.add_argument("--cache_max_size", dest="cache_max_size",
+                        action="store", default=None, type=int,
+                        help="Maximum size of the comparison result cache, " +
+                        "in MB (default no limit)")
+    parser.add_argument("--store_dir", dest="store_dir",
+                        action="store", default=None,
+                        help="Directory for a store of ANIb fragment files " +
+                        "and BLAST databases, reused between runs " +
+                        "(default no store)")
+    parser.add_argument("--store_max_size", dest="store_max_size",
+                        action="store", default=None, type=int,
+                        help="Maximum size of the ANIb fragment and BLAST " +
+                        "database store, in MB (default no limit)")
+    parser.add_argument("--tetra_prefilter", dest="tetra_prefilter",
+                        action="store", default=None, type=float,
+                        help="Only align ANIm/ANIb genome pairs with at " +
+                        "least this TETRA correlation; other pairs are " +
+                        "reported as not computed (default no prefilter)")
     return parser.parse_args()
 
 
@@ -348,16 +423,127 @@ def make_outdir():
 
 # Compress output directory and delete it
 def compress_delete_outdir(outdir):
-    """Compress the contents of the passed directory to .tar.gz and delete."""
-    # Compress output in .tar.gz file and remove raw output
-    tarfn = outdir + '.tar.gz'
-    logger.info("\tCompressing output from %s to %s", outdir, tarfn)
-    with tarfile.open(tarfn, "w:gz") as fh:
-        fh.add(outdir)
+    """Compress the contents of the passed directory to an archive and delete.
+
+    Files are compressed in parallel, and can be read back individually
+    from the archive (see pyani_archive). If the directory does not exist
+    (e.g. output was read from an existing archive), nothing is done.
+    """
+    if not os.path.isdir(outdir):
+        logger.info("\tNo output directory %s to compress", outdir)
+        return
+    logger.info("\tCompressing output from %s to %s", outdir,
+                pyani_archive.get_archive_path(outdir))
+    pyani_archive.archive_dir(outdir, workers=args.workers)
     logger.info("\tRemoving output directory %s", outdir)
     shutil.rmtree(outdir)
 
 
+# Open the cache of pairwise comparison results
+def open_cache(infiles, version_cmd):
+    """Returns (cache, genome hashes, tool version) for the current run.
+
+    - infiles - paths to each input file
+    - version_cmd - command-line reporting the alignment tool version
+    """
+    logger.info("Using comparison result cache in %s", args.cache_dir)
+    max_size = None
+    if args.cache_max_size is not None:
+        max_size = args.cache_max_size * 1024 * 1024
+    cache = pyani_cache.ResultCache(args.cache_dir, max_size)
+    logger.info("Calculating input file hashes")
+    hashes = pyani_cache.hash_files(infiles)
+    version = pyani_cache.get_tool_version(version_cmd)
+    logger.info("Alignment tool version: %s", version)
+    return cache, hashes, version
+
+
+# Choose the number of threads for each alignment job
+def get_threads_per_job(njobs):
+    """Returns the number of threads for each of njobs alignment jobs.
+
+    The --threads_per_job option is used if given. Otherwise, with
+    multiprocessing, cores are shared between the jobs, and SGE jobs use a
+    single thread.
+    """
+    if args.threads_per_job is not None:
+        threads = args.threads_per_job
+    elif args.scheduler == 'multiprocessing':
+        threads = run_mp.get_threads_per_job(njobs, args.workers)
+    else:
+        threads = 1
+    logger.info("Using %d thread(s) for each of %d jobs", threads, njobs)
+    return threads
+
+
+# Open the store of ANIb fragment files and BLAST databases
+def open_store():
+    """Returns the ArtefactStore for the current run."""
+    logger.info("Using fragment and BLAST database store in %s",
+                args.store_dir)
+    max_size = None
+    if args.store_max_size is not None:
+        max_size = args.store_max_size * 1024 * 1024
+    return pyani_store.ArtefactStore(args.store_dir, max_size)
+
+
+# Run NUCmer/delta-filter jobs with the selected scheduler
+def run_anim_jobs(joblist):
+    """Returns cumulative return value of the passed ANIm jobs.
+
+    - joblist - list of Jobs, which may have dependencies
+
+    The cumulative return value is always zero with SGE.
+    """
+    if args.scheduler == 'multiprocessing':
+        logger.info("Running jobs with multiprocessing")
+        if args.workers is None:
+            logger.info("(using maximum number of available " +
+                        "worker threads)")
+        else:
+            logger.info("(using %d worker threads, if available)",
+                        args.workers)
+        cumval = run_mp.run_dependency_graph(joblist,
+                                             workers=args.workers,
+                                             logger=logger)
+        logger.info("Cumulative return value: %d", cumval)
+        if 0 < cumval:
+            logger.warning("At least one NUCmer comparison failed. " +
+                           "ANIm may fail.")
+        else:
+            logger.info("All multiprocessing jobs complete.")
+        return cumval
+    logger.info("Running jobs with SGE")
+    logger.info("Jobarray group size set to %d", args.sgegroupsize)
+    run_sge.run_dependency_graph(joblist,
+                                 logger=logger,
+                                 jgprefix=args.jobprefix,
+                                 sgegroupsize=args.sgegroupsize,
+                                 sgeargs=args.sgeargs)
+    return 0
+
+
+# Get the comparisons to be made between input files
+def get_comparison_pairs(infiles, directional=False):
+    """Returns list of (query stem, subject stem) comparisons to be made.
+
+    - infiles - paths to each input file
+    - directional - if True, each comparison is listed in both directions
+
+    If --query_dir and --reference_dir are used, only query vs reference
+    comparisons are made, in that direction.
+    """
+    if query_labels is not None:
+        return [(qstem, rstem) for qstem in query_labels for
+                rstem in reference_labels]
+    pairs = [tuple(pyani_files.get_file_stem(fname) for fname in fpair)
+             for fpair in pyani_files.get_pairwise_files(infiles)]
+    if directional:
+        pairs = [pair for (stem1, stem2) in pairs for pair in
+                 ((stem1, stem2), (stem2, stem1))]
+    return pairs
+
+
 # Calculate ANIm for input
 def calculate_anim(infiles, org_lengths):
     """Returns ANIm result dataframes for files in input directory.
@@ -385,44 +571,84 @@ def calculate_anim(infiles, org_lengths):
     logger.info("Generating NUCmer command-lines")
     deltadir = os.path.join(args.outdirname, ALIGNDIR['ANIm'])
     logger.info("Writing nucmer output to %s", deltadir)
+    # Remove comparisons between dissimilar genomes, if prefiltering, then
+    # identify comparisons with results in the cache, if one is used
+    allpairs, prefiltered = prefilter_pairs(infiles,
+                                            get_comparison_pairs(infiles))
+    pairs = allpairs
+    if args.cache_dir:
+        cache, hashes, version = open_cache(infiles, [args.nucmer_exe,
+                                                      '--version'])
+        cache_params = {'maxmatch': args.maxmatch,
+                        'filter_engine': args.filter_engine}
+        pairs = pyani_cache.find_missing(cache, hashes, allpairs, "ANIm",
+                                         cache_params, version,
+                                         square=reference_labels is None)
+        logger.info("%d of %d comparisons found in cache",
+                    len(allpairs) - len(pairs), len(allpairs))
     # Schedule NUCmer runs
     if not args.skip_nucmer:
-        joblist = anim.generate_nucmer_jobs(infiles, args.outdirname,
-                                            nucmer_exe=args.nucmer_exe,
-                                            filter_exe=args.filter_exe,
-                                            maxmatch=args.maxmatch,
-                                            jobprefix=args.jobprefix)
-        if args.scheduler == 'multiprocessing':
-            logger.info("Running jobs with multiprocessing")
-            if args.workers is None:
-                logger.info("(using maximum number of available " +
-                            "worker threads)")
-            else:
-                logger.info("(using %d worker threads, if available)",
-                            args.workers)
-            cumval = run_mp.run_dependency_graph(joblist,
-                                                 workers=args.workers, 
-                                                 logger=logger)
-            logger.info("Cumulative return value: %d", cumval)
-            if 0 < cumval:
-                logger.warning("At least one NUCmer comparison failed. " +
-                               "ANIm may fail.")
-            else:
-                logger.info("All multiprocessing jobs complete.")
+        if args.nucmer_batchsize:
+            threads = get_threads_per_job(-(-len(pairs) //
+                                            args.nucmer_batchsize))
         else:
-            logger.info("Running jobs with SGE")
-            logger.info("Jobarray group size set to %d", args.sgegroupsize)
-            run_sge.run_dependency_graph(joblist,
-                                         logger=logger,
-                                         jgprefix=args.jobprefix,
-                                         sgegroupsize=args.sgegroupsize,
-                                         sgeargs=args.sgeargs)
+            threads = get_threads_per_job(len(pairs))
+        if threads > 1 and not anim.nucmer_supports_threads(args.nucmer_exe):
+            logger.info("NUCmer cannot use multiple threads (MUMmer 4 " +
+                        "required), using one thread for each job")
+            threads = 1
+        if args.nucmer_batchsize:
+            logger.info("Batching up to %d query genomes per NUCmer run",
+                        args.nucmer_batchsize)
+            joblist, batches = anim.generate_nucmer_batch_jobs(
+                infiles, args.outdirname, nucmer_exe=args.nucmer_exe,
+                maxmatch=args.maxmatch, jobprefix=args.jobprefix,
+                pairs=set(pairs), batchsize=args.nucmer_batchsize,
+                org_lengths=org_lengths, threads=threads)
+        else:
+            joblist = anim.generate_nucmer_jobs(
+                infiles, args.outdirname, nucmer_exe=args.nucmer_exe,
+                filter_exe=args.filter_exe, maxmatch=args.maxmatch,
+                jobprefix=args.jobprefix, filter_engine=args.filter_engine,
+                pairs=set(pairs), org_lengths=org_lengths, threads=threads)
+        cumval = run_anim_jobs(joblist)
+        # Split batched output into per-comparison .delta files, and
+        # filter these if delta-filter is used
+        if args.nucmer_batchsize:
+            logger.info("Splitting batched NUCmer output")
+            deltafiles = anim.split_batch_deltas(batches, deltadir)
+            shutil.rmtree(os.path.join(deltadir, pyani_config.BATCHDIR))
+            if args.filter_engine == 'delta-filter':
+                logger.info("Running delta-filter on split NUCmer output")
+                joblist = anim.generate_delta_filter_jobs(deltafiles,
+                                                          args.filter_exe,
+                                                          args.jobprefix)
+                cumval += run_anim_jobs(joblist)
     else:
         logger.warning("Skipping NUCmer run (as instructed)!")
 
     # Process resulting .delta files
     logger.info("Processing NUCmer .delta files.")
-    results = anim.process_deltadir(deltadir, org_lengths, logger=logger)
+    try:
+        results = anim.process_deltadir(deltadir, org_lengths, logger=logger,
+                                        workers=args.workers,
+                                        chunksize=args.ingest_chunksize,
+                                        filter_engine=args.filter_engine,
+                                        labels=query_labels,
+                                        columns=reference_labels,
+                                        sidecar=not args.nosidecar)
+    except ZeroDivisionError:
+        logger.error("One or more NUCmer output files has a problem.")
+        if not args.skip_nucmer:
+            if 0 < cumval:
+                logger.error("This is possibly due to NUCmer run failure, " +
+                             "please investigate")
+            else:
+                logger.error("This is possibly due to a NUCmer comparison " +
+                             "being too distant for use.")
+        logger.error(last_exception())
+        sys.exit(1)
+    results.add_not_computed(prefiltered, pyani_config.PREFILTERED)
     if results.zero_error:  # zero percentage identity error
         if not args.skip_nucmer and args.scheduler == 'multiprocessing':
             if 0 < cumval:
@@ -437,6 +663,18 @@ def calculate_anim(infiles, org_lengths):
                 logger.error("This is alternatively due to NUCmer run " +
                              "failure, analysis will continue, but please " +
                              "investigate.")
+    # Update the cache with new results, and add cached results
+    if args.cache_dir:
+        logger.info("Caching %d new comparison results",
+                    pyani_cache.store_results(cache, results, hashes, pairs,
+                                              cache_params, version,
+                                              org_lengths=org_lengths))
+        missing = set(pairs)
+        pyani_cache.fetch_results(cache, results, hashes,
+                                  [pair for pair in allpairs if
+                                   pair not in missing],
+                                  cache_params, version)
+        cache.close()
     if not args.nocompress:
         logger.info("Compressing/deleting %s", deltadir)
         compress_delete_outdir(deltadir)
@@ -465,19 +703,83 @@ def calculate_tetra(infiles):
     doi:10.1111/j.1462-2920.2004.00624.x
     """
     logger.info("Running TETRA.")
+    tetra_correlations = get_tetra_correlations(infiles)
+    if query_labels is not None:  # Only query vs reference comparisons
+        tetra_correlations = tetra_correlations.loc[query_labels,
+                                                    reference_labels]
+    return tetra_correlations
+
+
+# Calculate the TETRA correlation matrix for input
+def get_tetra_correlations(infiles):
+    """Returns TETRA correlation dataframe for all pairs of input files.
+
+    - infiles - paths to each input file
+
+    TETRA signatures are taken from (and added to) the signature cache,
+    if one is used.
+    """
     # First, find Z-scores
-    logger.info("Calculating TETRA Z-scores for each sequence.")
-    tetra_zscores = {}
-    for filename in infiles:
-        logger.info("Calculating TETRA Z-scores for %s", filename)
-        org = os.path.splitext(os.path.split(filename)[-1])[0]
-        tetra_zscores[org] = tetra.calculate_tetra_zscore(filename)
-    # Then calculate Pearson correlation between Z-scores for each sequence
-    logger.info("Calculating TETRA correlation scores.")
-    tetra_correlations = tetra.calculate_correlations(tetra_zscores)
+    if args.cache_dir:
+        # Only genomes without cached signatures need Z-scores calculated,
+        # and correlations are calculated from the cached signatures
+        logger.info("Using TETRA signature cache in %s", args.cache_dir)
+        sigcache = pyani_cache.SignatureCache(args.cache_dir)
+        logger.info("Calculating input file hashes")
+        hashes = pyani_cache.hash_files(infiles)
+        missing = [fname for fname in infiles if sigcache.get_row(
+            hashes[pyani_files.get_file_stem(fname)]) is None]
+        logger.info("%d of %d TETRA signatures found in cache",
+                    len(infiles) - len(missing), len(infiles))
+        logger.info("Calculating TETRA Z-scores for %d sequences.",
+                    len(missing))
+        for filename, zscores in zip(missing,
+                                     tetra.calculate_tetra_zscore_arrays(
+                                         missing, workers=args.workers)):
+            sigcache.put(hashes[pyani_files.get_file_stem(filename)],
+                         zscores)
+        sigcache.commit()
+        logger.info("Calculating TETRA correlation scores.")
+        orgs = sorted(hashes)
+        tetra_correlations = tetra.calculate_correlation_matrix(
+            orgs, sigcache.get([hashes[org] for org in orgs]))
+        sigcache.close()
+    else:
+        logger.info("Calculating TETRA Z-scores for each sequence.")
+        tetra_zscores = tetra.calculate_tetra_zscores(infiles,
+                                                      workers=args.workers)
+        # Then calculate Pearson correlation between Z-scores for each
+        # sequence
+        logger.info("Calculating TETRA correlation scores.")
+        tetra_correlations = tetra.calculate_correlations(tetra_zscores)
     return tetra_correlations
 
 
+# Remove comparisons between genomes with dissimilar TETRA signatures
+def prefilter_pairs(infiles, pairs):
+    """Returns (pairs to be aligned, prefiltered pairs).
+
+    - infiles - paths to each input file
+    - pairs - list of (query stem, subject stem) comparisons
+
+    If --tetra_prefilter is used, TETRA correlations are calculated for
+    the input files, and comparisons with a correlation below the
+    threshold are prefiltered: they are not aligned, and are reported as
+    not computed. Prefiltering comes before cache lookup, so that results
+    do not depend on the cache contents.
+    """
+    if args.tetra_prefilter is None:
+        return pairs, []
+    logger.info("Prefiltering comparisons with TETRA correlation < %s",
+                args.tetra_prefilter)
+    correlations = get_tetra_correlations(infiles)
+    pairs, prefiltered = tetra.filter_pairs(pairs, correlations,
+                                            args.tetra_prefilter)
+    logger.info("%d of %d comparisons prefiltered", len(prefiltered),
+                len(pairs) + len(prefiltered))
+    return pairs, prefiltered
+
+
 # Calculate ANIb for input
 def unified_anib(infiles, org_lengths):
     """Calculate ANIb for files in input directory.
@@ -514,19 +816,63 @@ def unified_anib(infiles, org_lengths):
     logger.info("Running %s", args.method)
     blastdir = os.path.join(args.outdirname, ALIGNDIR[args.method])
     logger.info("Writing BLAST output to %s", blastdir)
+    # Remove comparisons between dissimilar genomes, if prefiltering, then
+    # identify comparisons with results in the cache, if one is used; only
+    # input files in the remaining comparisons need be fragmented
+    allpairs, prefiltered = prefilter_pairs(
+        infiles, get_comparison_pairs(infiles, directional=True))
+    pairs = allpairs
+    if args.method == "ANIblastall":
+        version_cmd = [args.blastall_exe, '-']
+    else:
+        version_cmd = [args.blastn_exe, '-version']
+    if args.cache_dir:
+        cache, hashes, version = open_cache(infiles, version_cmd)
+        cache_params = anib.get_cache_params(args.fragsize,
+                                             args.combined_blastdb)
+        pairs = pyani_cache.find_missing(cache, hashes, allpairs,
+                                         args.method, cache_params, version,
+                                         sym=False)
+        logger.info("%d of %d comparisons found in cache",
+                    len(allpairs) - len(pairs), len(allpairs))
+    if args.cache_dir or prefiltered:
+        needed = set(stem for pair in pairs for stem in pair)
+        infiles = [fname for fname in infiles if
+                   pyani_files.get_file_stem(fname) in needed]
     # Build BLAST databases and run pairwise BLASTN
     if not args.skip_blastn:
+        # Link fragment files from the store, if one is used
+        if args.store_dir:
+            store = open_store()
+            if not args.cache_dir:
+                logger.info("Calculating input file hashes")
+                hashes = pyani_cache.hash_files(infiles)
+                version = pyani_cache.get_tool_version(version_cmd)
+            stored, fraglengths, missing = pyani_store.fetch_fragments(
+                store, infiles, hashes, blastdir, args.fragsize)
+            logger.info("%d of %d fragment files found in store",
+                        len(stored), len(infiles))
+        else:
+            stored, fraglengths, missing = {}, {}, infiles
         # Make sequence fragments
         logger.info("Fragmenting input files, and writing to %s",
                     args.outdirname)
         # Fraglengths does not get reused with BLASTN
-        fragfiles, fraglengths = anib.fragment_fasta_files(infiles,
-                                                           blastdir,
-                                                           args.fragsize)
-        # Export fragment lengths as JSON, in case we re-run with --skip_blastn
-        with open(os.path.join(blastdir,
-                               'fraglengths.json'), 'w') as outfile:
-            json.dump(fraglengths, outfile)
+        newfiles, newlengths = anib.fragment_fasta_files(missing, blastdir,
+                                                         args.fragsize,
+                                                         args.workers)
+        if args.store_dir:
+            pyani_store.store_fragments(store, newfiles, newlengths, hashes,
+                                        args.fragsize)
+        fraglengths.update(newlengths)
+        stored.update((anib.get_fragment_stem(fname), fname) for fname in
+                      newfiles)
+        fragfiles = [stored[pyani_files.get_file_stem(fname)] for fname in
+                     infiles]
+        # Export fragment lengths, in case we re-run with --skip_blastn
+        anib.write_fraglengths(fraglengths,
+                               os.path.join(blastdir,
+                                            pyani_config.FRAGLENGTHS_FILE))
 
         # Which executables are we using?
         #if args.method == "ANIblastall":
@@ -538,9 +884,35 @@ def unified_anib(infiles, org_lengths):
 
         # Run BLAST database-building and executables from a jobgraph
         logger.info("Creating job dependency graph")
-        jobgraph = anib.make_job_graph(infiles, fragfiles,
-                                       anib.make_blastcmd_builder(args.method,
-                                                                  blastdir))
+        if args.combined_blastdb:
+            logger.info("Using a combined BLAST database of all genomes")
+            threads = get_threads_per_job(len(set(qstem for qstem, _ in
+                                                  pairs)))
+            jobgraph, batches = anib.make_combined_jobs(
+                infiles, fragfiles, blastdir, pairs=set(pairs),
+                org_lengths=org_lengths, format_exe=args.makeblastdb_exe,
+                blast_exe=args.blastn_exe, threads=threads)
+        else:
+            threads = get_threads_per_job(len(pairs))
+            reducer = None
+            if args.reduce_blast:
+                logger.info("Reducing BLAST output as it is written")
+                reducer = {'hits': args.keep_best_hits}
+            blastcmds = anib.make_blastcmd_builder(args.method, blastdir,
+                                                   threads=threads,
+                                                   reducer=reducer)
+            # Link BLAST databases from the store, if one is used
+            prebuilt = set()
+            if args.store_dir:
+                prebuilt = pyani_store.fetch_blastdbs(store, infiles, hashes,
+                                                      blastcmds, args.method,
+                                                      version)
+                logger.info("%d of %d BLAST databases found in store",
+                            len(prebuilt), len(infiles))
+            jobgraph = anib.make_job_graph(infiles, fragfiles, blastcmds,
+                                           pairs=set(pairs),
+                                           org_lengths=org_lengths,
+                                           prebuilt=prebuilt)
         #jobgraph = anib.make_job_graph(infiles, fragfiles, blastdir,
         #                               format_exe, blast_exe, args.method,
         #                               jobprefix=args.jobprefix)
@@ -548,6 +920,7 @@ def unified_anib(infiles, org_lengths):
             logger.info("Running jobs with multiprocessing")
             logger.info("Running job dependency graph")
             cumval = run_mp.run_dependency_graph(jobgraph,
+                                                 workers=args.workers,
                                                  logger=logger)
             if 0 < cumval:
                 logger.warning("At least one BLAST run failed. " +
@@ -556,13 +929,34 @@ def unified_anib(infiles, org_lengths):
                 logger.info("All multiprocessing jobs complete.")
         else:
             run_sge.run_dependency_graph(jobgraph, logger=logger)
+            cumval = 0
             logger.info("Running jobs with SGE")
+        # Split combined BLASTN output into per-comparison .blast_tab files
+        if args.combined_blastdb:
+            logger.info("Splitting combined BLASTN output")
+            anib.split_combined_blast(batches, blastdir)
+            shutil.rmtree(os.path.join(blastdir, pyani_config.BATCHDIR))
+        elif args.store_dir:
+            logger.info("Storing %d new BLAST databases",
+                        pyani_store.store_blastdbs(
+                            store, [fname for fname in infiles if
+                                    blastcmds.get_db_name(fname) not in
+                                    prebuilt],
+                            hashes, blastcmds, args.method, version))
+        if args.store_dir:
+            store.close()
     else:
-        # Import fragment lengths from JSON
+        # Import fragment lengths, which may have been archived
+        # with the BLAST output
         if args.method == "ANIblastall":
-            with open(os.path.join(blastdir, 'fraglengths.json'),
-                      'rU') as infile:
-                fraglengths = json.load(infile)
+            if os.path.isdir(blastdir):
+                fragfile = os.path.join(blastdir,
+                                        pyani_config.FRAGLENGTHS_FILE)
+                archive = None
+            else:
+                fragfile = pyani_config.FRAGLENGTHS_FILE
+                archive = pyani_archive.get_archive_path(blastdir)
+            fraglengths = anib.read_fraglengths(fragfile, archive)
         else:
             fraglengths = None
         logger.warning("Skipping BLASTN runs (as instructed)!")
@@ -571,7 +965,14 @@ def unified_anib(infiles, org_lengths):
     logger.info("Processing pairwise %s BLAST output.", args.method)
     try:
         data = anib.process_blast(blastdir, org_lengths,
-                                  fraglengths=fraglengths, mode=args.method)
+                                  fraglengths=fraglengths, mode=args.method,
+                                  logger=logger, workers=args.workers,
+                                  chunksize=args.ingest_chunksize,
+                                  labels=query_labels,
+                                  columns=reference_labels,
+                                  sidecar=not args.nosidecar,
+                                  write_dataframes=args.write_dataframes,
+                                  reduced=args.reduce_blast)
     except ZeroDivisionError:
         logger.error("One or more BLAST output files has a problem.")
         if not args.skip_blastn:
@@ -582,6 +983,20 @@ def unified_anib(infiles, org_lengths):
                 logger.error("This is possibly due to a BLASTN comparison " +
                              "being too distant for use.")
         logger.error(last_exception())
+        sys.exit(1)
+    data.add_not_computed(prefiltered, pyani_config.PREFILTERED, sym=False)
+    # Update the cache with new results, and add cached results
+    if args.cache_dir:
+        logger.info("Caching %d new comparison results",
+                    pyani_cache.store_results(cache, data, hashes, pairs,
+                                              cache_params, version,
+                                              sym=False))
+        missing = set(pairs)
+        pyani_cache.fetch_results(cache, data, hashes,
+                                  [pair for pair in allpairs if
+                                   pair not in missing],
+                                  cache_params, version, sym=False)
+        cache.close()
     if not args.nocompress:
         logger.info("Compressing/deleting %s", blastdir)
         compress_delete_outdir(blastdir)
@@ -618,6 +1033,14 @@ def write(results):
             if args.write_excel:
                 dfr.to_excel(out_excel, index=True)
             dfr.to_csv(out_csv, index=True, sep="\t")
+        if results.not_computed:
+            filestem = "%s_%s" % (args.method,
+                                  pyani_config.NOT_COMPUTED_FILESTEM)
+            logger.info("\t%s (%d comparisons)", filestem,
+                        len(results.not_computed))
+            results.not_computed_table.to_csv(
+                os.path.join(args.outdirname, filestem) + '.tab',
+                index=False, sep="\t")
 
             
 # Draw ANIb/ANIm/TETRA output
@@ -633,6 +1056,10 @@ def draw(filestems, gformat):
         outfilename = fullstem + '.%s' % gformat
         infilename = fullstem + '.tab'
         df = pd.read_csv(infilename, index_col=0, sep="\t")
+        if df.isnull().values.any():  # e.g. prefiltered comparisons
+            logger.warning("Drawing comparisons not computed in %s as zero",
+                           infilename)
+            df = df.fillna(0)
         logger.info("Writing heatmap to %s", outfilename)
         params = pyani_graphics.Params(params_mpl(df)[filestem],
                                        pyani_tools.get_labels(args.labels),
@@ -721,10 +1148,26 @@ if __name__ == '__main__':
     logger.info("command-line: %s", ' '.join(sys.argv))
 
     # Have we got an input and output directory? If not, exit.
-    if args.indirname is None:
-        logger.error("No input directory name (exiting)")
-        sys.exit(1)
-    logger.info("Input directory: %s", args.indirname)
+    # Query and reference directories replace the input directory, and
+    # restrict comparisons to query vs reference genomes
+    if args.query_dir or args.reference_dir:
+        if args.query_dir is None or args.reference_dir is None:
+            logger.error("--query_dir and --reference_dir must be used " +
+                         "together (exiting)")
+            sys.exit(1)
+        if args.indirname is not None:
+            logger.error("-i/--indir cannot be used with --query_dir " +
+                         "and --reference_dir (exiting)")
+            sys.exit(1)
+        indirs = [args.query_dir, args.reference_dir]
+        logger.info("Query directory: %s", args.query_dir)
+        logger.info("Reference directory: %s", args.reference_dir)
+    else:
+        if args.indirname is None:
+            logger.error("No input directory name (exiting)")
+            sys.exit(1)
+        indirs = [args.indirname]
+        logger.info("Input directory: %s", args.indirname)
     if args.outdirname is None:
         logger.error("No output directory name (exiting)")
         sys.exit(1)
@@ -735,7 +1178,9 @@ if __name__ == '__main__':
 
     # Check for the presence of space characters in any of the input filenames
     # or output directory. If we have any, abort here and now.
-    filenames = [args.outdirname] + os.listdir(args.indirname)
+    filenames = [args.outdirname]
+    for indir in indirs:
+        filenames.extend(os.listdir(indir))
     for fname in filenames:
         if ' ' in  os.path.abspath(fname):
             logger.error("File or directory '%s' contains whitespace", fname)
@@ -763,6 +1208,16 @@ if __name__ == '__main__':
         logger.error("Valid methods are: %s", list(methods.keys()))
         sys.exit(1)
     logger.info("Using ANI method: %s", args.method)
+    if args.combined_blastdb and args.method != "ANIb":
+        logger.error("--combined_blastdb can only be used with ANIb " +
+                     "(exiting)")
+        sys.exit(1)
+    if args.reduce_blast and args.combined_blastdb:
+        logger.error("--reduce_blast cannot be used with " +
+                     "--combined_blastdb (exiting)")
+        sys.exit(1)
+    if args.tetra_prefilter is not None and args.method == "TETRA":
+        logger.warning("--tetra_prefilter has no effect with TETRA")
 
     # Skip calculations (or not) depending on rerender option
     if args.rerender:
@@ -779,15 +1234,33 @@ if __name__ == '__main__':
         logger.info("Using scheduler method: %s", args.scheduler)
         
         # Get input files
-        logger.info("Identifying FASTA files in %s", args.indirname)
-        infiles = pyani_files.get_fasta_files(args.indirname)
+        for indir in indirs:
+            logger.info("Identifying FASTA files in %s", indir)
+        infiles = pyani_files.get_fasta_files(indirs[0])
         logger.info("Input files:\n\t%s", '\n\t'.join(infiles))
 
-        # Are we subsampling? If so, make the selection here
+        # Are we subsampling? If so, make the selection here; only query
+        # genomes are subsampled
         if args.subsample:
             infiles = subsample_input(infiles)
             logger.info("Sampled input files:\n\t%s", '\n\t'.join(infiles))
 
+        # Reference genomes follow the query genomes, so that comparison
+        # output files are named query_vs_reference
+        query_labels, reference_labels = None, None
+        if args.query_dir:
+            reffiles = pyani_files.get_fasta_files(args.reference_dir)
+            logger.info("Reference files:\n\t%s", '\n\t'.join(reffiles))
+            query_labels = [pyani_files.get_file_stem(fname) for
+                            fname in infiles]
+            reference_labels = [pyani_files.get_file_stem(fname) for
+                                fname in reffiles]
+            if set(query_labels).intersection(reference_labels):
+                logger.error("Query and reference genomes must have " +
+                             "distinct file names (exiting)")
+                sys.exit(1)
+            infiles = infiles + reffiles
+
         # Get lengths of input sequences
         logger.info("Processing input sequence lengths")
         org_lengths = pyani_files.get_sequence_lengths(infiles)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+#
+# blast_reducer_wrapper.py
+#
+# This script is a wrapper for BLASTN+ and legacy BLASTN (blastall)
+# commands, used by pyani to reduce ANIb BLAST output as it is written.
+# It runs the BLAST command, which must write tabular output to STDOUT,
+# and passes that output line by line through a pipe to
+# pyani.anib.reduce_blast_tab(). Only the ANIb totals for the comparison
+# (and, optionally, the best hit for each query fragment) are written to
+# disk, rather than the full BLAST output. As with
+# delta_filter_wrapper.py, no shell redirection is needed, so that the
+# command can be run on SGE/OGE scheduling systems.
+#
+# The wrapper is called with its options, the path to the output
+# .blast_totals file, and then the BLAST command. For example, the
+# BLASTN+ command
+#
+# blastn -out <blast_tab file> [options]
+#
+# becomes
+#
+# blast_reducer_wrapper.py --mode ANIb <blast_totals file> blastn [options]
+#
+# and, for blastall output, the fragmented query FASTA file must also be
+# given with --fragments, so that fragment lengths can be read. The
+# wrapper exits with the return code of the BLAST command; totals are
+# only written if this is zero.
+#
+# (c) The James Hutton Institute 2017
+# Author: Leighton Pritchard
+#
+# Contact:
+# leighton.pritchard@hutton.ac.uk
+#
+# Leighton Pritchard,
+# Information and Computing Sciences,
+# James Hutton Institute,
+# Errol Road,
+# Invergowrie,
+# Dundee,
+# DD6 9LH,
+# Scotland,
+# UK
+#
+# The MIT License
+#
+# Copyright (c) 2017 The James Hutton Institute
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import argparse
+import subprocess
+import sys
+
+from pyani import anib
+
+
+# Parse command-line
+parser = argparse.ArgumentParser(prog="blast_reducer_wrapper.py")
+parser.add_argument("--mode", dest="mode", action="store", default="ANIb",
+                    choices=["ANIb", "ANIblastall"],
+                    help="BLASTN+ (ANIb) or BLASTALL (ANIblastall) output")
+parser.add_argument("--fragments", dest="fragments", action="store",
+                    default=None,
+                    help="Fragmented query FASTA file (ANIblastall only)")
+parser.add_argument("--hits", dest="hits", action="store", default=None,
+                    help="Write the best hit for each query fragment to " +
+                    "this .blast_tab file")
+parser.add_argument("--identity", dest="identity", action="store",
+                    default=0.3, type=float,
+                    help="Minimum identity of a hit (default 0.3)")
+parser.add_argument("--coverage", dest="coverage", action="store",
+                    default=0.7, type=float,
+                    help="Minimum coverage of a hit (default 0.7)")
+parser.add_argument("outfname", help="Path to the output .blast_totals file")
+parser.add_argument("blastcmd", nargs=argparse.REMAINDER,
+                    help="BLAST command, writing tabular output to STDOUT")
+args = parser.parse_args()
+
+fraglengths = None
+if args.mode == "ANIblastall":
+    fraglengths = anib.get_fragment_lengths(args.fragments)
+
+# Run BLAST, reducing its output as it is written
+hitsfh = None
+if args.hits is not None:
+    hitsfh = open(args.hits, 'w')
+proc = subprocess.Popen(args.blastcmd, stdout=subprocess.PIPE,
+                        universal_newlines=True)
+totals = anib.reduce_blast_tab(proc.stdout, args.identity, args.coverage,
+                               args.mode, fraglengths, hitsfh)
+if hitsfh is not None:
+    hitsfh.close()
+if proc.wait():
+    sys.exit(proc.returncode)
+anib.write_blast_totals(args.outfname, totals, args.identity, args.coverage)
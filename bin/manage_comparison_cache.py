@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+#
+# manage_comparison_cache.py
+#
+# Copyright 2017, The James Hutton Insitute
+# Author: Leighton Pritchard
+#
+# This code is part of the pyani package, and is governed by its licence.
+# Please see the LICENSE file that should have been included as part of
+# this package.
+"""A script to inspect and prune a pyani comparison result cache
+
+The cache is created by average_nucleotide_identity.py when the --cache_dir
+option is used. This script reports on the cache contents (info, list),
+evicts least recently used entries until the cache is within a size limit
+(prune), or removes all entries (clear).
+"""
+
+import sys
+import time
+
+from argparse import ArgumentParser
+
+from pyani import pyani_cache
+from pyani import __version__ as VERSION
+
+
+# Process command-line arguments
+def parse_cmdline():
+    """Parse command-line arguments for script."""
+    parser = ArgumentParser(prog="manage_comparison_cache.py")
+    parser.add_argument('--version', action='version',
+                        version='%(prog)s: pyani ' + VERSION)
+    parser.add_argument("cache_dir", action="store",
+                        help="Comparison result cache directory")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+    subparsers.add_parser("info", help="Summarise cache contents")
+    subparsers.add_parser("list", help="List cached comparisons")
+    prune = subparsers.add_parser("prune",
+                                  help="Evict least recently used entries")
+    prune.add_argument("--max_size", dest="max_size",
+                       action="store", required=True, type=int,
+                       help="Maximum size of the cache, in MB")
+    subparsers.add_parser("clear", help="Remove all cached comparisons")
+    return parser.parse_args()
+
+
+# Run as script
+if __name__ == '__main__':
+
+    # Parse command-line
+    args = parse_cmdline()
+    cache = pyani_cache.ResultCache(args.cache_dir)
+
+    if args.command == "info":
+        info = cache.info()
+        sys.stdout.write("Cache database: %s\n" % info['path'])
+        sys.stdout.write("Cached comparisons: %d\n" % info['entries'])
+        sys.stdout.write("Stored data size: %d bytes\n" % info['size'])
+        sys.stdout.write("Database file size: %d bytes\n" % info['file_size'])
+    elif args.command == "list":
+        sys.stdout.write('\t'.join(["genome_a", "genome_b", "method",
+                                    "params", "version", "size",
+                                    "accessed"]) + '\n')
+        for entry in cache.entries():
+            accessed = time.strftime("%Y-%m-%d %H:%M:%S",
+                                     time.localtime(entry[-1]))
+            sys.stdout.write('\t'.join([str(val) for val in entry[:-1]] +
+                                       [accessed]) + '\n')
+    elif args.command == "prune":
+        count = cache.prune(args.max_size * 1024 * 1024)
+        sys.stdout.write("Evicted %d cached comparisons\n" % count)
+    elif args.command == "clear":
+        cache.clear()
+        sys.stdout.write("Removed all cached comparisons\n")
+    cache.close()
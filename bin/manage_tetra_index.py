@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+#
+# manage_tetra_index.py
+#
+# Copyright 2017, The James Hutton Insitute
+# Author: Leighton Pritchard
+#
+# This code is part of the pyani package, and is governed by its licence.
+# Please see the LICENSE file that should have been included as part of
+# this package.
+"""A script to build and search a pyani TETRA nearest-neighbour index
+
+The index holds normalised TETRA Z-score vectors for a collection of
+reference genomes (see pyani.tetra.TetraIndex). This script adds genome
+FASTA files (or all FASTA files in a directory) to the index (add),
+reports the k indexed genomes whose TETRA signatures are most correlated
+with each query genome (query), or summarises the index (info).
+"""
+
+import os
+import sys
+
+from argparse import ArgumentParser
+
+from pyani import pyani_files, tetra
+from pyani import __version__ as VERSION
+
+
+# Process command-line arguments
+def parse_cmdline():
+    """Parse command-line arguments for script."""
+    parser = ArgumentParser(prog="manage_tetra_index.py")
+    parser.add_argument('--version', action='version',
+                        version='%(prog)s: pyani ' + VERSION)
+    parser.add_argument("index_dir", action="store",
+                        help="TETRA index directory")
+    parser.add_argument("--workers", dest="workers",
+                        action="store", default=None, type=int,
+                        help="Number of worker processes for Z-score " +
+                        "calculation (default all cores)")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+    subparsers.add_parser("info", help="Summarise index contents")
+    add = subparsers.add_parser("add", help="Add genomes to the index")
+    add.add_argument("infiles", nargs="+",
+                     help="Genome FASTA files, or directories of them")
+    query = subparsers.add_parser("query",
+                                  help="Find the most correlated genomes")
+    query.add_argument("infiles", nargs="+",
+                       help="Query genome FASTA files, or directories of them")
+    query.add_argument("-k", dest="k", action="store", default=10, type=int,
+                       help="Number of genomes to report per query " +
+                       "(default 10)")
+    return parser.parse_args()
+
+
+# Expand directories in a list of input paths to the FASTA files they hold
+def get_infiles(paths):
+    """Returns list of FASTA files named by, or in, the passed paths."""
+    infiles = []
+    for path in paths:
+        if os.path.isdir(path):
+            infiles.extend(sorted(pyani_files.get_fasta_files(path)))
+        else:
+            infiles.append(path)
+    return infiles
+
+
+# Run as script
+if __name__ == '__main__':
+
+    # Parse command-line
+    args = parse_cmdline()
+    index = tetra.TetraIndex(args.index_dir)
+
+    if args.command == "info":
+        sys.stdout.write("Index directory: %s\n" % args.index_dir)
+        sys.stdout.write("Indexed genomes: %d\n" % len(index))
+    elif args.command == "add":
+        labels = index.add_files(get_infiles(args.infiles), args.workers)
+        sys.stdout.write("Added %d genomes (%d indexed)\n" %
+                         (len(labels), len(index)))
+    elif args.command == "query":
+        infiles = get_infiles(args.infiles)
+        sys.stdout.write('\t'.join(["query", "rank", "genome",
+                                    "correlation"]) + '\n')
+        for infile, zscores in zip(infiles,
+                                   tetra.calculate_tetra_zscore_arrays(
+                                       infiles, args.workers)):
+            qname = pyani_files.get_file_stem(infile)
+            for rank, (label, corr) in enumerate(index.query(zscores,
+                                                             args.k), 1):
+                sys.stdout.write("%s\t%d\t%s\t%s\n" % (qname, rank, label,
+                                                       corr))
+    index.close()
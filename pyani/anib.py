@@ -83,26 +83,62 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 """
 
+import array
+import functools
+import io
+import multiprocessing
 import os
 import shutil
+import warnings
 
+import numpy as np
 import pandas as pd
 
-from Bio import SeqIO
+from Bio.SeqIO.FastaIO import SimpleFastaParser
 
+from . import anim
+from . import pyani_archive
 from . import pyani_config
 from . import pyani_files
+from . import pyani_ingest
 from . import pyani_jobs
 from .pyani_tools import ANIResults, BLASTcmds, BLASTexes, BLASTfunctions
 
 
+# Layout of per-hit records parsed from .blast_tab files. The fragment
+# field numbers query fragments in the sorted order of their IDs; the
+# remaining fields are the BLAST alignment length, mismatch and gap
+# counts, query fragment length and percentage identity.
+BLAST_DTYPE = [('fragment', np.int64), ('alnlen', np.int64),
+               ('mismatch', np.int64), ('gaps', np.int64),
+               ('qlen', np.int64), ('pid', np.float64)]
+
+# Width of the byte strings that query IDs are read into from .blast_tab
+# files; IDs must be shorter than this
+QID_WIDTH = 64
+
+# Prefix of the fragNNNNN IDs given to sequence fragments; fragments are
+# numbered from 1 within each fragmented file
+FRAGMENT_PREFIX = 'frag'
+
+# Tabular output fields for BLASTN+ runs; parse_blast_tab() reads these
+# by position
+BLASTN_FIELDS = "qseqid sseqid length mismatch pident nident qlen slen " +\
+    "qstart qend sstart send positive ppos gaps"
+
+# E-value threshold of BLASTN+ runs
+BLASTN_EVALUE = 1e-15
+
+
 # Divide input FASTA sequences into fragments
-def fragment_fasta_files(infiles, outdirname, fragsize):
+def fragment_fasta_files(infiles, outdirname, fragsize, workers=None):
     """Chops sequences of the passed files into fragments, returns filenames.
 
     - infiles - paths to each input sequence file
     - outdirname - path to output directory
     - fragsize - the size of sequence fragments
+    - workers - number of worker processes (None: all available cores;
+      1: fragment files in the calling process)
 
     Takes every sequence from every file in infiles, and splits them into
     consecutive fragments of length fragsize, (with any trailing sequences
@@ -110,24 +146,68 @@ def fragment_fasta_files(infiles, outdirname, fragsize):
     set of sequences to a file with the same name in the output directory.
     All fragments are named consecutively and uniquely (within a file) as
     fragNNNNN. Sequence description fields are retained.
+
+    Files are fragmented in parallel by fragment_fasta_file(), and the
+    fragment lengths recorded as they are written. Returns the output
+    filenames, and a dictionary of fragment length arrays (as returned by
+    get_fraglength_dict()).
     """
-    outfnames = []
-    for fname in infiles:
-        outstem, outext = os.path.splitext(os.path.split(fname)[-1])
-        outfname = os.path.join(outdirname, outstem) + '-fragments' + outext
-        outseqs = []
-        count = 0
-        for seq in SeqIO.parse(fname, 'fasta'):
-            idx = 0
-            while idx < len(seq):
-                count += 1
-                newseq = seq[idx:idx+fragsize]
-                newseq.id = "frag%05d" % count
-                outseqs.append(newseq)
-                idx += fragsize
-        outfnames.append(outfname)
-        SeqIO.write(outseqs, outfname, 'fasta')
-    return outfnames, get_fraglength_dict(outfnames)
+    tasks = [(fname, outdirname, fragsize) for fname in infiles]
+    if workers == 1 or len(tasks) < 2:
+        results = [fragment_fasta_file(*task) for task in tasks]
+    else:
+        with multiprocessing.Pool(processes=workers) as pool:
+            results = pool.starmap(fragment_fasta_file, tasks)
+    outfnames = [outfname for outfname, _ in results]
+    fraglength_dict = {os.path.split(outfname)[-1].split('-fragments')[0]:
+                       fraglengths for outfname, fraglengths in results}
+    return outfnames, fraglength_dict
+
+
+# Divide the sequences of a single FASTA file into fragments
+def fragment_fasta_file(infile, outdirname, fragsize):
+    """Returns (output filename, fragment lengths) for a fragmented file.
+
+    - infile - path to the input sequence file
+    - outdirname - path to output directory
+    - fragsize - the size of sequence fragments
+
+    Fragments are written as they are generated by iter_fragments(), in
+    FASTA format with 60-character sequence lines, so that only a single
+    input sequence is held in memory at a time. Fragment lengths are
+    returned as an array indexed by fragment ordinal (see
+    get_fragment_lengths()).
+    """
+    outstem, outext = os.path.splitext(os.path.split(infile)[-1])
+    outfname = os.path.join(outdirname, outstem) + '-fragments' + outext
+    fraglengths = array.array('i')
+    with open(infile, 'r') as ifh, open(outfname, 'w') as ofh:
+        for fragid, title, frag in iter_fragments(ifh, fragsize):
+            ofh.write(">%s\n" % ' '.join([fragid, title]).rstrip())
+            ofh.writelines(frag[idx:idx + 60] + '\n' for idx in
+                           range(0, len(frag), 60))
+            fraglengths.append(len(frag))
+    return outfname, np.frombuffer(fraglengths, dtype=np.int32).copy()
+
+
+# Generate fragments of the sequences in a FASTA file
+def iter_fragments(handle, fragsize):
+    """Yields (fragment ID, description, sequence) for each fragment.
+
+    - handle - open FASTA file handle
+    - fragsize - the size of sequence fragments
+
+    Each sequence is sliced into consecutive fragments of length fragsize,
+    the last of which may be shorter. Fragments are numbered from 1 as
+    fragNNNNN across the whole file, and carry the header line of the
+    sequence they came from as a description.
+    """
+    count = 0
+    for title, seq in SimpleFastaParser(handle):
+        for idx in range(0, len(seq), fragsize):
+            count += 1
+            yield "%s%05d" % (FRAGMENT_PREFIX, count), title, \
+                seq[idx:idx + fragsize]
 
 
 # Get lengths of all sequences in all files
@@ -136,9 +216,10 @@ def get_fraglength_dict(fastafiles):
 
     - fastafiles - list of FASTA input whole sequence files
 
-    Loops over input files and, for each, produces a dictionary with fragment
-    lengths, keyed by sequence ID. These are returned as a dictionary with
-    the keys being query IDs derived from filenames.
+    Loops over input files and, for each, produces an array of fragment
+    lengths, indexed by fragment ordinal (see get_fragment_lengths()).
+    These are returned as a dictionary with the keys being query IDs
+    derived from filenames.
     """
     fraglength_dict = {}
     for filename in fastafiles:
@@ -149,35 +230,93 @@ def get_fraglength_dict(fastafiles):
 
 # Get lengths of all sequences in a file
 def get_fragment_lengths(fastafile):
-    """Returns dictionary of sequence fragment lengths, keyed by fragment ID.
+    """Returns array of sequence fragment lengths, indexed by ordinal.
 
-    Biopython's SeqIO module is used to parse all sequences in the FASTA
-    file.
+    The length of fragment fragNNNNN is held at index NNNNN - 1 (see
+    get_fragment_ordinals()); any missing fragments have length zero.
 
     NOTE: ambiguity symbols are not discounted.
     """
-    fraglengths = {}
-    for seq in SeqIO.parse(fastafile, 'fasta'):
-        fraglengths[seq.id] = len(seq)
+    fragids, lengths = [], []
+    with open(fastafile, 'r') as ifh:
+        for title, seq in SimpleFastaParser(ifh):
+            fragids.append(title.split(None, 1)[0])
+            lengths.append(len(seq))
+    ordinals = get_fragment_ordinals(fragids)
+    fraglengths = np.zeros(ordinals.max() + 1 if len(ordinals) else 0,
+                           dtype=np.int32)
+    fraglengths[ordinals] = lengths
     return fraglengths
 
 
+# Get the ordinals of fragment IDs
+def get_fragment_ordinals(fragids):
+    """Returns array of zero-based ordinals for fragNNNNN fragment IDs."""
+    return pd.Index(fragids, dtype=object).str.slice(
+        len(FRAGMENT_PREFIX)).astype(np.int64).values - 1
+
+
+# Write fragment lengths for several genomes to a binary file
+def write_fraglengths(fraglengths, filename):
+    """Writes a dictionary of fragment length arrays to a .npz file.
+
+    - fraglengths - dictionary of fragment length arrays, keyed by query
+      name, as returned by fragment_fasta_files()
+    - filename - path to the output file
+    """
+    with open(filename, 'wb') as ofh:
+        np.savez(ofh, **fraglengths)
+
+
+# Read fragment lengths for several genomes from a binary file
+def read_fraglengths(filename, archive=None):
+    """Returns dictionary of fragment length arrays from a .npz file.
+
+    - filename - path to the file written by write_fraglengths()
+    - archive - path to an archive of BLAST output holding the file (see
+      pyani_archive.open_file()), or None to read the file from disk
+    """
+    with pyani_archive.open_file(filename, archive, binary=True) as ifh:
+        with np.load(io.BytesIO(ifh.read()), allow_pickle=False) as data:
+            return {qname: data[qname] for qname in data.files}
+
+
 # Create dictionary of database building commands, keyed by dbname
-def build_db_jobs(infiles, blastcmds):
-    """Returns dictionary of db-building commands, keyed by dbname."""
+def build_db_jobs(infiles, blastcmds, org_lengths=None, prebuilt=None):
+    """Returns dictionary of db-building commands, keyed by dbname.
+
+    - infiles - a list of paths to input FASTA files
+    - blastcmds - BLASTcmds object for construction of commands
+    - org_lengths - dictionary of sequence lengths, keyed by file stem,
+      used as the cost of each job
+    - prebuilt - collection of names of databases that already exist
+      (e.g. linked from a pyani_store.ArtefactStore); no jobs are made
+      for these
+    """
     dbjobdict = {}  # Dict of database construction jobs, keyed by filename
     # Create dictionary of database building jobs, keyed by db name
     # defining jobnum for later use as last job index used
     for idx, fname in enumerate(infiles):
+        if prebuilt is not None and blastcmds.get_db_name(fname) in prebuilt:
+            continue
+        cost = 0
+        if org_lengths is not None:
+            cost = org_lengths[pyani_files.get_file_stem(fname)]
         dbjobdict[blastcmds.get_db_name(fname)] = \
                 pyani_jobs.Job("%s_db_%06d" % (blastcmds.prefix, idx),
-                               blastcmds.build_db_cmd(fname))
+                               blastcmds.build_db_cmd(fname), cost=cost)
     return dbjobdict
 
 
 def make_blastcmd_builder(mode, outdir, format_exe=None, blast_exe=None,
-                          prefix="ANIBLAST"):
-    """Returns BLASTcmds object for construction of BLAST commands."""
+                          prefix="ANIBLAST", threads=1, reducer=None):
+    """Returns BLASTcmds object for construction of BLAST commands.
+
+    - threads - number of threads for each BLAST run
+    - reducer - if not None, a dictionary of keyword arguments for
+      construct_reducer_cmdline(), and BLAST output is reduced as it is
+      written (see reduce_blast_tab())
+    """
     if mode == "ANIb":  # BLAST/formatting executable depends on mode
         blastcmds = BLASTcmds(BLASTfunctions(construct_makeblastdb_cmd,
                                              construct_blastn_cmdline),
@@ -185,7 +324,7 @@ def make_blastcmd_builder(mode, outdir, format_exe=None, blast_exe=None,
                                         pyani_config.MAKEBLASTDB_DEFAULT,
                                         blast_exe or \
                                         pyani_config.BLASTN_DEFAULT),
-                              prefix, outdir)
+                              prefix, outdir, threads, reducer)
     else:
         blastcmds = BLASTcmds(BLASTfunctions(construct_formatdb_cmd,
                                              construct_blastall_cmdline),
@@ -193,16 +332,25 @@ def make_blastcmd_builder(mode, outdir, format_exe=None, blast_exe=None,
                                         pyani_config.FORMATDB_DEFAULT,
                                         blast_exe or \
                                         pyani_config.BLASTALL_DEFAULT),
-                              prefix, outdir)
+                              prefix, outdir, threads, reducer)
     return blastcmds
 
 
 # Make a dependency graph of BLAST commands
-def make_job_graph(infiles, fragfiles, blastcmds):
+def make_job_graph(infiles, fragfiles, blastcmds, pairs=None,
+                   org_lengths=None, prebuilt=None):
     """Return a job dependency graph, based on the passed input sequence files.
 
     - infiles - a list of paths to input FASTA files
     - fragfiles - a list of paths to fragmented input FASTA files
+    - pairs - collection of (query stem, subject stem) comparisons to be
+      run; None for all comparisons, in both directions
+    - org_lengths - dictionary of sequence lengths, keyed by file stem, used
+      to estimate the cost of each job; the cost of a BLAST job is the
+      product of the query and subject lengths, as every query fragment
+      is searched against the whole subject database
+    - prebuilt - collection of names of databases that already exist; BLAST
+      jobs against these have no database-building dependency
 
     By default, will run ANIb - it *is* possible to make a mess of passing the
     wrong executable for the mode you're using.
@@ -216,7 +364,7 @@ def make_job_graph(infiles, fragfiles, blastcmds):
     joblist = []    # Holds list of job dependency graphs
 
     # Get dictionary of database-building jobs
-    dbjobdict = build_db_jobs(infiles, blastcmds)
+    dbjobdict = build_db_jobs(infiles, blastcmds, org_lengths, prebuilt)
 
     # Create list of BLAST executable jobs, with dependencies
     jobnum = len(dbjobdict)
@@ -228,20 +376,128 @@ def make_job_graph(infiles, fragfiles, blastcmds):
                                 (blastcmds.prefix, jobnum),
                                 blastcmds.build_blast_cmd(fname1,
                                                           fname2.replace\
-                                                          ('-fragments', ''))),
+                                                          ('-fragments', '')),
+                                threads=blastcmds.threads),
                  pyani_jobs.Job("%s_exe_%06d_b" %
                                 (blastcmds.prefix, jobnum),
                                 blastcmds.build_blast_cmd(fname2,
                                                           fname1.replace\
-                                                          ('-fragments', '')))]
-            jobs[0].add_dependency(dbjobdict[fname1.replace('-fragments', '')])
-            jobs[1].add_dependency(dbjobdict[fname2.replace('-fragments', '')])
+                                                          ('-fragments', '')),
+                                threads=blastcmds.threads)]
+            for job, dbname in zip(jobs,
+                                   (fname2.replace('-fragments', ''),
+                                    fname1.replace('-fragments', ''))):
+                if dbname in dbjobdict:
+                    job.add_dependency(dbjobdict[dbname])
+            stem1, stem2 = get_fragment_stem(fname1), get_fragment_stem(fname2)
+            if org_lengths is not None:
+                for job in jobs:
+                    job.cost = org_lengths[stem1] * org_lengths[stem2]
+            if pairs is not None:  # keep only the requested comparisons
+                jobs = [job for job, pair in
+                        zip(jobs, ((stem1, stem2), (stem2, stem1)))
+                        if pair in pairs]
             joblist.extend(jobs)
 
     # Return the dependency graph
     return joblist
 
 
+# Make a list of BLASTN jobs against a single combined database
+def make_combined_jobs(infiles, fragfiles, outdir, pairs=None,
+                       org_lengths=None,
+                       format_exe=pyani_config.MAKEBLASTDB_DEFAULT,
+                       blast_exe=pyani_config.BLASTN_DEFAULT,
+                       prefix="ANIBLAST", threads=1):
+    """Return (Jobs, batches) describing ANIb runs against a combined database.
+
+    - infiles - a list of paths to input FASTA files
+    - fragfiles - a list of paths to fragmented input FASTA files
+    - outdir - path to the BLAST output directory
+    - pairs - collection of (query stem, subject stem) comparisons to be
+      run; None for all comparisons, in both directions
+    - org_lengths - dictionary of sequence lengths, keyed by file stem, used
+      to estimate the cost of each job
+    - format_exe - path to the makeblastdb executable
+    - blast_exe - path to the BLASTN executable
+    - prefix - prefix for Job names
+    - threads - number of threads for each BLASTN run
+
+    Rather than building a database for each genome, and running BLASTN
+    once per comparison, a single BLAST+ database is built from all subject
+    genomes, with sequence headers tagged by the file stem of their genome
+    (see anim.write_batch_fasta()). Each fragmented query genome is then
+    searched against this database in a single BLASTN run, reporting hits
+    to every database sequence, and the output must be split into
+    per-comparison .blast_tab files with split_combined_blast() before it
+    is parsed.
+
+    E-values are calculated with -dbsize set to the smallest subject genome,
+    and rescaled to each subject genome by split_combined_blast(), so are
+    not identical to those of pairwise runs where database composition
+    statistics differ. Sequence lengths are read from the input files if
+    org_lengths is not given.
+
+    The combined database and BLASTN output are written to a subdirectory
+    of the BLAST output directory. All returned Jobs are BLASTN jobs, with
+    the database-building Job as their dependency. The returned batches
+    are (combined .blast_tab path, query stem, subject stems, E-value
+    scales) tuples, for use with split_combined_blast(); the E-value scales
+    are the ratios of each subject genome's length to the database size.
+    A ValueError is raised if a file stem contains
+    pyani_config.BATCH_TAG_SEP.
+    """
+    batchdir = os.path.join(outdir, pyani_config.BATCHDIR)
+    os.makedirs(batchdir, exist_ok=True)
+    stems = [pyani_files.get_file_stem(fname) for fname in infiles]
+    anim.check_batch_stems(stems)
+    subjects = {}  # query stem: subject stems, in input order
+    for qstem in stems:
+        subjects[qstem] = tuple(stem for stem in stems if stem != qstem and
+                                (pairs is None or (qstem, stem) in pairs))
+    needed = set(stem for sstems in subjects.values() for stem in sstems)
+    dbfiles = [fname for fname, stem in zip(infiles, stems) if
+               stem in needed]
+    lengths = org_lengths
+    if lengths is None:
+        lengths = pyani_files.get_sequence_lengths(dbfiles)
+    dbfasta = os.path.join(batchdir, "combined.fna")
+    nseqs = anim.write_batch_fasta(dbfiles, dbfasta)
+    dbcmd, dbname = construct_makeblastdb_cmd(dbfasta, batchdir, format_exe)
+    dbcost = 0
+    if org_lengths is not None:
+        dbcost = sum(org_lengths[stem] for stem in needed)
+    dbjob = pyani_jobs.Job("%s_db_combined" % prefix, dbcmd, cost=dbcost)
+    joblist, batches = [], []
+    for fragfile in fragfiles:
+        qstem = get_fragment_stem(fragfile)
+        if not subjects.get(qstem):
+            continue
+        dbsize = min(lengths[stem] for stem in subjects[qstem])
+        cmd = construct_blastn_cmdline(fragfile, dbname, batchdir, blast_exe,
+                                       threads, max_target_seqs=nseqs,
+                                       fields=BLASTN_FIELDS + " evalue stitle",
+                                       dbsize=dbsize)
+        job = pyani_jobs.Job("%s_exe_%06d" % (prefix, len(joblist)), cmd,
+                             threads=threads)
+        if org_lengths is not None:
+            job.cost = org_lengths[qstem] * dbcost
+        job.add_dependency(dbjob)
+        joblist.append(job)
+        batches.append((os.path.join(batchdir, "%s_vs_combined.blast_tab" %
+                                     qstem), qstem, subjects[qstem],
+                        tuple(lengths[stem] / dbsize for stem in
+                              subjects[qstem])))
+    return joblist, batches
+
+
+# Get the organism label for a fragmented input FASTA file
+def get_fragment_stem(fragfile):
+    """Returns the input file stem for a fragmented FASTA file path."""
+    return os.path.splitext(os.path.split(fragfile)[-1])[0].replace(
+        '-fragments', '')
+
+
 # Generate list of makeblastdb command lines from passed filenames
 def generate_blastdb_commands(filenames, outdir, blastdb_exe=None,
                               mode="ANIb"):
@@ -333,11 +589,21 @@ def generate_blastn_commands(filenames, outdir, blast_exe=None, mode="ANIb"):
 
 # Generate single BLASTN command line
 def construct_blastn_cmdline(fname1, fname2, outdir,
-                             blastn_exe=pyani_config.BLASTN_DEFAULT):
+                             blastn_exe=pyani_config.BLASTN_DEFAULT,
+                             threads=1, max_target_seqs=1,
+                             fields=BLASTN_FIELDS, reducer=None,
+                             dbsize=None):
     """Returns a single blastn command.
 
     - filename - input filename
     - blastn_exe - path to BLASTN executable
+    - threads - number of BLASTN threads (-num_threads)
+    - max_target_seqs - number of database sequences reported per query
+    - fields - tabular output fields
+    - dbsize - if not None, the database size used for E-values (-dbsize)
+    - reducer - if not None, a dictionary of keyword arguments for
+      construct_reducer_cmdline(); BLASTN output is then reduced as it
+      is written, rather than written to a .blast_tab file
     """
     fstem1 = os.path.splitext(os.path.split(fname1)[-1])[0]
     fstem2 = os.path.splitext(os.path.split(fname2)[-1])[0]
@@ -345,18 +611,30 @@ def construct_blastn_cmdline(fname1, fname2, outdir,
     prefix = os.path.join(outdir, "%s_vs_%s" % (fstem1, fstem2))
     cmd = "{0} -out {1}.blast_tab -query {2} -db {3} " +\
         "-xdrop_gap_final 150 -dust no -evalue 1e-15 " +\
-        "-max_target_seqs 1 -outfmt '6 qseqid sseqid length mismatch " +\
-        "pident nident qlen slen qstart qend sstart send positive " +\
-        "ppos gaps' -task blastn"
-    return cmd.format(blastn_exe, prefix, fname1, fname2)
+        "-max_target_seqs {4} -outfmt '6 {5}' -task blastn"
+    if threads > 1:
+        cmd += " -num_threads %d" % threads
+    if dbsize is not None:
+        cmd += " -dbsize %d" % dbsize
+    if reducer is not None:  # write output to STDOUT, for the reducer
+        cmd = cmd.replace("-out {1}.blast_tab ", "")
+        return construct_reducer_cmdline(
+            cmd.format(blastn_exe, prefix, fname1, fname2, max_target_seqs,
+                       fields), prefix, fname1, "ANIb", **reducer)
+    return cmd.format(blastn_exe, prefix, fname1, fname2, max_target_seqs,
+                      fields)
 
 
 # Generate single BLASTALL command line
 def construct_blastall_cmdline(fname1, fname2, outdir,
-                               blastall_exe=pyani_config.BLASTALL_DEFAULT):
+                               blastall_exe=pyani_config.BLASTALL_DEFAULT,
+                               threads=1, reducer=None):
     """Returns a single blastall command.
 
     - blastall_exe - path to BLASTALL executable
+    - threads - number of BLASTALL processors (-a)
+    - reducer - if not None, a dictionary of keyword arguments for
+      construct_reducer_cmdline()
     """
     fstem1 = os.path.splitext(os.path.split(fname1)[-1])[0]
     fstem2 = os.path.splitext(os.path.split(fname2)[-1])[0]
@@ -365,20 +643,145 @@ def construct_blastall_cmdline(fname1, fname2, outdir,
     cmd = "{0} -p blastn -o {1}.blast_tab -i {2} -d {3} " +\
         "-X 150 -q -1 -F F -e 1e-15 " +\
         "-b 1 -v 1 -m 8"
+    if threads > 1:
+        cmd += " -a %d" % threads
+    if reducer is not None:  # write output to STDOUT, for the reducer
+        return construct_reducer_cmdline(
+            cmd.replace("-o {1}.blast_tab ", "").format(
+                blastall_exe, prefix, fname1, fname2),
+            prefix, fname1, "ANIblastall", **reducer)
     return cmd.format(blastall_exe, prefix, fname1, fname2)
 
 
+# Wrap a single BLAST command line so that its output is reduced as written
+def construct_reducer_cmdline(blastcmd, prefix, fragfile, mode="ANIb",
+                              hits=False, identity=0.3, coverage=0.7):
+    """Returns a blast_reducer_wrapper.py command for a BLAST command.
+
+    - blastcmd - BLAST command line writing tabular output to STDOUT
+    - prefix - path prefix of the output files
+    - fragfile - path to the fragmented query FASTA file, from which
+      fragment lengths are read for BLASTALL output
+    - mode - BLASTN+ or BLASTALL output?
+    - hits - if True, also write the hits passing the filter to
+      prefix.blast_tab
+    - identity, coverage - thresholds used to filter hits
+
+    The wrapper runs the BLAST command, passing its output through a pipe
+    to reduce_blast_tab(), and writes the totals to prefix.blast_totals
+    (see write_blast_totals()) so that the full BLAST output is never
+    written to disk.
+    """
+    cmd = "blast_reducer_wrapper.py --mode {0} --identity {1} " +\
+        "--coverage {2}"
+    if mode == "ANIblastall":
+        cmd += " --fragments %s" % fragfile
+    if hits:
+        cmd += " --hits %s.blast_tab" % prefix
+    return cmd.format(mode, identity, coverage) + \
+        " {0}.blast_totals {1}".format(prefix, blastcmd)
+
+
+# Split the output of BLASTN against a combined database by subject genome
+def split_combined_blast(batches, outdir):
+    """Returns list of per-comparison .blast_tab files written from batches.
+
+    - batches - (combined .blast_tab path, query stem, subject stems,
+      E-value scales) tuples, as returned by make_combined_jobs()
+    - outdir - path to the directory for per-comparison .blast_tab files
+
+    Hits whose rescaled E-value fails the BLASTN threshold are dropped.
+    For each query fragment, the hits to the best-ranked subject sequence
+    of each genome are written to its query_vs_subject.blast_tab file, as
+    if BLASTN had been run with -max_target_seqs 1 against that genome
+    alone. Batches whose BLASTN output is missing are skipped.
+
+    Hits are grouped by subject genome before any output is written, and
+    each .blast_tab file is then written in turn, so that only one output
+    file is open at a time. If a batch cannot be split, its partly written
+    .blast_tab files are removed before the exception is raised.
+    """
+    outfiles = []
+    for blastfile, qstem, sstems, scales in batches:
+        if not os.path.isfile(blastfile):
+            continue
+        scales = dict(zip(sstems, scales))
+        outfnames = [os.path.join(outdir, "%s_vs_%s.blast_tab" %
+                                  (qstem, sstem)) for sstem in sstems]
+        try:
+            hits = {sstem: [] for sstem in sstems}
+            with open(blastfile, 'r') as ifh:
+                fragment, best = None, {}
+                for line in ifh:
+                    fields = line.rstrip('\n').split('\t')
+                    sstem, sseqid = fields[-1].split(None, 1)[0].split(
+                        pyani_config.BATCH_TAG_SEP, 1)
+                    if sstem not in hits or \
+                       float(fields[-2]) * scales[sstem] > BLASTN_EVALUE:
+                        continue
+                    if fields[0] != fragment:  # best subject seq per genome
+                        fragment, best = fields[0], {}
+                    if best.setdefault(sstem, sseqid) == sseqid:
+                        fields[1] = sseqid
+                        hits[sstem].append('\t'.join(fields[:-2]) + '\n')
+            for sstem, outfname in zip(sstems, outfnames):
+                with open(outfname, 'w') as ofh:
+                    ofh.writelines(hits.pop(sstem))
+        except Exception:
+            for outfname in outfnames:
+                if os.path.isfile(outfname):
+                    os.remove(outfname)
+            raise
+        outfiles.extend(outfnames)
+    return outfiles
+
+
+# Get the parameters that identify ANIb results in the comparison cache
+def get_cache_params(fragsize, combined=False):
+    """Returns dictionary of parameters that affect cached ANIb results.
+
+    - fragsize - size of the query genome fragments
+    - combined - True if BLASTN was run against a combined database (see
+      make_combined_jobs())
+
+    Results from a combined database search use rescaled E-values, and
+    keep the best subject sequence of each genome in a search of all
+    genomes, so they are cached separately from pairwise results. Reducing
+    BLAST output as it is written (see construct_reducer_cmdline()) gives
+    the same totals, and is not included.
+    """
+    return {'fragsize': fragsize, 'combined': combined}
+
+
 # Process pairwise BLASTN output
 def process_blast(blast_dir, org_lengths, fraglengths=None, mode="ANIb",
-                  identity=0.3, coverage=0.7, logger=None):
+                  identity=0.3, coverage=0.7, logger=None, workers=None,
+                  chunksize=None, labels=None, columns=None, sidecar=False,
+                  write_dataframes=False, reduced=False):
     """Returns a tuple of ANIb results for .blast_tab files in the output dir.
 
-    - blast_dir - path to the directory containing .blast_tab files
+    - blast_dir - path to the directory containing .blast_tab files; if
+      this has been archived with pyani_archive.archive_dir(), files are
+      read directly from the archive
     - org_lengths - the base count for each input sequence
-    - fraglengths - dictionary of query sequence fragment lengths, only
-    needed for BLASTALL output
+    - fraglengths - dictionary of query sequence fragment length arrays
+    (see get_fraglength_dict()), only needed for BLASTALL output
     - mode - parsing BLASTN+ or BLASTALL output?
     - logger - a logger for messages
+    - workers - number of worker processes used to parse files (None: all
+    available cores)
+    - chunksize - number of files passed to each worker at a time
+    - labels - query sequence labels (default: all keys of org_lengths)
+    - columns - subject sequence labels, if these differ from the query
+      labels (e.g. a reference panel); the results are then rectangular
+    - sidecar - if True, BLAST hits are read from the binary sidecar of
+      each file where this is up to date, and written otherwise, so that
+      the files need not be parsed again (see parse_blast_tab_task())
+    - write_dataframes - if True, write the best BLAST hits for each file to
+      a .dataframe file, for debugging (see parse_blast_tab())
+    - reduced - if True, read the .blast_totals files written by
+      blast_reducer_wrapper.py (see construct_reducer_cmdline()), rather
+      than .blast_tab files
 
     Returns the following pandas dataframes in an ANIResults object;
     query sequences are rows, subject sequences are columns:
@@ -392,52 +795,131 @@ def process_blast(blast_dir, org_lengths, fraglengths=None, mode="ANIb",
     very distant sequence was included in the analysis.
     """
     # Process directory to identify input files
-    blastfiles = pyani_files.get_input_files(blast_dir, '.blast_tab')
+    archive, blastfiles = pyani_archive.get_output_files(
+        blast_dir, '.blast_totals' if reduced else '.blast_tab')
+    if archive is not None and logger:
+        logger.info("Reading BLAST output from archive %s", archive)
     # Hold data in ANIResults object
-    results = ANIResults(list(org_lengths.keys()), mode)
+    if labels is None:
+        labels = list(org_lengths.keys())
+    results = ANIResults(labels, mode, columns)
 
     # Fill diagonal NA values for alignment_length with org_lengths
-    for org, length in list(org_lengths.items()):
-        results.alignment_lengths[org][org] = length
-
-    # Process .blast_tab files assuming that the filename format holds:
-    # org1_vs_org2.blast_tab:
-    for blastfile in blastfiles:
-        qname, sname = \
-            os.path.splitext(os.path.split(blastfile)[-1])[0].split('_vs_')
-
-        # We may have BLAST files from other analyses in the same directory
-        # If this occurs, we raise a warning, and skip the file
-        if qname not in list(org_lengths.keys()):
-            if logger:
-                logger.warning("Query name %s not in input " % qname +
-                               "sequence list, skipping %s" % blastfile)
-            continue
-        if sname not in list(org_lengths.keys()):
-            if logger:
-                logger.warning("Subject name %s not in input " % sname +
-                               "sequence list, skipping %s" % blastfile)
-            continue
-        resultvals = parse_blast_tab(blastfile, fraglengths,
-                                     identity, coverage, mode)
-        query_cover = float(resultvals[0]) / org_lengths[qname]
-
-        # Populate dataframes: when assigning data, we need to note that
-        # we have asymmetrical data from BLAST output, so only the
-        # upper triangle is populated
-        results.add_tot_length(qname, sname, resultvals[0], sym=False)
-        results.add_sim_errors(qname, sname, resultvals[1], sym=False)
-        results.add_pid(qname, sname, 0.01 * resultvals[2], sym=False)
-        results.add_coverage(qname, sname, query_cover)
+    results.add_org_lengths(org_lengths)
+
+    # Parse .blast_tab files assuming that the filename format holds:
+    # org1_vs_org2.blast_tab; files that don't correspond to input
+    # sequences are skipped
+    tasks = pyani_ingest.get_comparison_tasks(blastfiles, labels, logger,
+                                              columns)
+    if reduced:
+        parser = functools.partial(read_blast_totals_task, identity=identity,
+                                   coverage=coverage, archive=archive)
+    else:
+        parser = functools.partial(parse_blast_tab_task,
+                                   fraglengths=fraglengths,
+                                   identity=identity, coverage=coverage,
+                                   mode=mode, sidecar=sidecar,
+                                   archive=archive,
+                                   write_dataframe=write_dataframes)
+    data = pyani_ingest.ingest(tasks, parser, 5, workers, chunksize)
+    qidx, sidx = data[:, 0].astype(int), data[:, 1].astype(int)
+    lengths = np.array([org_lengths[org] for org in labels], dtype=float)
+    query_cover = data[:, 2] / lengths[qidx]
+
+    # Populate dataframes: when assigning data, we need to note that
+    # we have asymmetrical data from BLAST output, so only the
+    # upper triangle is populated
+    results.add_bulk(qidx, sidx, data[:, 2], data[:, 3], 0.01 * data[:, 4],
+                     query_cover, sym=False)
     return results
 
 
+# Parse a single .blast_tab file, for use with pyani_ingest
+def parse_blast_tab_task(task, fraglengths, identity, coverage, mode,
+                         sidecar=False, archive=None, write_dataframe=False):
+    """Returns [(query idx, subject idx, aln length, sim errors, pid)].
+
+    - task - (query index, subject index, filename) tuple
+    - sidecar - if True, read the BLAST hits from the file's binary sidecar
+      where this is up to date; otherwise parse the file and write the
+      sidecar. Sidecars are not used for files read from an archive, or
+      if write_dataframe is True.
+
+    Remaining arguments are passed to parse_blast_tab(). The sidecar holds
+    all hits, before filtering, so that it can be reused with different
+    identity and coverage thresholds.
+    """
+    qidx, sidx, filename = task
+    if not sidecar or archive is not None or write_dataframe:
+        return [(qidx, sidx) +
+                parse_blast_tab(filename, fraglengths, identity, coverage,
+                                mode, archive=archive,
+                                write_dataframe=write_dataframe)]
+    data = pyani_ingest.read_sidecar(filename, 'hits')
+    if data is None:
+        hits = parse_blast_tab(filename, fraglengths, identity, coverage,
+                               mode, hits=True)[3]
+        pyani_ingest.write_sidecar(filename, hits=hits)
+    else:
+        hits = data['hits']
+    return [(qidx, sidx) + get_blast_totals(hits, identity, coverage)]
+
+
+# Calculate ANIb totals from an array of BLAST hits
+def get_blast_totals(hits, identity, coverage):
+    """Returns (alignment length, similarity errors, mean_pid) tuple from hits.
+
+    - hits - NumPy structured array of BLAST hits (dtype BLAST_DTYPE), as
+      returned by parse_blast_tab(..., hits=True)
+    - identity - minimum identity of a hit, over the query fragment length
+    - coverage - minimum coverage of the query fragment by a hit
+
+    Totals are calculated over the best hit for each query fragment (see
+    get_best_hits()).
+    """
+    best = hits[get_best_hits(hits, identity, coverage)]
+    if not len(best):  # Happens if there are no matches in ANIb
+        return 0, 0, 0
+    return (int((best['alnlen'] - best['gaps']).sum()),
+            int((best['mismatch'] + best['gaps']).sum()),
+            float(best['pid'].mean()))
+
+
+# Identify the best BLAST hit for each query fragment
+def get_best_hits(hits, identity, coverage):
+    """Returns indices of the best hit for each query fragment.
+
+    - hits - NumPy structured array of BLAST hits (dtype BLAST_DTYPE)
+    - identity - minimum identity of a hit, over the query fragment length
+    - coverage - minimum coverage of the query fragment by a hit
+
+    Hits are retained if their coverage of the query fragment (excluding
+    gaps) exceeds coverage, and their identity over the fragment length
+    exceeds identity. Of these, the first hit in the file for each query
+    fragment is its best hit. Indices are returned in fragment order.
+    """
+    alnlen = hits['alnlen'] - hits['gaps']
+    qcover = alnlen / hits['qlen']
+    qpid = (alnlen - hits['mismatch']) / hits['qlen']
+    passed = np.flatnonzero((qcover > coverage) & (qpid > identity))
+    return passed[np.unique(hits['fragment'][passed], return_index=True)[1]]
+
+
 # Parse BLASTALL output to get total alignment length and mismatches
-def parse_blast_tab(filename, fraglengths, identity, coverage, mode="ANIb"):
+def parse_blast_tab(filename, fraglengths, identity, coverage, mode="ANIb",
+                    hits=False, archive=None, write_dataframe=False):
     """Returns (alignment length, similarity errors, mean_pid) tuple
     from .blast_tab
 
     - filename - path to .blast_tab file
+    - hits - if True, also return a NumPy structured array (dtype
+      BLAST_DTYPE) describing every BLAST hit, before filtering
+    - archive - path to an archive of BLAST output holding the file (see
+      pyani_archive.open_file()), or None to read the file from disk
+    - write_dataframe - if True, write the best hit for each query fragment
+      to a tab-separated .dataframe file alongside the input, for
+      debugging (only if the file is read from disk)
 
     Calculate the alignment length and total number of similarity errors (as
     we would with ANIm), as well as the Goris et al.-defined mean identity
@@ -450,44 +932,7 @@ def parse_blast_tab(filename, fraglengths, identity, coverage, mode="ANIb"):
     over an alignable region of at least 70% of their length.
     '''
     """
-    # Assuming that the filename format holds org1_vs_org2.blast_tab:
-    qname = os.path.splitext(os.path.split(filename)[-1])[0].split('_vs_')[0]
-    # Load output as dataframe
-    if mode == "ANIblastall":
-        qfraglengths = fraglengths[qname]
-        columns = ['sid', 'blast_pid', 'blast_alnlen', 'blast_mismatch',
-                   'blast_gaps', 'q_start', 'q_end', 's_start', 's_end',
-                   'e_Value', 'bit_score']
-    else:
-        columns = ['sbjct_id', 'blast_alnlen', 'blast_mismatch',
-                   'blast_pid', 'blast_identities', 'qlen', 'slen',
-                   'q_start', 'q_end', 's_start', 's_end', 'blast_pos',
-                   'ppos', 'blast_gaps']
-    # We may receive an empty BLASTN output file, if there are no significant
-    # regions of homology. This causes pandas to throw an error on CSV import.
-    # To get past this, we create an empty dataframe with the appropriate
-    # columns.
-    try:
-        data = pd.read_csv(filename, header=None, sep='\t', index_col=0)
-        data.columns = columns
-    except pd.io.common.EmptyDataError:
-        data = pd.DataFrame(columns=columns)
-    # Add new column for fragment length, only for BLASTALL
-    if mode == "ANIblastall":
-        data['qlen'] = pd.Series([qfraglengths[idx] for idx in data.index],
-                                 index=data.index)
-    # Add new columns for recalculated alignment length, proportion, and
-    # percentage identity
-    data['ani_alnlen'] = data['blast_alnlen'] - data['blast_gaps']
-    data['ani_alnids'] = data['ani_alnlen'] - data['blast_mismatch']
-    data['ani_coverage'] = data['ani_alnlen'] / data['qlen']
-    data['ani_pid'] = data['ani_alnids'] / data['qlen']
-    # Filter rows on 'ani_coverage' > 0.7, 'ani_pid' > 0.3
-    filtered = data[(data['ani_coverage'] > coverage) & (data['ani_pid'] > identity)]
-    # Dedupe query hits, so we only take the best hit
-    filtered = filtered.groupby(filtered.index).first()
-    # Replace NaNs with zero
-    filtered = filtered.fillna(value=0)  # Needed if no matches
+    records, fragids = load_blast_tab(filename, fraglengths, mode, archive)
     # The ANI value is then the mean percentage identity.
     # We report total alignment length and the number of similarity errors
     # (mismatches and gaps), as for ANIm
@@ -496,13 +941,176 @@ def parse_blast_tab(filename, fraglengths, identity, coverage, mode="ANIb"):
     # development indicated that a handful of fragments are differentially
     # filtered out in JSpecies and this script. This is often on the basis
     # of rounding differences (e.g. coverage being close to 70%).
-    # NOTE: If there are no hits, then ani_pid will be nan - we replace this
-    # with zero if that happens
-    ani_pid = filtered['blast_pid'].mean()
-    if pd.isnull(ani_pid):  # Happens if there are no matches in ANIb
-        ani_pid = 0
-    aln_length = filtered['ani_alnlen'].sum()
-    sim_errors = filtered['blast_mismatch'].sum() +\
-        filtered['blast_gaps'].sum()
-    filtered.to_csv(filename + '.dataframe', sep="\t")
-    return aln_length, sim_errors, ani_pid
+    totals = get_blast_totals(records, identity, coverage)
+    if write_dataframe and archive is None:
+        best = records[get_best_hits(records, identity, coverage)]
+        dfr = pd.DataFrame(best[[field for field, _ in BLAST_DTYPE[1:]]],
+                           index=fragids[best['fragment']])
+        dfr['ani_alnlen'] = dfr['alnlen'] - dfr['gaps']
+        dfr['ani_coverage'] = dfr['ani_alnlen'] / dfr['qlen']
+        dfr['ani_pid'] = (dfr['ani_alnlen'] - dfr['mismatch']) / dfr['qlen']
+        dfr.to_csv(filename + '.dataframe', sep="\t")
+    if hits:
+        return totals + (records,)
+    return totals
+
+
+# Load a .blast_tab file as an array of BLAST hits
+def load_blast_tab(filename, fraglengths, mode="ANIb", archive=None):
+    """Returns (hits, fragment IDs) from the passed .blast_tab file.
+
+    - filename - path to .blast_tab file
+    - fraglengths - dictionary of query sequence fragment length arrays
+      (see get_fraglength_dict()), only needed for BLASTALL output
+    - mode - parsing BLASTN+ or BLASTALL output?
+    - archive - path to an archive of BLAST output holding the file, or None
+
+    hits is a NumPy structured array (dtype BLAST_DTYPE) with one record
+    per line of the file. Only the required columns are read, with explicit
+    types. Query fragments are numbered in the sorted order of their IDs,
+    and the IDs are returned as an array indexed by fragment number.
+    """
+    # Assuming that the filename format holds org1_vs_org2.blast_tab:
+    qname = os.path.splitext(os.path.split(filename)[-1])[0].split('_vs_')[0]
+    # Positions of the query ID, percentage identity, alignment length,
+    # mismatch and gap columns, and (BLAST+ only) query length
+    if mode == "ANIblastall":
+        columns = {0: 'qid', 2: 'pid', 3: 'alnlen', 4: 'mismatch', 5: 'gaps'}
+    else:
+        columns = {0: 'qid', 2: 'alnlen', 3: 'mismatch', 4: 'pid',
+                   6: 'qlen', 14: 'gaps'}
+    # Query IDs are the fragNNNNN IDs of fragmented input files, so are
+    # read as short byte strings; longer IDs are rejected below, rather
+    # than truncated
+    dtypes = dict(BLAST_DTYPE, qid='S%d' % QID_WIDTH)
+    options = {'delimiter': '\t', 'comments': None, 'encoding': 'bytes',
+               'ndmin': 1, 'usecols': sorted(columns),
+               'dtype': [(columns[col], dtypes[columns[col]]) for col in
+                         sorted(columns)]}
+    # NumPy's loadtxt() parses these columns in C, and is faster than pandas
+    # for this. We may receive an empty BLASTN output file, if there are no
+    # significant regions of homology; loadtxt() warns, and returns no hits.
+    # Files on disk are passed by path, which is faster than reading from a
+    # file handle
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', UserWarning)
+        if archive is None:
+            data = np.loadtxt(filename, **options)
+        else:
+            with pyani_archive.open_file(filename, archive,
+                                         binary=True) as ifh:
+                data = np.loadtxt(ifh, **options)
+    # BLAST reports all hits for a query fragment together, so only the
+    # first ID of each run of hits need be sorted to number the fragments
+    qids = data['qid']
+    if len(qids) and np.char.str_len(qids).max() >= QID_WIDTH:
+        raise ValueError("Query IDs in %s may be longer than %d characters" %
+                         (filename, QID_WIDTH - 1))
+    first = np.ones(len(qids), dtype=bool)
+    first[1:] = qids[1:] != qids[:-1]
+    starts = np.flatnonzero(first)
+    fragids, runcodes = np.unique(qids[starts], return_inverse=True)
+    fragids = fragids.astype(str)
+    codes = np.repeat(runcodes, np.diff(np.append(starts, len(qids))))
+    records = np.zeros(len(data), dtype=BLAST_DTYPE)
+    records['fragment'] = codes
+    for name in data.dtype.names[1:]:
+        records[name] = data[name]
+    # Add fragment lengths, only for BLASTALL
+    if mode == "ANIblastall":
+        records['qlen'] = fraglengths[qname][
+            get_fragment_ordinals(fragids)][codes]
+    return records, fragids
+
+
+# Reduce BLAST tabular output to ANIb totals, line by line
+def reduce_blast_tab(lines, identity=0.3, coverage=0.7, mode="ANIb",
+                     fraglengths=None, hitsfh=None):
+    """Returns (alignment length, similarity errors, mean_pid) tuple
+    from lines of BLAST tabular output.
+
+    - lines - iterable of .blast_tab lines, e.g. the STDOUT of a BLAST
+      process
+    - identity - minimum identity of a hit, over the query fragment length
+    - coverage - minimum coverage of the query fragment by a hit
+    - mode - parsing BLASTN+ or BLASTALL output?
+    - fraglengths - fragment length array of the query genome (see
+      get_fragment_lengths()), only needed for BLASTALL output
+    - hitsfh - if not None, an open file handle to which the best hit for
+      each query fragment is written, as a .blast_tab line
+
+    This applies the filter of get_best_hits() incrementally, so that only
+    the identities of the best hits are held in memory, and the totals are
+    equal to those returned by parse_blast_tab() for the same output. A
+    .blast_tab file of the best hits written to hitsfh also has the same
+    totals.
+    """
+    alnlen, simerrors, best = 0, 0, {}
+    for line in lines:
+        fields = line.rstrip('\n').split('\t')
+        if fields[0] in best:  # later hits are never the best hit
+            continue
+        if mode == "ANIblastall":
+            qlen = int(fraglengths[int(fields[0][len(FRAGMENT_PREFIX):]) -
+                                   1])
+            pid, length, mismatch, gaps = (float(fields[2]), int(fields[3]),
+                                           int(fields[4]), int(fields[5]))
+        else:
+            length, mismatch, pid, qlen, gaps = (int(fields[2]),
+                                                 int(fields[3]),
+                                                 float(fields[4]),
+                                                 int(fields[6]),
+                                                 int(fields[14]))
+        if (length - gaps) / qlen > coverage and \
+           (length - gaps - mismatch) / qlen > identity:
+            best[fields[0]] = pid
+            alnlen += length - gaps
+            simerrors += mismatch + gaps
+            if hitsfh is not None:
+                hitsfh.write(line)
+    if not best:  # Happens if there are no matches in ANIb
+        return 0, 0, 0
+    # The mean is taken in fragment order, as in get_blast_totals()
+    return (alnlen, simerrors,
+            float(np.array([best[fragid] for fragid in sorted(best)]).mean()))
+
+
+# Write ANIb totals reduced from BLAST output
+def write_blast_totals(filename, totals, identity, coverage):
+    """Writes reduced BLAST totals, and the thresholds used, to a file.
+
+    - filename - path to the .blast_totals file
+    - totals - (alignment length, similarity errors, mean_pid) tuple, as
+      returned by reduce_blast_tab()
+    - identity, coverage - thresholds used to filter hits
+
+    The file is tab-separated, with a header line. It is written to a
+    temporary file and moved into place, so that a partially-written file
+    is never read.
+    """
+    tmpname = "%s.%d.tmp" % (filename, os.getpid())
+    with open(tmpname, 'w') as ofh:
+        ofh.write("alnlen\tsimerrors\tpid\tidentity\tcoverage\n")
+        ofh.write('\t'.join(repr(val) for val in
+                            tuple(totals) + (identity, coverage)) + '\n')
+    os.replace(tmpname, filename)
+
+
+# Read a single .blast_totals file, for use with pyani_ingest
+def read_blast_totals_task(task, identity, coverage, archive=None):
+    """Returns [(query idx, subject idx, aln length, sim errors, pid)].
+
+    - task - (query index, subject index, filename) tuple
+    - identity, coverage - thresholds expected to have been used to filter
+      hits
+    - archive - path to an archive of BLAST output holding the file, or None
+
+    Raises a ValueError if the file was written with different thresholds.
+    """
+    qidx, sidx, filename = task
+    with pyani_archive.open_file(filename, archive) as ifh:
+        values = ifh.read().splitlines()[1].split('\t')
+    if (float(values[3]), float(values[4])) != (identity, coverage):
+        raise ValueError("%s was reduced with identity %s, coverage %s" %
+                         (filename, values[3], values[4]))
+    return [(qidx, sidx, int(values[0]), int(values[1]), float(values[2]))]
@@ -21,48 +21,108 @@ counts, average nucleotide identity (ANI) percentages, and minimum aligned
 percentage (of whole genome) for each pairwise comparison.
 """
 
+import array
+import contextlib
+import functools
+import heapq
 import os
+import re
 
+import numpy as np
+
+from . import pyani_archive
+from . import pyani_cache
 from . import pyani_config
 from . import pyani_files
+from . import pyani_ingest
 from . import pyani_jobs
 from .pyani_tools import ANIResults
 
 
+# Size (in characters) of blocks read when parsing .delta/.filter files
+DELTA_CHUNKSIZE = 1 << 20
+
+# Layout of per-alignment records parsed from .delta/.filter files. The
+# ref_id and qry_id fields number sequences in the order they are first
+# seen in the file; the remaining fields are the seven columns of the
+# alignment header line.
+DELTA_DTYPE = [('ref_id', np.int32), ('qry_id', np.int32),
+               ('ref_start', np.int64), ('ref_end', np.int64),
+               ('qry_start', np.int64), ('qry_end', np.int64),
+               ('errors', np.int64), ('sim_errors', np.int64),
+               ('stops', np.int64)]
+
+
 # Generate list of Job objects, one per NUCmer run
 def generate_nucmer_jobs(filenames, outdir='.',
                          nucmer_exe=pyani_config.NUCMER_DEFAULT,
                          filter_exe=pyani_config.FILTER_DEFAULT,
                          maxmatch=False,
-                         jobprefix="ANINUCmer"):
+                         jobprefix="ANINUCmer",
+                         filter_engine=pyani_config.FILTER_ENGINE_DEFAULT,
+                         pairs=None, org_lengths=None, threads=1):
     """Return a list of Jobs describing NUCmer command-lines for ANIm
 
     - filenames - a list of paths to input FASTA files
     - outdir - path to output directory
     - nucmer_exe - location of the nucmer binary
     - maxmatch - Boolean flag indicating to use NUCmer's -maxmatch option
+    - filter_engine - 'delta-filter' to run delta-filter as a dependent job
+      for each comparison; 'native' to return only the NUCmer jobs, as
+      the 1-to-1 filter is then applied when the .delta files are parsed
+    - pairs - collection of (file stem, file stem) comparisons to be run;
+      None for all pairwise comparisons
+    - org_lengths - dictionary of sequence lengths, keyed by file stem, used
+      to estimate the cost of each job (see get_nucmer_cost())
+    - threads - number of threads for each NUCmer run (MUMmer 4 only)
 
     Loop over all FASTA files, generating Jobs describing NUCmer command lines
     for each pairwise comparison.
     """
     ncmds, fcmds = generate_nucmer_commands(filenames, outdir, nucmer_exe,
-                                            filter_exe, maxmatch)
+                                            filter_exe, maxmatch, pairs,
+                                            threads)
+    costs = [get_nucmer_cost(fpair, org_lengths) for fpair in
+             pyani_files.get_pairwise_files(filenames, pairs)]
     joblist = []
     for idx, ncmd in enumerate(ncmds):
-        njob = pyani_jobs.Job("%s_%06d-n" % (jobprefix, idx), ncmd)
-        fjob = pyani_jobs.Job("%s_%06d-f" % (jobprefix, idx), fcmds[idx])
+        njob = pyani_jobs.Job("%s_%06d-n" % (jobprefix, idx), ncmd,
+                              cost=costs[idx], threads=threads)
+        if filter_engine == 'native':
+            joblist.append(njob)
+            continue
+        fjob = pyani_jobs.Job("%s_%06d-f" % (jobprefix, idx), fcmds[idx],
+                              cost=costs[idx])
         fjob.add_dependency(njob)
         #joblist.append(njob)  # not required: dependency in fjob
         joblist.append(fjob)
     return joblist
 
 
+# Estimate the cost of a NUCmer run
+def get_nucmer_cost(filenames, org_lengths=None):
+    """Returns the estimated relative cost of aligning the passed files.
+
+    - filenames - paths to the reference and query FASTA files
+    - org_lengths - dictionary of sequence lengths, keyed by file stem;
+      if None, all costs are zero
+
+    NUCmer's run time grows with the total length of the input sequences
+    (suffix tree construction for the reference, and a scan of the
+    queries), so the total length is used as the cost.
+    """
+    if org_lengths is None:
+        return 0
+    return sum(org_lengths[pyani_files.get_file_stem(fname)]
+               for fname in filenames)
+
+
 # Generate list of NUCmer pairwise comparison command lines from
 # passed sequence filenames
 def generate_nucmer_commands(filenames, outdir='.',
                              nucmer_exe=pyani_config.NUCMER_DEFAULT,
                              filter_exe=pyani_config.FILTER_DEFAULT,
-                             maxmatch=False):
+                             maxmatch=False, pairs=None, threads=1):
     """Return a tuple of lists of NUCmer command-lines for ANIm
 
     The first element is a list of NUCmer commands, the second a list
@@ -74,18 +134,21 @@ def generate_nucmer_commands(filenames, outdir='.',
     - outdir - path to output directory
     - nucmer_exe - location of the nucmer binary
     - maxmatch - Boolean flag indicating to use NUCmer's -maxmatch option
+    - pairs - collection of (file stem, file stem) comparisons to be run;
+      None for all pairwise comparisons
+    - threads - number of threads for each NUCmer run (MUMmer 4 only)
 
     Loop over all FASTA files generating NUCmer command lines for each
     pairwise comparison.
     """
     nucmer_cmdlines, delta_filter_cmdlines = [], []
-    for idx, fname1 in enumerate(filenames[:-1]):
-        for fname2 in filenames[idx+1:]:
-            ncmd, dcmd = construct_nucmer_cmdline(fname1, fname2, outdir,
-                                                  nucmer_exe, filter_exe,
-                                                  maxmatch)
-            nucmer_cmdlines.append(ncmd)
-            delta_filter_cmdlines.append(dcmd)
+    for fname1, fname2 in pyani_files.get_pairwise_files(filenames,
+                                                         pairs):
+        ncmd, dcmd = construct_nucmer_cmdline(fname1, fname2, outdir,
+                                              nucmer_exe, filter_exe,
+                                              maxmatch, threads)
+        nucmer_cmdlines.append(ncmd)
+        delta_filter_cmdlines.append(dcmd)
     return (nucmer_cmdlines, delta_filter_cmdlines)
 
 
@@ -94,7 +157,7 @@ def generate_nucmer_commands(filenames, outdir='.',
 def construct_nucmer_cmdline(fname1, fname2, outdir='.',
                              nucmer_exe=pyani_config.NUCMER_DEFAULT,
                              filter_exe=pyani_config.FILTER_DEFAULT,
-                             maxmatch=False):
+                             maxmatch=False, threads=1):
     """Returns a tuple of NUCmer and delta-filter commands
 
     The split into a tuple was made necessary by changes to SGE/OGE. The
@@ -109,6 +172,8 @@ def construct_nucmer_cmdline(fname1, fname2, outdir='.',
     - outdir - path to output directory
     - maxmatch - Boolean flag indicating whether to use NUCmer's -maxmatch
     option. If not, the -mum option is used instead
+    - threads - number of NUCmer threads; this option is only given if
+    threads > 1, as it is not supported before MUMmer 4
     """
     outsubdir = os.path.join(outdir, pyani_config.ALIGNDIR['ANIm'])
     outprefix = os.path.join(outsubdir, "%s_vs_%s" %
@@ -118,43 +183,571 @@ def construct_nucmer_cmdline(fname1, fname2, outdir='.',
         mode = "--maxmatch"
     else:
         mode = "--mum"
+    mode += get_nucmer_threads_option(threads)
     nucmercmd = "{0} {1} -p {2} {3} {4}".format(nucmer_exe, mode, outprefix,
                                                 fname1, fname2)
-    filtercmd = "delta_filter_wrapper.py " + \
-    "{0} -1 {1} {2}".format(filter_exe,
-                            outprefix + '.delta',
-                            outprefix + '.filter')
+    filtercmd = construct_delta_filter_cmdline(outprefix + '.delta',
+                                               filter_exe)
     return(nucmercmd, filtercmd)
     #return "{0}; {1}".format(nucmercmd, filtercmd)
 
 
+# Get the NUCmer option for multithreaded alignment
+def get_nucmer_threads_option(threads=1):
+    """Returns the NUCmer command-line option for the number of threads.
+
+    An empty string is returned for a single thread, so that commands
+    remain valid for MUMmer 3, which does not support the option.
+    """
+    if threads > 1:
+        return " -t %d" % threads
+    return ""
+
+
+# Check whether a NUCmer executable can align with multiple threads
+def nucmer_supports_threads(nucmer_exe=pyani_config.NUCMER_DEFAULT):
+    """Returns True if the passed NUCmer executable supports threads.
+
+    The major version reported by nucmer --version is compared with
+    pyani_config.NUCMER_THREADS_VERSION; False is returned if the version
+    cannot be determined.
+    """
+    match = re.search(r'\d+', pyani_cache.get_tool_version([nucmer_exe,
+                                                            '--version']))
+    return match is not None and \
+        int(match.group()) >= pyani_config.NUCMER_THREADS_VERSION
+
+
+# Generate single delta-filter command line for a .delta file
+def construct_delta_filter_cmdline(deltafile,
+                                   filter_exe=pyani_config.FILTER_DEFAULT):
+    """Returns a delta_filter_wrapper.py command for a .delta file.
+
+    - deltafile - path to the NUCmer .delta file
+    - filter_exe - location of the delta-filter binary
+
+    The filtered output is written alongside the input, with the
+    extension .filter.
+    """
+    return "delta_filter_wrapper.py " + \
+        "{0} -1 {1} {2}".format(filter_exe, deltafile,
+                                os.path.splitext(deltafile)[0] + '.filter')
+
+
+# Generate list of delta-filter Jobs for .delta files
+def generate_delta_filter_jobs(deltafiles,
+                               filter_exe=pyani_config.FILTER_DEFAULT,
+                               jobprefix="ANINUCmer"):
+    """Return a list of Jobs describing delta-filter command-lines.
+
+    - deltafiles - a list of paths to NUCmer .delta files
+    - filter_exe - location of the delta-filter binary
+    - jobprefix - prefix for Job names
+
+    Used to filter the per-pair .delta files obtained by splitting batched
+    NUCmer output. The cost of each job is the size of its .delta file.
+    """
+    return [pyani_jobs.Job("%s_%06d-f" % (jobprefix, idx),
+                           construct_delta_filter_cmdline(deltafile,
+                                                          filter_exe),
+                           cost=os.path.getsize(deltafile))
+            for idx, deltafile in enumerate(deltafiles)]
+
+
+# Generate list of batched NUCmer Jobs
+def generate_nucmer_batch_jobs(filenames, outdir='.',
+                               nucmer_exe=pyani_config.NUCMER_DEFAULT,
+                               maxmatch=False, jobprefix="ANINUCmer",
+                               pairs=None, batchsize=10, org_lengths=None,
+                               threads=1):
+    """Return (Jobs, batches) describing batched NUCmer runs for ANIm.
+
+    - filenames - a list of paths to input FASTA files
+    - outdir - path to output directory
+    - nucmer_exe - location of the nucmer binary
+    - maxmatch - Boolean flag indicating to use NUCmer's -maxmatch option
+    - jobprefix - prefix for Job names
+    - pairs - collection of (file stem, file stem) comparisons to be run;
+      None for all pairwise comparisons
+    - batchsize - maximum number of query genomes in each NUCmer run
+    - org_lengths - dictionary of sequence lengths, keyed by file stem, used
+      to estimate the cost of each job (see get_nucmer_cost())
+    - threads - number of threads for each NUCmer run (MUMmer 4 only)
+
+    Rather than running NUCmer once per comparison, each reference genome
+    is aligned against a multiple FASTA file of up to batchsize query
+    genomes, so that its index is built once per batch. Query sequence
+    headers are tagged with the file stem of their genome (see
+    write_batch_fasta()), and the NUCmer output must be split into
+    per-comparison .delta files with split_batch_deltas() before it is
+    filtered and parsed.
+
+    Query genomes are divided into batches in input file order, so that
+    batch FASTA files can be shared between reference genomes. The batch
+    files and NUCmer output are written to a subdirectory of the NUCmer
+    output directory.
+
+    The returned batches are (batch .delta path, reference stem, query
+    filenames) tuples, for use with split_batch_deltas(). A ValueError is
+    raised if a file stem contains pyani_config.BATCH_TAG_SEP.
+    """
+    stems = [pyani_files.get_file_stem(fname) for fname in filenames]
+    check_batch_stems(stems)
+    outsubdir = os.path.join(outdir, pyani_config.ALIGNDIR['ANIm'])
+    batchdir = os.path.join(outsubdir, pyani_config.BATCHDIR)
+    os.makedirs(batchdir, exist_ok=True)
+    mode = "--maxmatch" if maxmatch else "--mum"
+    mode += get_nucmer_threads_option(threads)
+    positions = {stem: idx for idx, stem in enumerate(stems)}
+    queries = {}  # reference stem: query filenames, in input order
+    for fname1, fname2 in pyani_files.get_pairwise_files(filenames, pairs):
+        queries.setdefault(pyani_files.get_file_stem(fname1),
+                           []).append(fname2)
+    batchfiles = {}  # batch FASTA file paths, keyed by query stems
+    joblist, batches = [], []
+    for fname1, refstem in zip(filenames, stems):
+        # Group the queries for this reference by their global batch
+        groups = {}
+        for fname2 in queries.get(refstem, []):
+            batch = positions[pyani_files.get_file_stem(fname2)] // batchsize
+            groups.setdefault(batch, []).append(fname2)
+        for _, members in sorted(groups.items()):
+            qstems = tuple(pyani_files.get_file_stem(fname)
+                           for fname in members)
+            if qstems not in batchfiles:
+                batchfiles[qstems] = os.path.join(batchdir, "batch_%06d.fna"
+                                                  % len(batchfiles))
+                write_batch_fasta(members, batchfiles[qstems])
+            outprefix = os.path.join(batchdir, "%s_vs_%s" %
+                                     (refstem, pyani_files.get_file_stem(
+                                         batchfiles[qstems])))
+            joblist.append(pyani_jobs.Job("%s_%06d-n" %
+                                          (jobprefix, len(joblist)),
+                                          "{0} {1} -p {2} {3} {4}".format(
+                                              nucmer_exe, mode, outprefix,
+                                              fname1, batchfiles[qstems]),
+                                          cost=get_nucmer_cost(
+                                              [fname1] + members,
+                                              org_lengths),
+                                          threads=threads))
+            batches.append((outprefix + '.delta', refstem, tuple(members)))
+    return joblist, batches
+
+
+# Check that file stems can be used to tag batched sequence headers
+def check_batch_stems(stems):
+    """Raises a ValueError if a file stem contains the batch tag separator.
+
+    - stems - file stems of the genomes to be batched
+
+    Tagged sequence headers are split on the first separator (see
+    write_batch_fasta()), so a stem containing it would be mis-assigned.
+    """
+    bad = [stem for stem in stems if pyani_config.BATCH_TAG_SEP in stem]
+    if bad:
+        raise ValueError("Genome file stems cannot contain %r when batched "
+                         "(%s)" % (pyani_config.BATCH_TAG_SEP,
+                                   ", ".join(bad)))
+
+
+# Write a multiple FASTA file of several genomes, with tagged headers
+def write_batch_fasta(filenames, outfilename):
+    """Writes the sequences from the passed FASTA files to a single file.
+
+    - filenames - paths to the input FASTA files
+    - outfilename - path to the output FASTA file
+
+    The ID of each sequence is prefixed with the file stem of the genome
+    it came from, followed by pyani_config.BATCH_TAG_SEP, so that NUCmer
+    (or BLASTN) output can be assigned to the correct comparison.
+
+    Returns the number of sequences written.
+    """
+    nseqs = 0
+    with open(outfilename, 'w') as ofh:
+        for filename in filenames:
+            tag = '>' + pyani_files.get_file_stem(filename) + \
+                pyani_config.BATCH_TAG_SEP
+            with open(filename, 'r') as ifh:
+                for line in ifh:
+                    if line.startswith('>'):
+                        line = tag + line[1:]
+                        nseqs += 1
+                    ofh.write(line)
+    return nseqs
+
+
+# Split the output of batched NUCmer runs into per-comparison .delta files
+def split_batch_deltas(batches, outdir):
+    """Returns list of per-comparison .delta files written from batches.
+
+    - batches - (batch .delta path, reference stem, query filenames)
+      tuples, as returned by generate_nucmer_batch_jobs()
+    - outdir - path to the directory for per-comparison .delta files
+
+    Each alignment block in a batch .delta file is written to the
+    reference_vs_query.delta file for its query genome, with the tag
+    removed from the query sequence ID, and the batch FASTA file replaced
+    by the query FASTA file in the header, so that the output is
+    equivalent to that of a NUCmer run on the single pair. A .delta file
+    is written for every comparison in the batch, even if it contains no
+    alignments. If a batch cannot be split, its partly written .delta
+    files are removed before the exception is raised.
+    """
+    outfiles = []
+    for deltafile, refstem, qfiles in batches:
+        qstems = [pyani_files.get_file_stem(fname) for fname in qfiles]
+        outfnames = [os.path.join(outdir, "%s_vs_%s.delta" % (refstem, qstem))
+                     for qstem in qstems]
+        try:
+            with contextlib.ExitStack() as stack:
+                handles = {qstem: stack.enter_context(open(outfname, 'w'))
+                           for qstem, outfname in zip(qstems, outfnames)}
+                ifh = stack.enter_context(open(deltafile, 'r'))
+                # NUCmer writes the reference and query paths, in the form
+                # it resolved them; MUMmer splits this line on whitespace
+                refpath, qrypath = ifh.readline().split()[:2]
+                header = ifh.readline()
+                for qfile in qfiles:
+                    if os.path.isabs(qrypath):
+                        qfile = os.path.abspath(qfile)
+                    handles[pyani_files.get_file_stem(qfile)].write(
+                        "%s %s\n%s" % (refpath, qfile, header))
+                ofh = None
+                for line in ifh:
+                    if line.startswith('>'):  # >ref tagged_qry reflen qrylen
+                        ref, qry, lengths = line[1:].split(None, 2)
+                        qstem, qry = qry.split(pyani_config.BATCH_TAG_SEP, 1)
+                        ofh = handles[qstem]
+                        line = '>%s %s %s' % (ref, qry, lengths)
+                    ofh.write(line)
+        except Exception:
+            for outfname in outfnames:
+                if os.path.isfile(outfname):
+                    os.remove(outfname)
+            raise
+        outfiles.extend(outfnames)
+    return outfiles
+
+
 # Parse NUCmer delta file to get total alignment length and total sim_errors
-def parse_delta(filename):
+def parse_delta(filename, records=False, chunksize=DELTA_CHUNKSIZE,
+                archive=None):
     """Returns (alignment length, similarity errors) tuple from passed .delta.
 
     - filename - path to the input .delta file
+    - records - if True, also return a NumPy structured array (dtype
+      DELTA_DTYPE) describing each individual alignment
+    - chunksize - size (in characters) of the blocks read from the file
+    - archive - path to an archive of NUCmer output holding the file (see
+      pyani_archive.open_file()), or None to read the file from disk
 
     Extracts the aligned length and number of similarity errors for each
     aligned uniquely-matched region, and returns the cumulative total for
-    each as a tuple.
+    each as a tuple. If records is True, the tuple has a third element:
+    the per-alignment array of records.
+
+    The file is read in fixed-size blocks, and only the seven-column
+    alignment header lines are converted to integers, so memory use does
+    not grow with the size of the input file (other than for the optional
+    records).
     """
     aln_length, sim_errors = 0, 0
-    for line in [l.strip().split() for l in open(filename, 'rU').readlines()]:
-        if line[0] == 'NUCMER' or line[0].startswith('>'):  # Skip headers
+    values = array.array('q')  # flat buffer of per-alignment record values
+    ids = {'ref': {}, 'qry': {}}  # sequence IDs, numbered in order seen
+    ref_id, qry_id = -1, -1
+    for line in iter_delta_lines(filename, chunksize, archive):
+        if line.startswith('>'):  # Sequence header: >ref qry reflen qrylen
+            if records:
+                ref, qry = line[1:].split()[:2]
+                ref_id = ids['ref'].setdefault(ref, len(ids['ref']))
+                qry_id = ids['qry'].setdefault(qry, len(ids['qry']))
             continue
-        # We only process lines with seven columns:
-        if len(line) == 7:
-            aln_length += abs(int(line[1]) - int(line[0]))
-            sim_errors += int(line[4])
+        # We only process lines with seven columns: all other numeric lines
+        # describe indel positions and have a single column
+        vals = line.split()
+        if len(vals) != 7:
+            continue
+        vals = [int(val) for val in vals]
+        aln_length += abs(vals[1] - vals[0])
+        sim_errors += vals[4]
+        if records:
+            values.extend([ref_id, qry_id])
+            values.extend(vals)
+    if records:
+        return aln_length, sim_errors, delta_records_from_buffer(values)
     return aln_length, sim_errors
 
 
+# Iterate over lines in a NUCmer .delta file, in fixed-size blocks
+def iter_delta_lines(filename, chunksize=DELTA_CHUNKSIZE, archive=None):
+    """Yields stripped lines from the passed .delta file, body only.
+
+    - filename - path to the input .delta file
+    - chunksize - size (in characters) of the blocks read from the file
+    - archive - path to an archive holding the file, or None
+
+    The two preamble lines (input file paths, and alignment program) are
+    not returned. Blocks are read with a fixed size, and any partial line
+    at the end of a block is carried over to the next.
+    """
+    with pyani_archive.open_file(filename, archive) as ifh:
+        carry = ''
+        lineno = 0
+        while True:
+            block = ifh.read(chunksize)
+            if not block:
+                break
+            lines = (carry + block).split('\n')
+            carry = lines.pop()
+            for line in lines:
+                lineno += 1
+                if lineno > 2:
+                    yield line.strip()
+        if carry and lineno >= 2:
+            yield carry.strip()
+
+
+# Convert a flat buffer of delta record values into a structured array
+def delta_records_from_buffer(values):
+    """Returns a NumPy structured array from a flat buffer of values.
+
+    - values - flat sequence of integers, nine per alignment, in the field
+      order of DELTA_DTYPE
+    """
+    flat = np.frombuffer(values, dtype=np.int64) if len(values) else \
+        np.zeros(0, dtype=np.int64)
+    flat = flat.reshape(-1, len(DELTA_DTYPE))
+    recs = np.zeros(len(flat), dtype=DELTA_DTYPE)
+    for idx, (field, _) in enumerate(DELTA_DTYPE):
+        recs[field] = flat[:, idx]
+    return recs
+
+
+# Identify the alignments retained by a 1-to-1 filter of delta records
+def filter_delta_1to1(records):
+    """Returns a Boolean mask of the records kept by a 1-to-1 filter.
+
+    - records - NumPy structured array of alignments (dtype DELTA_DTYPE),
+      as returned by parse_delta(..., records=True) for a .delta file
+
+    This is a native implementation of MUMmer's delta-filter -1 option.
+    An alignment is retained if it lies on the best-scoring chain of
+    alignments for its reference sequence, and on the best-scoring chain
+    of alignments for its query sequence (the intersection of the two
+    longest increasing subsets, in delta-filter's terms). Alignments
+    sharing a start position are chained highest-scoring first, as in
+    delta-filter, so that ties resolve the same way.
+    """
+    keep_ref = np.zeros(len(records), dtype=bool)
+    keep_qry = np.zeros(len(records), dtype=bool)
+    if not len(records):
+        return keep_ref
+    ref_len = np.abs(records['ref_end'] - records['ref_start']) + 1
+    identity = (ref_len - records['errors']) / ref_len
+    for keep, side in ((keep_ref, 'ref'), (keep_qry, 'qry')):
+        starts, ends = records[side + '_start'], records[side + '_end']
+        lows, highs = np.minimum(starts, ends), np.maximum(starts, ends)
+        scores = (highs - lows + 1) * identity ** 2
+        for seqid in np.unique(records[side + '_id']):
+            idx = np.flatnonzero(records[side + '_id'] == seqid)
+            # Order by start, then by descending score, along this sequence
+            order = idx[np.lexsort((-scores[idx], lows[idx]))]
+            chain = chain_intervals(lows[order], highs[order],
+                                    identity[order])
+            keep[order[chain]] = True
+    return keep_ref & keep_qry
+
+
+# Find the best-scoring chain of sorted, weighted intervals
+def chain_intervals(lows, highs, identity):
+    """Returns indices of intervals on the highest-scoring chain.
+
+    - lows - interval start positions, sorted ascending
+    - highs - interval end positions
+    - identity - fractional identity of each interval
+
+    Each interval scores its length weighted by the square of its
+    identity; where an interval follows another on the chain, only the
+    non-overlapping part is scored. An interval may follow another only
+    if the overlap between them does not exceed the length of either.
+    The chain is found in a single sweep along the sequence: intervals
+    that end before the current one starts can only precede it without
+    overlap, so just the best of them is kept; the remaining (overlapping)
+    candidates are scored individually. Ties go to the earliest interval.
+    """
+    lengths = (highs - lows + 1).tolist()
+    weights = (identity ** 2).tolist()
+    lows, highs = lows.tolist(), highs.tolist()
+    best = [length * weight for length, weight in zip(lengths, weights)]
+    previous = [-1] * len(lows)
+    closed_score, closed_idx = -np.inf, -1
+    active = []  # heap of (high, index) for intervals that may overlap
+    for idx, low in enumerate(lows):
+        while active and active[0][0] < low:
+            pred = heapq.heappop(active)[1]
+            if (best[pred], -pred) > (closed_score, -closed_idx):
+                closed_score, closed_idx = best[pred], pred
+        score, pred = closed_score + lengths[idx] * weights[idx], closed_idx
+        for high, cand in active:
+            overlap = high - low + 1
+            if overlap > lengths[idx] or overlap > lengths[cand]:
+                continue
+            cand_score = best[cand] + (lengths[idx] - overlap) * weights[idx]
+            if (cand_score, -cand) > (score, -pred):
+                score, pred = cand_score, cand
+        if pred >= 0 and score > best[idx]:
+            best[idx] = score
+            previous[idx] = pred
+        heapq.heappush(active, (highs[idx], idx))
+    chain = []
+    idx = int(np.argmax(best))
+    while idx >= 0:
+        chain.append(idx)
+        idx = previous[idx]
+    return np.array(chain[::-1], dtype=int)
+
+
+# Count the bases covered by the union of a set of intervals
+def get_covered_bases(seqids, starts, ends):
+    """Returns the number of bases covered by the passed intervals.
+
+    - seqids - sequence ID of each interval
+    - starts - interval start positions (1-based)
+    - ends - interval end positions (inclusive; may precede the start for
+      reverse-strand alignments)
+
+    Overlapping intervals on the same sequence are merged, so that each
+    base is counted once. Sequences are placed end-to-end on a single
+    axis, the intervals are sorted by start, and merged intervals begin
+    wherever an interval starts beyond the furthest end seen so far.
+    """
+    if not len(seqids):
+        return 0
+    lows, highs = np.minimum(starts, ends), np.maximum(starts, ends)
+    offsets = seqids.astype(np.int64) * (int(highs.max()) + 2)
+    lows, highs = lows + offsets, highs + offsets
+    order = np.argsort(lows, kind='mergesort')
+    lows, reach = lows[order], np.maximum.accumulate(highs[order])
+    first = np.ones(len(lows), dtype=bool)
+    first[1:] = lows[1:] > reach[:-1]
+    last = np.append(np.flatnonzero(first)[1:] - 1, len(lows) - 1)
+    return int((reach[last] - lows[first] + 1).sum())
+
+
+# Count the reference and query bases covered by delta records
+def get_delta_coverage(records):
+    """Returns (reference, query) covered bases for passed delta records.
+
+    - records - NumPy structured array of alignments (dtype DELTA_DTYPE)
+    """
+    return (get_covered_bases(records['ref_id'], records['ref_start'],
+                              records['ref_end']),
+            get_covered_bases(records['qry_id'], records['qry_start'],
+                              records['qry_end']))
+
+
+# Parse a single .delta file, for use with pyani_ingest
+def parse_delta_task(task, sidecar=False, archive=None):
+    """Returns [(query idx, subject idx, aln length, sim errors, query
+    covered bases, subject covered bases)] for a task.
+
+    - task - (query index, subject index, filename) tuple
+    - sidecar - if True, read values from the file's binary sidecar where
+      possible, and write the sidecar if the file has to be parsed
+    - archive - path to an archive holding the file, or None
+
+    The NUCmer reference is the query of the comparison (the files are
+    named reference_vs_query).
+    """
+    qidx, sidx, filename = task
+    return [(qidx, sidx) + get_delta_totals(filename, False, sidecar,
+                                                   archive)]
+
+
+# Parse and 1-to-1 filter a single .delta file, for use with pyani_ingest
+def parse_delta_native_task(task, sidecar=False, archive=None):
+    """Returns [(query idx, subject idx, aln length, sim errors, query
+    covered bases, subject covered bases)] for a task.
+
+    - task - (query index, subject index, filename) tuple, where filename
+      is an unfiltered NUCmer .delta file
+    - sidecar - if True, read values from the file's binary sidecar where
+      possible, and write the sidecar if the file has to be parsed
+    - archive - path to an archive holding the file, or None
+
+    Totals are calculated only over the alignments retained by
+    filter_delta_1to1(), in place of running delta-filter -1.
+    """
+    qidx, sidx, filename = task
+    return [(qidx, sidx) + get_delta_totals(filename, True, sidecar,
+                                                   archive)]
+
+
+# Get totals for a single .delta/.filter file, via its sidecar if possible
+def get_delta_totals(filename, native=False, sidecar=False, archive=None):
+    """Returns (aln length, sim errors, reference covered bases, query
+    covered bases) for the passed .delta/.filter file.
+
+    - filename - path to the .delta/.filter file
+    - native - if True, totals are calculated only over the alignments
+      retained by filter_delta_1to1()
+    - sidecar - if True, read the totals from the file's binary sidecar
+      where this is up to date; otherwise parse the file and write the
+      sidecar
+    - archive - path to an archive of NUCmer output holding the file, or
+      None; sidecars are not used for files read from an archive
+
+    The sidecar holds the per-alignment records and a mask of the records
+    retained by the 1-to-1 filter (all records, if native is False), as
+    well as the totals.
+    """
+    sidecar = sidecar and archive is None
+    if sidecar:
+        data = pyani_ingest.read_sidecar(filename, 'totals', 'native')
+        if data is not None and bool(data['native']) == native:
+            return tuple(data['totals'].tolist())
+    aln_length, sim_errors, records = parse_delta(filename, records=True,
+                                                  archive=archive)
+    keep = np.ones(len(records), dtype=bool)
+    if native:
+        keep = filter_delta_1to1(records)
+        aln_length = int(np.abs(records['ref_end'][keep] -
+                                records['ref_start'][keep]).sum())
+        sim_errors = int(records['errors'][keep].sum())
+    totals = (aln_length, sim_errors) + get_delta_coverage(records[keep])
+    if sidecar:
+        pyani_ingest.write_sidecar(filename, records=records, keep=keep,
+                                   totals=np.array(totals, dtype=np.int64),
+                                   native=native)
+    return totals
+
+
 # Parse all the .delta files in the passed directory
-def process_deltadir(delta_dir, org_lengths, logger=None):
+def process_deltadir(delta_dir, org_lengths, logger=None, workers=None,
+                     chunksize=None,
+                     filter_engine=pyani_config.FILTER_ENGINE_DEFAULT,
+                     labels=None, columns=None, sidecar=False):
     """Returns a tuple of ANIm results for .deltas in passed directory.
 
-    - delta_dir - path to the directory containing .delta files
+    - delta_dir - path to the directory containing .delta files; if this
+      has been archived with pyani_archive.archive_dir(), files are read
+      directly from the archive
     - org_lengths - dictionary of total sequence lengths, keyed by sequence
+    - logger - a logger for messages
+    - workers - number of worker processes used to parse files (None: all
+      available cores)
+    - chunksize - number of files passed to each worker at a time
+    - filter_engine - 'delta-filter' to parse the .filter files written by
+      delta-filter; 'native' to parse the .delta files and apply a 1-to-1
+      filter in Python
+    - labels - query sequence labels (default: all keys of org_lengths)
+    - columns - subject sequence labels, if these differ from the query
+      labels (e.g. a reference panel); the results are then rectangular,
+      and alignment_coverage holds only query coverage
+    - sidecar - if True, values are read from the binary sidecar of each
+      file where this is up to date, and written otherwise, so that the
+      files need not be parsed again (see get_delta_totals())
 
     Returns the following pandas dataframes in an ANIResults object;
     query sequences are rows, subject sequences are columns:
@@ -163,62 +756,78 @@ def process_deltadir(delta_dir, org_lengths, logger=None):
     - percentage_identity - symmetrical: percentage identity of alignment
     - alignment_coverage - non-symmetrical: coverage of query and subject
     - similarity_errors - symmetrical: count of similarity errors
+    - covered_bases - non-symmetrical: bases of the query and subject
+      covered by the union of alignments
+    - covered_fraction - non-symmetrical: covered_bases as a fraction of
+      query and subject length
 
     May throw a ZeroDivisionError if one or more NUCmer runs failed, or a
     very distant sequence was included in the analysis.
     """
     # Process directory to identify input files - as of v0.2.4 we use the
-    # .filter files that result from delta-filter (1:1 alignments)
-    deltafiles = pyani_files.get_input_files(delta_dir, '.filter')
+    # .filter files that result from delta-filter (1:1 alignments), unless
+    # the native 1:1 filter is requested
+    if filter_engine == 'native':
+        archive, deltafiles = pyani_archive.get_output_files(delta_dir,
+                                                             '.delta')
+        parser = parse_delta_native_task
+    else:
+        archive, deltafiles = pyani_archive.get_output_files(delta_dir,
+                                                             '.filter')
+        parser = parse_delta_task
+    if archive is not None and logger:
+        logger.info("Reading NUCmer output from archive %s", archive)
 
     # Hold data in ANIResults object
-    results = ANIResults(list(org_lengths.keys()), "ANIm")
+    if labels is None:
+        labels = list(org_lengths.keys())
+    results = ANIResults(labels, "ANIm", columns)
+    if columns is None:
+        columns = labels
 
     # Fill diagonal NA values for alignment_length with org_lengths
-    for org, length in list(org_lengths.items()):
-        results.alignment_lengths[org][org] = length
-
-    # Process .delta files assuming that the filename format holds:
-    # org1_vs_org2.delta
-    for deltafile in deltafiles:
-        qname, sname = \
-            os.path.splitext(os.path.split(deltafile)[-1])[0].split('_vs_')
-
-        # We may have .delta files from other analyses in the same directory
-        # If this occurs, we raise a warning, and skip the .delta file
-        if qname not in list(org_lengths.keys()):
-            if logger:
-                logger.warning("Query name %s not in input " % qname +
-                               "sequence list, skipping %s" % deltafile)
-            continue
-        if sname not in list(org_lengths.keys()):
-            if logger:
-                logger.warning("Subject name %s not in input " % sname +
-                               "sequence list, skipping %s" % deltafile)
-            continue
-        tot_length, tot_sim_error = parse_delta(deltafile)
-        if tot_length == 0 and logger is not None:
-            if logger:
+    results.add_org_lengths(org_lengths)
+
+    # Parse .delta files assuming that the filename format holds:
+    # org1_vs_org2.delta; files that don't correspond to input sequences
+    # are skipped
+    tasks = pyani_ingest.get_comparison_tasks(deltafiles, labels, logger,
+                                              columns)
+    data = pyani_ingest.ingest(tasks, functools.partial(parser,
+                                                        sidecar=sidecar,
+                                                        archive=archive),
+                               6, workers, chunksize)
+    qidx, sidx = data[:, 0].astype(int), data[:, 1].astype(int)
+    tot_length, tot_sim_error = data[:, 2], data[:, 3]
+    zero_length = tot_length == 0
+    if logger:
+        for task, zero in zip(tasks, zero_length):
+            if zero:
                 logger.warning("Total alignment length reported in " +
-                               "%s is zero!" % deltafile)
-        query_cover = float(tot_length) / org_lengths[qname]
-        sbjct_cover = float(tot_length) / org_lengths[sname]
-
-        # Calculate percentage ID of aligned length. This may fail if
-        # total length is zero.
-        # The ZeroDivisionError that would arise should be handled
-        # Common causes are that a NUCmer run failed, or that a very
-        # distant sequence was included in the analysis.
-        try:
-            perc_id = 1 - float(tot_sim_error) / tot_length
-        except ZeroDivisionError:
-            perc_id = 0  # set arbitrary value of zero identity
-            results.zero_error = True
-
-        # Populate dataframes: when assigning data from symmetrical MUMmer
-        # output, both upper and lower triangles will be populated
-        results.add_tot_length(qname, sname, tot_length)
-        results.add_sim_errors(qname, sname, tot_sim_error)
-        results.add_pid(qname, sname, perc_id)
-        results.add_coverage(qname, sname, query_cover, sbjct_cover)
+                               "%s is zero!" % task[2])
+    qlengths = np.array([org_lengths[org] for org in labels], dtype=float)
+    slengths = np.array([org_lengths[org] for org in columns], dtype=float)
+    query_cover = tot_length / qlengths[qidx]
+    sbjct_cover = tot_length / slengths[sidx]
+
+    # Calculate percentage ID of aligned length. This is undefined if
+    # total length is zero; we set an arbitrary value of zero identity
+    # and flag the error.
+    # Common causes are that a NUCmer run failed, or that a very
+    # distant sequence was included in the analysis.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        perc_id = 1 - tot_sim_error / tot_length
+    perc_id[zero_length] = 0
+    if zero_length.any():
+        results.zero_error = True
+
+    # Populate dataframes: when assigning data from symmetrical MUMmer
+    # output, both upper and lower triangles will be populated
+    results.add_bulk(qidx, sidx, tot_length, tot_sim_error, perc_id,
+                     query_cover, sbjct_cover)
+    # True covered bases, from the union of alignments on each genome
+    query_bases, sbjct_bases = data[:, 4], data[:, 5]
+    results.add_covered_bases(qidx, sidx, query_bases,
+                              query_bases / qlengths[qidx], sbjct_bases,
+                              sbjct_bases / slengths[sidx])
     return results
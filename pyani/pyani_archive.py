@@ -0,0 +1,181 @@
+# Copyright 2017, The James Hutton Insitute
+# Author: Leighton Pritchard
+#
+# This code is part of the pyani package, and is governed by its licence.
+# Please see the LICENSE file that should have been included as part of
+# this package.
+
+"""Code to archive comparison output directories, with random access.
+
+ANIm and ANIb write one output file per pairwise comparison, and the
+output directory is archived at the end of a run. Compressing the whole
+directory as a single stream is slow for large numbers of files, and no
+file can be read back without decompressing everything before it.
+
+Instead, each file is compressed independently with gzip by a pool of
+threads (zlib releases the GIL while compressing), and stored as
+<name>.gz in a ZIP archive. The ZIP central directory serves as an index
+of the archive members, so that individual output files can be read
+directly from the archive (e.g. when resuming with --skip_nucmer).
+"""
+
+import collections
+import concurrent.futures
+import gzip
+import io
+import os
+import time
+import zipfile
+
+from . import pyani_config
+from . import pyani_files
+
+# Extension of compressed files within an archive
+MEMBER_EXT = '.gz'
+
+# Archives opened by this process, keyed by (path, process ID); forked
+# worker processes must not share an open archive with their parent
+_ARCHIVES = {}
+
+
+# Get the path to the archive of an output directory
+def get_archive_path(dirname):
+    """Returns the path to the archive of the passed directory."""
+    return os.path.normpath(dirname) + pyani_config.ARCHIVE_EXT
+
+
+# Compress a single file, for use by a thread pool
+def compress_file(filename, level=6):
+    """Returns the gzip-compressed contents of the passed file.
+
+    - filename - path to the file
+    - level - gzip compression level
+    """
+    with open(filename, 'rb') as ifh:
+        return gzip.compress(ifh.read(), compresslevel=level)
+
+
+# Archive the contents of a directory, compressing files in parallel
+def archive_dir(dirname, workers=None, level=6):
+    """Returns the path to an archive of the files in the passed directory.
+
+    - dirname - path to the directory to be archived
+    - workers - number of compression threads (None: one per core)
+    - level - gzip compression level
+
+    Files in the directory and its subdirectories are compressed by a pool
+    of threads, and written to the archive (see get_archive_path()) in
+    directory order. Only a bounded number of
+    compressed files is held in memory at once. The archive is written to
+    a temporary file and moved into place when complete. The directory is
+    not deleted.
+    """
+    filenames = []
+    for root, _, files in os.walk(dirname):
+        filenames.extend(os.path.join(root, fname) for fname in sorted(files))
+    archive = get_archive_path(dirname)
+    tmpname = archive + '.tmp'
+    nthreads = workers or os.cpu_count() or 1
+    with concurrent.futures.ThreadPoolExecutor(nthreads) as pool, \
+            zipfile.ZipFile(tmpname, 'w', zipfile.ZIP_STORED,
+                            allowZip64=True) as zfh:
+        pending = collections.deque()
+        for filename in filenames:
+            pending.append((filename, pool.submit(compress_file, filename,
+                                                  level)))
+            if len(pending) > 4 * nthreads:
+                write_member(zfh, dirname, *pending.popleft())
+        while pending:
+            write_member(zfh, dirname, *pending.popleft())
+    os.replace(tmpname, archive)
+    return archive
+
+
+# Write a compressed file to an archive
+def write_member(zfh, dirname, filename, future):
+    """Writes the result of compress_file() to an open archive.
+
+    - zfh - ZipFile open for writing
+    - dirname - path to the directory being archived
+    - filename - path to the compressed file
+    - future - concurrent.futures.Future returning the compressed data
+
+    The member is named by the path of the file relative to dirname, and
+    keeps the file's modification time (limited to the range of dates a
+    ZIP archive can hold) and permissions.
+    """
+    member = os.path.relpath(filename, dirname).replace(os.sep, '/')
+    stat = os.stat(filename)
+    date_time = min(max(time.localtime(stat.st_mtime)[:6],
+                        (1980, 1, 1, 0, 0, 0)), (2107, 12, 31, 23, 59, 59))
+    zinfo = zipfile.ZipInfo(member + MEMBER_EXT, date_time=date_time)
+    zinfo.compress_type = zipfile.ZIP_STORED
+    zinfo.external_attr = (stat.st_mode & 0xFFFF) << 16
+    zfh.writestr(zinfo, future.result())
+
+
+# Open an archive for reading, once per process
+def get_archive(archive):
+    """Returns an open ZipFile for the passed archive path.
+
+    The archive, and its index, are read once per process and reused for
+    subsequent reads of its members.
+    """
+    key = (archive, os.getpid())
+    if key not in _ARCHIVES:
+        _ARCHIVES[key] = zipfile.ZipFile(archive, 'r')
+    return _ARCHIVES[key]
+
+
+# List the files held in an archive
+def get_archive_files(archive, *ext):
+    """Returns names of files in the archive, filtered by extension.
+
+    - archive - path to the archive
+    - *ext - list of arguments describing permitted file extensions
+
+    As with pyani_files.get_input_files(), only files at the top level of
+    the archived directory are returned.
+    """
+    names = [name[:-len(MEMBER_EXT)] for name in
+             get_archive(archive).namelist() if name.endswith(MEMBER_EXT)]
+    return [name for name in names if
+            '/' not in name and os.path.splitext(name)[-1] in ext]
+
+
+# Get comparison output files from a directory, or from its archive
+def get_output_files(dirname, *ext):
+    """Returns (archive, filenames) for output files of a directory.
+
+    - dirname - path to the output directory
+    - *ext - list of arguments describing permitted file extensions
+
+    If the directory exists, archive is None and the files are listed as
+    with pyani_files.get_input_files(). Otherwise, if the directory has
+    been archived with archive_dir(), archive is the path to the archive,
+    and the files are named as archive members (see open_file()).
+    """
+    archive = get_archive_path(dirname)
+    if os.path.isdir(dirname) or not os.path.isfile(archive):
+        return None, pyani_files.get_input_files(dirname, *ext)
+    return archive, get_archive_files(archive, *ext)
+
+
+# Open an output file for reading, from disk or from an archive
+def open_file(filename, archive=None, binary=False):
+    """Returns a handle for reading the passed file.
+
+    - filename - path to the file, or name of the file in the archive
+    - archive - path to an archive made by archive_dir(), or None to open
+      filename from disk
+    - binary - if True, the handle reads bytes rather than text
+
+    Archive members are decompressed as they are read.
+    """
+    if archive is None:
+        return open(filename, 'rb' if binary else 'r')
+    member = gzip.GzipFile(fileobj=get_archive(archive).open(filename +
+                                                             MEMBER_EXT))
+    if binary:
+        return member
+    return io.TextIOWrapper(member)
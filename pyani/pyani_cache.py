@@ -0,0 +1,510 @@
+# Copyright 2017, The James Hutton Insitute
+# Author: Leighton Pritchard
+#
+# This code is part of the pyani package, and is governed by its licence.
+# Please see the LICENSE file that should have been included as part of
+# this package.
+
+"""Code to cache pairwise comparison results between pyani runs.
+
+Results for each pairwise comparison are stored in an SQLite database,
+keyed by the content (SHA256 hash) of the two input genome files, the
+analysis method, the parameters that affect the result (e.g. fragsize,
+maxmatch) and the version of the alignment tool. A comparison is only
+recalculated if one of these changes, so that adding genomes to an
+analysis only requires the new comparisons to be run.
+
+ANIm comparisons are symmetrical, and are cached once per unordered pair
+of genomes; ANIb comparisons are cached separately for each direction.
+Symmetrical entries hold the alignment length, similarity errors and
+identity, followed by pairs of values for the two genomes: coverage,
+covered bases and covered fraction.
+
+The cache can be limited in size: least recently used entries are
+evicted when the stored data exceeds the limit. Access times are held in
+memory by lookups, and written when the cache is committed, so that
+lookups do not hold the database write lock.
+
+TETRA Z-score signatures are cached per genome, keyed by the genome
+content hash alone, in SignatureCache. The signatures are held as rows of
+a single binary file of float64 values, indexed in the SQLite database,
+so that all cached signatures can be memory-mapped as one array.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import subprocess
+import time
+
+import numpy as np
+
+# Name of the SQLite database file within a cache directory
+CACHE_DBNAME = 'pyani_cache.sqlite'
+
+# Number of values held by a symmetrical cache entry
+SYM_NVALUES = 9
+
+# Size (in bytes) of blocks read when hashing input files
+HASH_BLOCKSIZE = 1 << 20
+
+# Name of the binary TETRA signature file within a cache directory; this
+# holds one row of SIGNATURE_LENGTH little-endian float64 values per genome
+SIGNATURE_FILE = 'tetra_signatures.bin'
+SIGNATURE_LENGTH = 256
+SIGNATURE_DTYPE = np.dtype('<f8')
+
+SQL_CREATE = '''CREATE TABLE IF NOT EXISTS results
+                (key TEXT PRIMARY KEY, genome_a TEXT, genome_b TEXT,
+                 method TEXT, params TEXT, version TEXT, data TEXT,
+                 size INTEGER, created REAL, accessed REAL)'''
+
+SQL_CREATE_SIGNATURES = '''CREATE TABLE IF NOT EXISTS signatures
+                           (genome TEXT PRIMARY KEY, row INTEGER,
+                            created REAL, accessed REAL)'''
+
+
+# Class to hold a persistent cache of pairwise comparison results
+class ResultCache(object):
+    """Persistent SQLite cache of pairwise comparison results."""
+    def __init__(self, cachedir, max_size=None):
+        """Open (creating, if necessary) the cache in the passed directory.
+
+        - cachedir - path to the cache directory
+        - max_size - maximum size (bytes) of stored data; None for no limit
+        """
+        os.makedirs(cachedir, exist_ok=True)
+        self.path = os.path.join(cachedir, CACHE_DBNAME)
+        self.max_size = max_size
+        self.accessed = {}
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute(SQL_CREATE)
+        self.conn.commit()
+
+    def get(self, key):
+        """Return the cached tuple of values for key, or None.
+
+        The access time of the entry is written by commit().
+        """
+        row = self.conn.execute('SELECT data FROM results WHERE key=?',
+                                (key,)).fetchone()
+        if row is None:
+            return None
+        self.accessed[key] = time.time()
+        return tuple(json.loads(row[0]))
+
+    def put(self, key, components, values):
+        """Store a tuple of values in the cache.
+
+        - key - key returned by make_key()
+        - components - (genome_a, genome_b, method, params, version) tuple
+          from which the key was made, stored for reporting
+        - values - tuple of numbers describing the comparison
+        """
+        data = json.dumps([float(val) for val in values])
+        genome_a, genome_b, method, params, version = components
+        params = json.dumps(params, sort_keys=True)
+        size = len(key) + len(data) + len(params)
+        now = time.time()
+        self.conn.execute('INSERT OR REPLACE INTO results VALUES ' +
+                          '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                          (key, genome_a, genome_b, method, params, version,
+                           data, size, now, now))
+
+    def write_accessed(self):
+        """Write the access times of entries read since the last commit."""
+        self.conn.executemany('UPDATE results SET accessed=? WHERE key=?',
+                              [(accessed, key) for key, accessed in
+                               self.accessed.items()])
+        self.accessed = {}
+
+    def commit(self):
+        """Commit changes, evicting entries if the size limit is exceeded."""
+        self.write_accessed()
+        if self.max_size is not None:
+            self.prune(self.max_size)
+        self.conn.commit()
+
+    def prune(self, max_size):
+        """Evict least recently used entries until size <= max_size.
+
+        Returns the number of entries removed.
+        """
+        self.write_accessed()
+        rows = self.conn.execute('SELECT key, size FROM results ' +
+                                 'ORDER BY accessed DESC').fetchall()
+        sizes = np.cumsum([row[1] for row in rows])
+        evict = [row[0] for row, total in zip(rows, sizes)
+                 if total > max_size]
+        self.conn.executemany('DELETE FROM results WHERE key=?',
+                              [(key,) for key in evict])
+        self.conn.commit()
+        return len(evict)
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        self.conn.execute('DELETE FROM results')
+        self.conn.commit()
+        self.conn.execute('VACUUM')
+
+    def entries(self):
+        """Return list of (genome_a, genome_b, method, params, version,
+        size, accessed) tuples for cached entries, most recent first.
+        """
+        return self.conn.execute('SELECT genome_a, genome_b, method, ' +
+                                 'params, version, size, accessed ' +
+                                 'FROM results ' +
+                                 'ORDER BY accessed DESC').fetchall()
+
+    def info(self):
+        """Return dictionary describing the cache contents."""
+        count, size = self.conn.execute('SELECT COUNT(*), SUM(size) ' +
+                                        'FROM results').fetchone()
+        return {'path': self.path, 'entries': count, 'size': size or 0,
+                'file_size': os.path.getsize(self.path)}
+
+    def close(self):
+        """Commit outstanding changes and close the cache."""
+        self.commit()
+        self.conn.close()
+
+
+# Class to hold a persistent cache of per-genome TETRA signatures
+class SignatureCache(object):
+    """Persistent cache of TETRA Z-score signatures, keyed by genome hash."""
+    def __init__(self, cachedir, dbname=CACHE_DBNAME,
+                 sigfile=SIGNATURE_FILE):
+        """Open (creating, if necessary) the cache in the passed directory.
+
+        - cachedir - path to the cache directory, which may be shared with
+          a ResultCache
+        - dbname - name of the SQLite database file indexing signatures
+        - sigfile - name of the binary signature file
+        """
+        os.makedirs(cachedir, exist_ok=True)
+        self.path = os.path.join(cachedir, dbname)
+        self.sigpath = os.path.join(cachedir, sigfile)
+        self.accessed = {}
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute(SQL_CREATE_SIGNATURES)
+        self.conn.commit()
+
+    def get_row(self, genome):
+        """Return the row of the signature file for genome, or None.
+
+        The access time of the signature is written by commit().
+        """
+        row = self.conn.execute('SELECT row FROM signatures WHERE genome=?',
+                                (genome,)).fetchone()
+        if row is None:
+            return None
+        self.accessed[genome] = time.time()
+        return row[0]
+
+    def put(self, genome, signature):
+        """Store the signature array for genome; return its row.
+
+        A signature replaces any existing signature for the genome, in the
+        same row; otherwise it is written to the row after the last. The
+        row is allocated and written while holding the database write
+        lock, and indexed only once written, so that concurrent runs
+        sharing the cache cannot claim the same row. Each signature is
+        committed as it is stored. Raises a ValueError if the signature
+        does not hold SIGNATURE_LENGTH values.
+        """
+        signature = np.asarray(signature, dtype=SIGNATURE_DTYPE)
+        if signature.shape != (SIGNATURE_LENGTH,):
+            raise ValueError("TETRA signatures must hold %d values, not %s "
+                             "(%s)" % (SIGNATURE_LENGTH, signature.shape,
+                                       genome))
+        self.commit()
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = self.conn.execute('SELECT row FROM signatures ' +
+                                    'WHERE genome=?', (genome,)).fetchone()
+            if row is None:
+                row = self.conn.execute('SELECT COALESCE(MAX(row) + 1, 0) ' +
+                                        'FROM signatures').fetchone()
+            mode = 'r+b' if os.path.isfile(self.sigpath) else 'wb'
+            with open(self.sigpath, mode) as ofh:
+                ofh.seek(row[0] * signature.nbytes)
+                ofh.write(signature.tobytes())
+            now = time.time()
+            self.conn.execute('INSERT OR REPLACE INTO signatures VALUES ' +
+                              '(?, ?, ?, ?)', (genome, row[0], now, now))
+        except Exception:
+            self.conn.rollback()
+            raise
+        self.conn.commit()
+        return row[0]
+
+    def signatures(self):
+        """Return all stored signatures as a read-only memory-mapped array.
+
+        Rows are as returned by get_row() and put(); the array is empty if
+        no signatures are stored.
+        """
+        nrows = self.conn.execute('SELECT COALESCE(MAX(row) + 1, 0) ' +
+                                  'FROM signatures').fetchone()[0]
+        if not nrows:
+            return np.zeros((0, SIGNATURE_LENGTH), dtype=SIGNATURE_DTYPE)
+        return np.memmap(self.sigpath, dtype=SIGNATURE_DTYPE, mode='r',
+                         shape=(nrows, SIGNATURE_LENGTH))
+
+    def genomes(self):
+        """Return list of the genomes with stored signatures, in row order.
+
+        As rows are only ever added after the last, or reused, the list
+        labels the rows of signatures().
+        """
+        return [genome for genome, in
+                self.conn.execute('SELECT genome FROM signatures ' +
+                                  'ORDER BY row')]
+
+    def get(self, genomes):
+        """Return array of the signatures of the passed genomes, in order.
+
+        Raises a KeyError if any genome has no stored signature.
+        """
+        rows = [self.get_row(genome) for genome in genomes]
+        self.commit()
+        missing = [genome for genome, row in zip(genomes, rows) if
+                   row is None]
+        if missing:
+            raise KeyError("No TETRA signature cached for %s" % missing)
+        return np.array(self.signatures()[rows])
+
+    def info(self):
+        """Return dictionary describing the cache contents."""
+        count = self.conn.execute('SELECT COUNT(*) FROM ' +
+                                  'signatures').fetchone()[0]
+        size = 0
+        if os.path.isfile(self.sigpath):
+            size = os.path.getsize(self.sigpath)
+        return {'path': self.sigpath, 'entries': count, 'size': size}
+
+    def commit(self):
+        """Commit changes and access times to the signature index."""
+        self.conn.executemany('UPDATE signatures SET accessed=? ' +
+                              'WHERE genome=?',
+                              [(accessed, genome) for genome, accessed in
+                               self.accessed.items()])
+        self.accessed = {}
+        self.conn.commit()
+
+    def close(self):
+        """Commit outstanding changes and close the cache."""
+        self.commit()
+        self.conn.close()
+
+
+# Make a cache key for a single comparison
+def make_key(hash_a, hash_b, method, params, version, sym=True):
+    """Returns a (key, components) tuple for a comparison.
+
+    - hash_a, hash_b - content hashes of the query and subject genomes
+    - method - analysis method, e.g. ANIm
+    - params - dictionary of parameters that affect the result
+    - version - alignment tool version string
+    - sym - if True, the comparison is symmetrical, and the genome hashes
+      are placed in sorted order so that either direction gives the same key
+    """
+    if sym:
+        hash_a, hash_b = sorted((hash_a, hash_b))
+    components = (hash_a, hash_b, method, params, version)
+    key = hashlib.sha256(json.dumps(components,
+                                    sort_keys=True).encode()).hexdigest()
+    return key, components
+
+
+# Get a content hash for each input file
+def hash_files(filenames, blocksize=HASH_BLOCKSIZE):
+    """Returns dictionary of SHA256 file hashes, keyed by file stem.
+
+    - filenames - paths to input files
+    - blocksize - size (bytes) of the blocks read from each file
+    """
+    hashes = {}
+    for filename in filenames:
+        digest = hashlib.sha256()
+        with open(filename, 'rb') as ifh:
+            for block in iter(lambda: ifh.read(blocksize), b''):
+                digest.update(block)
+        stem = os.path.splitext(os.path.split(filename)[-1])[0]
+        hashes[stem] = digest.hexdigest()
+    return hashes
+
+
+# Get the version string reported by an alignment tool
+def get_tool_version(cmdline):
+    """Returns the version line from the passed version command output.
+
+    - cmdline - list of command-line arguments, e.g. ['blastn', '-version']
+
+    The first line of output that contains a digit is returned, or
+    'unknown' if the command cannot be run.
+    """
+    try:
+        result = subprocess.run(cmdline, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+    except OSError:
+        return 'unknown'
+    for line in result.stdout.decode('utf-8', 'replace').splitlines():
+        if any(char.isdigit() for char in line):
+            return line.strip()
+    return 'unknown'
+
+
+# Exchange the genome-specific values of a symmetrical cache entry
+def swap_values(values):
+    """Returns symmetrical comparison values with the genomes exchanged.
+
+    - values - (length, errors, identity) followed by pairs of values,
+      one for each genome
+    """
+    swapped = values[:3]
+    for idx in range(3, len(values), 2):
+        swapped += (values[idx + 1], values[idx])
+    return swapped
+
+
+# Look up the cached values of a single comparison
+def get_values(cache, hashes, qname, sname, method, params, version,
+               sym=True, square=True):
+    """Returns the cached values of a comparison, or None.
+
+    - square - if True, covered bases are needed for both genomes of a
+      symmetrical comparison; otherwise only for the query genome
+
+    Remaining arguments are as for find_missing(). Symmetrical values are
+    returned with the query genome first. Entries cached by rectangular
+    runs, or before covered bases were calculated, may hold NaN covered
+    bases; if any that are needed are NaN, the comparison is treated as
+    not cached, so that it is recalculated.
+    """
+    values = cache.get(make_key(hashes[qname], hashes[sname], method,
+                                params, version, sym)[0])
+    if values is None or not sym:
+        return values
+    if hashes[qname] > hashes[sname]:  # stored in hash order
+        values = swap_values(values)
+    values += (float('nan'),) * (SYM_NVALUES - len(values))
+    if np.isnan(values[5:9] if square else values[5:9:2]).any():
+        return None
+    return values
+
+
+# Identify comparisons that are not in the cache
+def find_missing(cache, hashes, pairs, method, params, version, sym=True,
+                 square=True):
+    """Returns the list of pairs not found in the cache.
+
+    - cache - ResultCache object
+    - hashes - dictionary of genome content hashes, keyed by label
+    - pairs - list of (query, subject) label tuples to be looked up
+    - method - analysis method, e.g. ANIm
+    - params - dictionary of parameters that affect the result
+    - version - alignment tool version string
+    - sym - if True, comparisons are symmetrical (ANIm); otherwise each
+      direction is cached separately (ANIb)
+    - square - if True, results are for all-vs-all comparisons (see
+      get_values())
+    """
+    missing = [(qname, sname) for qname, sname in pairs if
+               get_values(cache, hashes, qname, sname, method, params,
+                          version, sym, square) is None]
+    cache.commit()
+    return missing
+
+
+# Fill an ANIResults object with cached comparison results
+def fetch_results(cache, results, hashes, pairs, params, version, sym=True):
+    """Populates results with cached values; returns pairs not found.
+
+    - cache - ResultCache object
+    - results - ANIResults object to be populated
+    - hashes - dictionary of genome content hashes, keyed by label
+    - pairs - list of (query, subject) label tuples to be looked up
+    - params - dictionary of parameters that affect the result
+    - version - alignment tool version string
+    - sym - if True, comparisons are symmetrical (ANIm); otherwise each
+      direction is cached separately (ANIb)
+
+    Entries without the covered bases needed by results are returned as
+    not found (see get_values()).
+    """
+    rows = {label: idx for idx, label in
+            enumerate(results.alignment_lengths.index)}
+    cols = {label: idx for idx, label in
+            enumerate(results.alignment_lengths.columns)}
+    found, missing = [], []
+    for qname, sname in pairs:
+        values = get_values(cache, hashes, qname, sname, results.mode,
+                            params, version, sym, results.square)
+        if values is None:
+            missing.append((qname, sname))
+            continue
+        found.append((rows[qname], cols[sname]) + values)
+    cache.commit()
+    if found:
+        data = np.array(found, dtype=float)
+        qidx, sidx = data[:, 0].astype(int), data[:, 1].astype(int)
+        results.add_bulk(qidx, sidx, data[:, 2], data[:, 3], data[:, 4],
+                         data[:, 5], data[:, 6] if sym else None, sym=sym)
+        if sym:
+            results.add_covered_bases(qidx, sidx, data[:, 7], data[:, 9],
+                                      data[:, 8], data[:, 10])
+    return missing
+
+
+# Store comparison results from an ANIResults object in the cache
+def store_results(cache, results, hashes, pairs, params, version, sym=True,
+                  org_lengths=None):
+    """Stores results for the passed pairs in the cache.
+
+    - cache - ResultCache object
+    - results - ANIResults object holding calculated results
+    - hashes - dictionary of genome content hashes, keyed by label
+    - pairs - list of (query, subject) label tuples to be stored
+    - params - dictionary of parameters that affect the result
+    - version - alignment tool version string
+    - sym - if True, comparisons are symmetrical (ANIm); otherwise each
+      direction is cached separately (ANIb)
+
+    - org_lengths - dictionary of genome lengths, keyed by label; needed
+      for symmetrical comparisons in rectangular results, which do not
+      hold the subject coverage
+
+    Comparisons with no alignment (e.g. failed runs) are not stored.
+    Subject covered bases are not held in rectangular results, and are
+    stored as NaN. Returns the number of comparisons stored.
+    """
+    count = 0
+    for qname, sname in pairs:
+        values = (results.alignment_lengths.loc[qname, sname],
+                  results.similarity_errors.loc[qname, sname],
+                  results.percentage_identity.loc[qname, sname],
+                  results.alignment_coverage.loc[qname, sname])
+        if np.isnan(values[0]) or values[0] == 0:
+            continue
+        if sym:
+            qbases = results.covered_bases.loc[qname, sname]
+            qfraction = results.covered_fraction.loc[qname, sname]
+            if results.square:
+                values += (results.alignment_coverage.loc[sname, qname],
+                           qbases, results.covered_bases.loc[sname, qname],
+                           qfraction,
+                           results.covered_fraction.loc[sname, qname])
+            else:
+                values += (values[0] / org_lengths[sname],
+                           qbases, float('nan'), qfraction, float('nan'))
+            if hashes[qname] > hashes[sname]:  # store in hash order
+                qname, sname = sname, qname
+                values = swap_values(values)
+        key, components = make_key(hashes[qname], hashes[sname],
+                                   results.mode, params, version, sym)
+        cache.put(key, components, values)
+        count += 1
+    cache.commit()
+    return count
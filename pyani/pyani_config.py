@@ -19,10 +19,33 @@ BLASTALL_DEFAULT = "blastall"
 FORMATDB_DEFAULT = "formatdb"
 QSUB_DEFAULT = "qsub"
 
+# Earliest NUCmer major version (MUMmer 4) that can align with multiple
+# threads
+NUCMER_THREADS_VERSION = 4
+
+# Engines available to apply the ANIm 1-to-1 alignment filter
+FILTER_ENGINES = ("delta-filter", "native")
+FILTER_ENGINE_DEFAULT = "delta-filter"
+
+# Separator between genome file stem and sequence ID in the tagged headers
+# of batched NUCmer query files and combined BLAST databases
+BATCH_TAG_SEP = "::"
+
+# Extension for binary sidecars of parsed comparison output files
+SIDECAR_EXT = ".npz"
+
+# Name of the binary file of ANIb fragment lengths in the BLAST output
+# directory
+FRAGLENGTHS_FILE = "fraglengths.npz"
+
+# Extension for archives of comparison output directories
+ARCHIVE_EXT = ".zip"
+
 # Stems for output files
 ANIM_FILESTEMS = ("ANIm_alignment_lengths", "ANIm_percentage_identity",
                   "ANIm_alignment_coverage", "ANIm_similarity_errors",
-                  "ANIm_hadamard")
+                  "ANIm_hadamard", "ANIm_covered_bases",
+                  "ANIm_covered_fraction")
 ANIB_FILESTEMS = ("ANIb_alignment_lengths", "ANIb_percentage_identity",
                   "ANIb_alignment_coverage", "ANIb_similarity_errors",
                   "ANIb_hadamard")
@@ -33,11 +56,21 @@ ANIBLASTALL_FILESTEMS = ("ANIblastall_alignment_lengths",
                          "ANIblastall_similarity_errors",
                          "ANIblastall_hadamard")
 
+# Stem (following the method name) of the output file listing comparisons
+# that were not computed, and the status recorded for comparisons removed
+# by the TETRA prefilter
+NOT_COMPUTED_FILESTEM = "not_computed"
+PREFILTERED = "not computed (prefiltered)"
+
 # Output subdirectory names for each method
 ALIGNDIR = {'ANIm': 'nucmer_output',
             'ANIb': 'blastn_output',
             'ANIblastall': 'blastall_output'}
 
+# Subdirectory of the NUCmer/BLAST output directory for batched NUCmer
+# runs and combined BLAST databases
+BATCHDIR = 'batches'
+
 # Any valid matplotlib colour map can be used here
 # See, e.g. http://matplotlib.org/xkcd/examples/color/colormaps_reference.html
 MPL_CBAR = 'Spectral'
@@ -120,6 +153,9 @@ def params_mpl(df):
             'ANIm_hadamard': ('hadamard_BuRd', 0, 1),
             'ANIm_similarity_errors': ('afmhot', df.values.min(),
                                        df.values.max()),
+            'ANIm_covered_bases': ('afmhot', df.values.min(),
+                                   df.values.max()),
+            'ANIm_covered_fraction': ('BuRd', 0, 1),
             'TETRA_correlations': ('spbnd_BuRd', 0, 1),
             'ANIblastall_alignment_lengths': ('afmhot', df.values.min(),
                                               df.values.max()),
@@ -50,3 +50,26 @@ def get_sequence_lengths(fastafilenames):
         tot_lengths[os.path.splitext(os.path.split(fn)[-1])[0]] = \
             sum([len(s) for s in SeqIO.parse(fn, 'fasta')])
     return tot_lengths
+
+
+# Generate the pairs of input files to be compared
+def get_pairwise_files(filenames, pairs=None):
+    """Returns list of (filename, filename) tuples for pairwise comparison.
+
+    - filenames - a list of paths to input FASTA files
+    - pairs - collection of (file stem, file stem) comparisons to be
+      retained; None to retain all pairwise comparisons
+    """
+    filepairs = []
+    for idx, fname1 in enumerate(filenames[:-1]):
+        for fname2 in filenames[idx+1:]:
+            if pairs is None or \
+               (get_file_stem(fname1), get_file_stem(fname2)) in pairs:
+                filepairs.append((fname1, fname2))
+    return filepairs
+
+
+# Get the stem of a filename, as used to label its organism
+def get_file_stem(filename):
+    """Returns the passed filename, without path or extension."""
+    return os.path.splitext(os.path.split(filename)[-1])[0]
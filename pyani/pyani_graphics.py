@@ -107,12 +107,14 @@ def get_seaborn_clustermap(dfr, params, title=None, annot=True):
                          cmap=params.cmap,
                          vmin=params.vmin,
                          vmax=params.vmax,
-                         col_colors=params.colorbar,
+                         col_colors=params.col_colorbar,
                          row_colors=params.colorbar,
+                         row_cluster=dfr.shape[0] > 1,
+                         col_cluster=dfr.shape[1] > 1,
                          figsize=(params.figsize,
                                   params.figsize),
                          linewidths=params.linewidths,
-                         xticklabels=params.labels,
+                         xticklabels=params.collabels,
                          yticklabels=params.labels,
                          annot=annot)
     fig.cax.yaxis.set_label_position('left')
@@ -140,24 +142,28 @@ def heatmap_seaborn(dfr, outfilename=None, title=None, params=None):
     # aesthetics, and a maximum to avoid core dumps on rendering.
     # If we hit the maximum size, we should modify font size.
     maxfigsize = 120
-    calcfigsize = dfr.shape[0] * 1.1
+    calcfigsize = max(dfr.shape) * 1.1
     figsize = min(max(8, calcfigsize), maxfigsize)
     if figsize == maxfigsize:
         scale = maxfigsize/calcfigsize
         sns.set_context("notebook", font_scale=scale)
 
-    # Add a colorbar?
+    # Add a colorbar? Rows and columns are labelled separately, as the
+    # dataframe may be rectangular (queries vs references)
     if params.classes is None:
-        col_cb = None
+        row_cb, col_cb = None, None
     else:
-        col_cb = get_seaborn_colorbar(dfr, params.classes)
+        row_cb = get_seaborn_colorbar(dfr, params.classes)
+        col_cb = get_seaborn_colorbar(dfr.T, params.classes)
 
     # Labels are defined before we build the clustering
     # If a label mapping is missing, use the key text as fall back
+    params.collabels = get_safe_seaborn_labels(dfr.T, params.labels)
     params.labels = get_safe_seaborn_labels(dfr, params.labels)
 
     # Add attributes to parameter object, and draw heatmap
-    params.colorbar = col_cb
+    params.colorbar = row_cb
+    params.col_colorbar = col_cb
     params.figsize = figsize
     params.linewidths = 0.25
     fig = get_seaborn_clustermap(dfr, params, title=title)
@@ -197,9 +203,12 @@ def add_mpl_dendrogram(dfr, fig, heatmap_gs, orientation='col'):
                                              wspace=0.0, hspace=0.1,
                                              height_ratios=height_ratios)
     dend_axes = fig.add_subplot(gspec[0, 0])
-    dend = sch.dendrogram(sch.linkage(dists, method='complete'),
-                          color_threshold=np.inf,
-                          orientation=orient)
+    if len(dists) > 1:
+        dend = sch.dendrogram(sch.linkage(dists, method='complete'),
+                              color_threshold=np.inf,
+                              orientation=orient)
+    else:  # A single row or column cannot be clustered
+        dend = {'leaves': [0]}
     clean_axis(dend_axes)
     return {'dendrogram': dend,
             'gridspec': gspec}
@@ -210,7 +219,7 @@ def get_mpl_heatmap_axes(dfr, fig, heatmap_gs):
     """Return axis for Matplotlib heatmap."""
     # Create heatmap axis
     heatmap_axes = fig.add_subplot(heatmap_gs[1, 1])
-    heatmap_axes.set_xticks(np.linspace(0, dfr.shape[0]-1, dfr.shape[0]))
+    heatmap_axes.set_xticks(np.linspace(0, dfr.shape[1]-1, dfr.shape[1]))
     heatmap_axes.set_yticks(np.linspace(0, dfr.shape[0]-1, dfr.shape[0]))
     heatmap_axes.grid('off')
     heatmap_axes.xaxis.tick_bottom()
@@ -220,7 +229,12 @@ def get_mpl_heatmap_axes(dfr, fig, heatmap_gs):
 
 def add_mpl_colorbar(dfr, fig, dend, params, orientation='row'):
     """Add class colorbars to Matplotlib heatmap."""
-    for name in dfr.index[dend['dendrogram']['leaves']]:
+    # Row colourbars label the dataframe rows, column colourbars the columns
+    if orientation == 'row':
+        names = dfr.index[dend['dendrogram']['leaves']]
+    else:
+        names = dfr.columns[dend['dendrogram']['leaves']]
+    for name in names:
         if name not in params.classes:
             params.classes[name] = name
 
@@ -230,7 +244,7 @@ def add_mpl_colorbar(dfr, fig, dend, params, orientation='row'):
 
     # colourbar
     cblist = []
-    for name in dfr.index[dend['dendrogram']['leaves']]:
+    for name in names:
         try:
             cblist.append(classdict[params.classes[name]])
         except KeyError:
@@ -308,8 +322,8 @@ def heatmap_mpl(dfr, outfilename=None, title=None, params=None):
                 labels
     """
     # Layout figure grid and add title
-    # Set figure size by the number of rows in the dataframe
-    figsize = max(8, dfr.shape[0] * 0.175)
+    # Set figure size by the number of rows or columns in the dataframe
+    figsize = max(8, max(dfr.shape) * 0.175)
     fig = plt.figure(figsize=(figsize, figsize))
     # if title:
     #     fig.suptitle(title)
@@ -325,8 +339,8 @@ def heatmap_mpl(dfr, outfilename=None, title=None, params=None):
 
     # Add heatmap axes to figure, with rows/columns as in the dendrograms
     heatmap_axes = get_mpl_heatmap_axes(dfr, fig, heatmap_gs)
-    ax_map = heatmap_axes.imshow(dfr.ix[rowdend['dendrogram']['leaves'],
-                                        coldend['dendrogram']['leaves']],
+    ax_map = heatmap_axes.imshow(dfr.iloc[rowdend['dendrogram']['leaves'],
+                                          coldend['dendrogram']['leaves']],
                                  interpolation='nearest',
                                  cmap=params.cmap, origin='lower',
                                  vmin=params.vmin, vmax=params.vmax,
@@ -342,7 +356,7 @@ def heatmap_mpl(dfr, outfilename=None, title=None, params=None):
     # Add heatmap labels
     add_mpl_labels(heatmap_axes,
                    dfr.index[rowdend['dendrogram']['leaves']],
-                   dfr.index[coldend['dendrogram']['leaves']],
+                   dfr.columns[coldend['dendrogram']['leaves']],
                    params)
 
 
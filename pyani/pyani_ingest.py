@@ -0,0 +1,172 @@
+# Copyright 2017, The James Hutton Insitute
+# Author: Leighton Pritchard
+#
+# This code is part of the pyani package, and is governed by its licence.
+# Please see the LICENSE file that should have been included as part of
+# this package.
+
+"""Code to parse pairwise comparison output files in parallel.
+
+ANIm and ANIb produce one output file per pairwise comparison, and every
+one of these must be parsed before the result matrices can be assembled.
+For large numbers of input genomes this step can dominate runtime, so the
+parsing is distributed over a pool of worker processes.
+
+Each task passed to a worker describes a single output file. The worker
+parses the file and returns compact numeric tuples of the form
+(query index, subject index, value, value, ...), which are collected by
+the parent process into a single NumPy array so that the result matrices
+can be populated in bulk.
+
+Parsed values can also be stored in a small binary sidecar (a NumPy .npz
+file) alongside each output file, so that later passes over the same
+output (e.g. with --skip_nucmer, or different ANIb thresholds) read the
+sidecar rather than reparsing the text file.
+"""
+
+import multiprocessing
+import os
+import zipfile
+
+import numpy as np
+
+from . import pyani_config
+
+# Parser used by worker processes; set once per worker by _init_worker()
+_PARSER = None
+
+
+def _init_worker(parser):
+    """Store the parser function in a worker process."""
+    global _PARSER  # pylint: disable=global-statement
+    _PARSER = parser
+
+
+def _run_parser(task):
+    """Apply the worker's parser to a single task."""
+    return _PARSER(task)
+
+
+# Parse a collection of output files, in parallel
+def ingest(tasks, parser, ncols, workers=None, chunksize=None):
+    """Returns a 2D array of values obtained by parsing the passed tasks.
+
+    - tasks - list of tasks, each describing one file to be parsed
+    - parser - function taking a single task and returning an iterable of
+      rows; each row is a tuple of ncols numbers, the first two of which
+      are the query and subject indices. This must be picklable (i.e. a
+      module-level function, or functools.partial of one).
+    - ncols - the number of values in each row
+    - workers - number of worker processes (None: all available cores;
+      1: parse in the calling process)
+    - chunksize - number of tasks passed to a worker at a time (None:
+      chosen so that each worker receives around four chunks)
+
+    Rows are returned in the same order as the tasks that produced them.
+    """
+    if workers == 1 or len(tasks) < 2:
+        rows = [row for task in tasks for row in parser(task)]
+    else:
+        if chunksize is None:
+            nworkers = workers or multiprocessing.cpu_count()
+            chunksize = max(1, len(tasks) // (4 * nworkers))
+        with multiprocessing.Pool(processes=workers,
+                                  initializer=_init_worker,
+                                  initargs=(parser,)) as pool:
+            rows = [row for result in pool.imap(_run_parser, tasks,
+                                                chunksize)
+                    for row in result]
+    return np.array(rows, dtype=float).reshape(-1, ncols)
+
+
+# Build parsing tasks from a list of org1_vs_org2 output files
+def get_comparison_tasks(filenames, labels, logger=None, columns=None):
+    """Returns list of (query index, subject index, filename) tasks.
+
+    - filenames - paths to comparison output files
+    - labels - list of organism labels; indices refer to this list
+    - logger - a logger for messages
+    - columns - list of subject organism labels, if these differ from the
+      query labels; subject indices then refer to this list
+
+    Output filenames are assumed to have the format org1_vs_org2.ext. Files
+    whose query or subject is not in the list of labels (e.g. from other
+    analyses in the same directory) are skipped, with a warning.
+    """
+    index = {label: idx for idx, label in enumerate(labels)}
+    if columns is None:
+        sindex = index
+    else:
+        sindex = {label: idx for idx, label in enumerate(columns)}
+    tasks = []
+    for filename in filenames:
+        qname, sname = get_comparison_names(filename)
+        if qname not in index:
+            if logger:
+                logger.warning("Query name %s not in input " % qname +
+                               "sequence list, skipping %s" % filename)
+            continue
+        if sname not in sindex:
+            if logger:
+                logger.warning("Subject name %s not in input " % sname +
+                               "sequence list, skipping %s" % filename)
+            continue
+        tasks.append((index[qname], sindex[sname], filename))
+    return tasks
+
+
+# Get query and subject names from an org1_vs_org2 output filename
+def get_comparison_names(filename):
+    """Returns (query, subject) names from an org1_vs_org2.ext filename."""
+    qname, sname = \
+        os.path.splitext(os.path.split(filename)[-1])[0].split('_vs_')
+    return qname, sname
+
+
+# Get the path to the binary sidecar of a comparison output file
+def get_sidecar_path(filename):
+    """Returns the path to the binary sidecar of the passed file."""
+    return filename + pyani_config.SIDECAR_EXT
+
+
+# Read arrays from the binary sidecar of a comparison output file
+def read_sidecar(filename, *names):
+    """Returns dictionary of named arrays from the sidecar of a file, or None.
+
+    - filename - path to the parsed comparison output file (not the sidecar)
+    - *names - names of the arrays to be returned
+
+    None is returned if the sidecar does not exist, cannot be read, lacks
+    any of the named arrays, or was written for a version of the output
+    file with a different modification time or size.
+    """
+    try:
+        stat = os.stat(filename)
+        with np.load(get_sidecar_path(filename), allow_pickle=False) as data:
+            if int(data['source_mtime']) != stat.st_mtime_ns or \
+               int(data['source_size']) != stat.st_size:
+                return None
+            return {name: data[name] for name in names}
+    except (OSError, EOFError, KeyError, ValueError, zipfile.BadZipFile):
+        return None
+
+
+# Write arrays to the binary sidecar of a comparison output file
+def write_sidecar(filename, **arrays):
+    """Writes the passed arrays to the sidecar of the passed file.
+
+    - filename - path to the parsed comparison output file (not the sidecar)
+    - **arrays - arrays to be stored, keyed by name
+
+    The modification time and size of the output file are stored with the
+    arrays, so that stale sidecars are ignored by read_sidecar(). The
+    sidecar is written to a temporary file and moved into place, so that
+    a partially-written sidecar is never read.
+    """
+    stat = os.stat(filename)
+    sidecar = get_sidecar_path(filename)
+    tmpname = "%s.%d.tmp" % (sidecar, os.getpid())
+    with open(tmpname, 'wb') as ofh:
+        np.savez(ofh, source_mtime=stat.st_mtime_ns,
+                 source_size=stat.st_size, **arrays)
+    os.replace(tmpname, sidecar)
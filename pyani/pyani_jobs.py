@@ -16,11 +16,8 @@ the Job will not be executed until its dependency is executed.
 
 When used in ANI analysis, the way jobs are used depends on the scheduler.
 
-With multiprocessing, we place all root jobs in a single pool; then all
-first-level dependencies will go in a second (dependent) pool that is not run
-until the first is completed, and so on. It's not very efficient, but should
-work equivalently to the original code that handled asynchronous pools
-directly.
+With multiprocessing, jobs are run by a single pool of workers, and each
+job is started as soon as all of its own dependencies have completed.
 
 With SGE, the dependencies can be managed independently, and effectively
 interleaved by the scheduler with no need for pools.
@@ -44,16 +41,21 @@ class Job:
     """Objects in this class represent individual jobs to be run, with a list
     of dependencies (jobs that must be run first).
     """
-    def __init__(self, name, command, queue=None):
+    def __init__(self, name, command, queue=None, cost=0, threads=1):
         """Instantiates a Job object.
 
         - name           String describing the job (uniquely)
         - command        String, the valid shell command to run the job
         - queue          String, the SGE queue under which the job shall run
+        - cost           Number, estimated relative cost of running the job;
+                         schedulers start the most costly jobs first
+        - threads        Integer, number of threads used by the command
         """
         self.name = name                 # Unique name for the job
         self.queue = queue               # The SGE queue to run the job under
         self.command = command           # Command line to run for this job
+        self.cost = cost                 # Estimated relative cost of the job
+        self.threads = threads           # Threads used by the command
         self.script = command
         self.scriptPath = None           # Will hold path to the script file
         self.dependencies = []           # List of jobs to be completed first
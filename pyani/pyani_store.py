@@ -0,0 +1,319 @@
+# Copyright 2017, The James Hutton Insitute
+# Author: Leighton Pritchard
+#
+# This code is part of the pyani package, and is governed by its licence.
+# Please see the LICENSE file that should have been included as part of
+# this package.
+
+"""Code to keep ANIb input artefacts between pyani runs.
+
+Before any BLAST search is run, ANIb fragments every input genome and
+builds a BLAST database for it. These artefacts depend only on the genome
+contents and a few parameters, so they are kept in a persistent store and
+linked into the output directory of later runs, rather than regenerated.
+
+Each store entry is a directory of files, keyed by the content (SHA256
+hash) of the genome, the kind of artefact, and the parameters that affect
+it:
+
+- fragments - the fragmented genome and its fragment lengths, keyed by
+  fragment size
+- blastdb - the BLAST database files, keyed by method, BLAST tool version
+  and database filename (BLAST+ databases refer to their own filenames,
+  and cannot be renamed)
+
+Entries are indexed in an SQLite database, in the manner of
+pyani_cache.ResultCache, and the store can be limited in size: least
+recently used entries are evicted when the stored files exceed the limit.
+As in the cache, lookups do not write to the index; access times are
+written when the store is committed.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import time
+
+import numpy as np
+
+# Name of the SQLite index file within a store directory
+STORE_DBNAME = 'pyani_store.sqlite'
+
+# Names of files within a fragments entry
+FRAGMENT_FILE = 'fragments.fna'
+FRAGLENGTH_FILE = 'fraglengths.npy'
+
+SQL_CREATE = '''CREATE TABLE IF NOT EXISTS artefacts
+                (key TEXT PRIMARY KEY, genome TEXT, kind TEXT,
+                 params TEXT, version TEXT, size INTEGER, created REAL,
+                 accessed REAL)'''
+
+
+# Class to hold a persistent store of ANIb input artefacts
+class ArtefactStore(object):
+    """Persistent store of files derived from input genomes."""
+    def __init__(self, storedir, max_size=None):
+        """Open (creating, if necessary) the store in the passed directory.
+
+        - storedir - path to the store directory
+        - max_size - maximum size (bytes) of stored files; None for no limit
+        """
+        os.makedirs(storedir, exist_ok=True)
+        self.storedir = storedir
+        self.path = os.path.join(storedir, STORE_DBNAME)
+        self.max_size = max_size
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute(SQL_CREATE)
+        self.conn.commit()
+        self.accessed = {}  # access times of entries read since commit
+        self.removed = set()  # entries found removed from outside the store
+
+    def get(self, key):
+        """Return the path to the directory of entry key, or None."""
+        row = self.conn.execute('SELECT key FROM artefacts WHERE key=?',
+                                (key,)).fetchone()
+        if row is None:
+            return None
+        entrydir = os.path.join(self.storedir, key)
+        if not os.path.isdir(entrydir):  # removed from outside the store
+            self.removed.add(key)
+            return None
+        self.accessed[key] = time.time()
+        return entrydir
+
+    def put(self, key, components, filenames):
+        """Copy files into the store as entry key; return the entry path.
+
+        - key - key returned by make_key()
+        - components - (genome, kind, params, version) tuple from which
+          the key was made, stored for reporting
+        - filenames - dictionary of paths to the files to be stored, keyed
+          by their names within the entry
+
+        The files are copied to a temporary directory, which is moved into
+        place when complete.
+        """
+        entrydir = os.path.join(self.storedir, key)
+        tmpdir = "%s.%d.tmp" % (entrydir, os.getpid())
+        os.makedirs(tmpdir, exist_ok=True)
+        size = 0
+        for name, filename in filenames.items():
+            shutil.copyfile(filename, os.path.join(tmpdir, name))
+            size += os.path.getsize(filename)
+        if os.path.isdir(entrydir):
+            shutil.rmtree(entrydir)
+        os.replace(tmpdir, entrydir)
+        genome, kind, params, version = components
+        now = time.time()
+        self.accessed.pop(key, None)
+        self.removed.discard(key)
+        self.conn.execute('INSERT OR REPLACE INTO artefacts VALUES ' +
+                          '(?, ?, ?, ?, ?, ?, ?, ?)',
+                          (key, genome, kind,
+                           json.dumps(params, sort_keys=True), version,
+                           size, now, now))
+        return entrydir
+
+    def write_accessed(self):
+        """Write access times and removals of entries read since commit."""
+        self.conn.executemany('UPDATE artefacts SET accessed=? WHERE key=?',
+                              [(accessed, key) for key, accessed in
+                               self.accessed.items()])
+        self.conn.executemany('DELETE FROM artefacts WHERE key=?',
+                              [(key,) for key in self.removed])
+        self.accessed, self.removed = {}, set()
+
+    def commit(self):
+        """Commit changes, evicting entries if the size limit is exceeded."""
+        self.write_accessed()
+        if self.max_size is not None:
+            self.prune(self.max_size)
+        self.conn.commit()
+
+    def prune(self, max_size):
+        """Evict least recently used entries until size <= max_size.
+
+        Returns the number of entries removed.
+        """
+        self.write_accessed()
+        rows = self.conn.execute('SELECT key, size FROM artefacts ' +
+                                 'ORDER BY accessed DESC').fetchall()
+        sizes = np.cumsum([row[1] for row in rows])
+        evict = [row[0] for row, total in zip(rows, sizes)
+                 if total > max_size]
+        for key in evict:
+            shutil.rmtree(os.path.join(self.storedir, key),
+                          ignore_errors=True)
+        self.conn.executemany('DELETE FROM artefacts WHERE key=?',
+                              [(key,) for key in evict])
+        self.conn.commit()
+        return len(evict)
+
+    def info(self):
+        """Return dictionary describing the store contents."""
+        count, size = self.conn.execute('SELECT COUNT(*), SUM(size) ' +
+                                        'FROM artefacts').fetchone()
+        return {'path': self.path, 'entries': count, 'size': size or 0}
+
+    def close(self):
+        """Commit outstanding changes and close the store."""
+        self.commit()
+        self.conn.close()
+
+
+# Make a store key for a single artefact
+def make_key(genome, kind, params, version=''):
+    """Returns a (key, components) tuple for an artefact.
+
+    - genome - content hash of the input genome
+    - kind - kind of artefact, e.g. fragments
+    - params - dictionary of parameters that affect the artefact
+    - version - tool version string, if the artefact depends on it
+    """
+    components = (genome, kind, params, version)
+    key = hashlib.sha256(json.dumps(components,
+                                    sort_keys=True).encode()).hexdigest()
+    return key, components
+
+
+# Link a stored file into place, copying if it cannot be linked
+def link_file(filename, linkname):
+    """Hard links filename to linkname, or copies it across filesystems."""
+    if os.path.exists(linkname):
+        os.remove(linkname)
+    try:
+        os.link(filename, linkname)
+    except OSError:
+        shutil.copyfile(filename, linkname)
+
+
+# Link stored fragment files into an output directory
+def fetch_fragments(store, infiles, hashes, outdir, fragsize):
+    """Returns (fragment files, fragment lengths, missing input files).
+
+    - store - ArtefactStore object
+    - infiles - paths to input FASTA files
+    - hashes - dictionary of genome content hashes, keyed by file stem
+    - outdir - path to the directory for fragment files
+    - fragsize - size of sequence fragments
+
+    Fragment files found in the store are linked into outdir, with the
+    names written by anib.fragment_fasta_files(). Fragment files and
+    lengths are keyed by file stem; input files with no stored fragments
+    are returned in input order.
+    """
+    os.makedirs(outdir, exist_ok=True)
+    fragfiles, fraglengths, missing = {}, {}, []
+    for infile in infiles:
+        stem, ext = os.path.splitext(os.path.split(infile)[-1])
+        entrydir = store.get(make_key(hashes[stem], 'fragments',
+                                      {'fragsize': fragsize})[0])
+        if entrydir is None:
+            missing.append(infile)
+            continue
+        fragfiles[stem] = os.path.join(outdir, stem + '-fragments' + ext)
+        link_file(os.path.join(entrydir, FRAGMENT_FILE), fragfiles[stem])
+        fraglengths[stem] = np.load(os.path.join(entrydir, FRAGLENGTH_FILE),
+                                    allow_pickle=False)
+    store.commit()
+    return fragfiles, fraglengths, missing
+
+
+# Store newly-written fragment files
+def store_fragments(store, fragfiles, fraglengths, hashes, fragsize):
+    """Stores fragment files and their lengths; returns the number stored.
+
+    - store - ArtefactStore object
+    - fragfiles - paths to fragment files written by
+      anib.fragment_fasta_files()
+    - fraglengths - dictionary of fragment length arrays, keyed by file
+      stem
+    - hashes - dictionary of genome content hashes, keyed by file stem
+    - fragsize - size of sequence fragments
+    """
+    for fragfile in fragfiles:
+        stem = os.path.splitext(os.path.split(fragfile)[-1])[0].replace(
+            '-fragments', '')
+        lengthfile = "%s.%d.npy" % (fragfile, os.getpid())
+        with open(lengthfile, 'wb') as ofh:
+            np.save(ofh, fraglengths[stem])
+        key, components = make_key(hashes[stem], 'fragments',
+                                   {'fragsize': fragsize})
+        store.put(key, components, {FRAGMENT_FILE: fragfile,
+                                    FRAGLENGTH_FILE: lengthfile})
+        os.remove(lengthfile)
+    store.commit()
+    return len(fragfiles)
+
+
+# Get the store key for the BLAST database of an input file
+def get_blastdb_key(stem, dbname, hashes, mode, version):
+    """Returns the (key, components) tuple for a BLAST database."""
+    return make_key(hashes[stem], 'blastdb',
+                    {'mode': mode, 'name': os.path.split(dbname)[-1]},
+                    version)
+
+
+# Link stored BLAST databases into an output directory
+def fetch_blastdbs(store, infiles, hashes, blastcmds, mode, version):
+    """Returns the set of database names linked from the store.
+
+    - store - ArtefactStore object
+    - infiles - paths to input FASTA files
+    - hashes - dictionary of genome content hashes, keyed by file stem
+    - blastcmds - BLASTcmds object used to name the databases
+    - mode - ANIb or ANIblastall
+    - version - BLAST tool version string
+
+    Database files found in the store are linked into place, so that the
+    corresponding database-building jobs need not be run.
+    """
+    found = set()
+    for infile in infiles:
+        stem = os.path.splitext(os.path.split(infile)[-1])[0]
+        dbname = blastcmds.get_db_name(infile)
+        entrydir = store.get(get_blastdb_key(stem, dbname, hashes, mode,
+                                             version)[0])
+        if entrydir is None:
+            continue
+        os.makedirs(os.path.dirname(dbname), exist_ok=True)
+        for name in os.listdir(entrydir):
+            link_file(os.path.join(entrydir, name),
+                      os.path.join(os.path.dirname(dbname), name))
+        found.add(dbname)
+    store.commit()
+    return found
+
+
+# Store newly-built BLAST databases
+def store_blastdbs(store, infiles, hashes, blastcmds, mode, version):
+    """Stores BLAST database files; returns the number of databases stored.
+
+    - store - ArtefactStore object
+    - infiles - paths to input FASTA files whose databases were built
+    - hashes - dictionary of genome content hashes, keyed by file stem
+    - blastcmds - BLASTcmds object used to name the databases
+    - mode - ANIb or ANIblastall
+    - version - BLAST tool version string
+
+    The database files are those named <database name>.*; databases with
+    no index (.nin or, for multiple volumes, .nal) file, e.g. from failed
+    builds, are not stored.
+    """
+    count = 0
+    for infile in infiles:
+        stem = os.path.splitext(os.path.split(infile)[-1])[0]
+        dbname = blastcmds.get_db_name(infile)
+        dbfiles = glob.glob(glob.escape(dbname) + '.*')
+        if dbname + '.nin' not in dbfiles and dbname + '.nal' not in dbfiles:
+            continue
+        key, components = get_blastdb_key(stem, dbname, hashes, mode,
+                                          version)
+        store.put(key, components, {os.path.split(fname)[-1]: fname for
+                                    fname in dbfiles})
+        count += 1
+    store.commit()
+    return count
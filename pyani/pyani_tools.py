@@ -14,19 +14,54 @@ from . import pyani_config
 # Class to hold ANI dataframe results
 class ANIResults(object):
     """Holds ANI dataframe results."""
-    def __init__(self, labels, mode):
-        """Initialise with four empty, labelled dataframes."""
-        self.alignment_lengths = pd.DataFrame(index=labels, columns=labels,
+    def __init__(self, labels, mode, columns=None):
+        """Initialise with six empty, labelled dataframes.
+
+        - labels - sequence labels for the dataframe rows (and columns)
+        - mode - ANI method
+        - columns - sequence labels for the dataframe columns, if these
+          differ from the rows (e.g. query genomes compared against a
+          reference panel); the dataframes are then rectangular
+        """
+        if columns is None:
+            columns = labels
+        self.alignment_lengths = pd.DataFrame(index=labels, columns=columns,
                                               dtype=float)
-        self.similarity_errors = pd.DataFrame(index=labels, columns=labels,
+        self.similarity_errors = pd.DataFrame(index=labels, columns=columns,
                                               dtype=float).fillna(0)
-        self.percentage_identity = pd.DataFrame(index=labels, columns=labels,
+        self.percentage_identity = pd.DataFrame(index=labels,
+                                                columns=columns,
                                                 dtype=float).fillna(1.0)
-        self.alignment_coverage = pd.DataFrame(index=labels, columns=labels,
+        self.alignment_coverage = pd.DataFrame(index=labels, columns=columns,
                                                dtype=float).fillna(1.0)
+        self.covered_bases = pd.DataFrame(index=labels, columns=columns,
+                                          dtype=float)
+        self.covered_fraction = pd.DataFrame(index=labels, columns=columns,
+                                             dtype=float)
+        self.not_computed = {}
         self.zero_error = False
         self.mode = mode
 
+    @property
+    def square(self):
+        """Return True if rows and columns describe the same sequences."""
+        return list(self.alignment_lengths.index) == \
+            list(self.alignment_lengths.columns)
+
+    def add_org_lengths(self, org_lengths):
+        """Add sequence lengths as self-alignment lengths.
+
+        - org_lengths - dictionary of sequence lengths, keyed by label
+
+        Only sequences that label both a row and a column are assigned.
+        """
+        for org, length in list(org_lengths.items()):
+            if org in self.alignment_lengths.index and \
+               org in self.alignment_lengths.columns:
+                self.alignment_lengths.loc[org, org] = length
+                self.covered_bases.loc[org, org] = length
+                self.covered_fraction.loc[org, org] = 1.0
+
     def add_tot_length(self, qname, sname, value, sym=True):
         """Add a total length value to self.alignment_lengths."""
         self.alignment_lengths.loc[qname, sname] = value
@@ -51,20 +86,121 @@ class ANIResults(object):
         if scover:
             self.alignment_coverage.loc[sname, qname] = scover
 
+    def add_bulk(self, rows, cols, tot_lengths, sim_errors, pids, qcovers,
+                 scovers=None, sym=True):
+        """Add arrays of values for many comparisons at once.
+
+        - rows - integer positions of the query sequences
+        - cols - integer positions of the subject sequences
+        - tot_lengths, sim_errors, pids - arrays of values for each
+          comparison; assigned symmetrically if sym is True
+        - qcovers - array of query coverage values
+        - scovers - array of subject coverage values (optional)
+
+        Rectangular results have no transposed cells, so values are never
+        assigned symmetrically, and subject coverage is not assigned.
+        """
+        if not self.square:
+            sym, scovers = False, None
+        self.alignment_lengths = set_cells(self.alignment_lengths, rows, cols,
+                                           tot_lengths, sym)
+        self.similarity_errors = set_cells(self.similarity_errors, rows, cols,
+                                           sim_errors, sym)
+        self.percentage_identity = set_cells(self.percentage_identity, rows,
+                                             cols, pids, sym)
+        self.alignment_coverage = set_cells(self.alignment_coverage, rows,
+                                            cols, qcovers, sym=False)
+        if scovers is not None:
+            self.alignment_coverage = set_cells(self.alignment_coverage, cols,
+                                                rows, scovers, sym=False)
+
+    def add_not_computed(self, pairs, status, sym=True):
+        """Mark comparisons that were not computed.
+
+        - pairs - (query, subject) label tuples of the comparisons
+        - status - reason the comparisons were not computed, e.g.
+          pyani_config.PREFILTERED
+        - sym - if True, the transposed comparisons are also marked
+
+        The comparison values are set to NaN, rather than left at their
+        initial values, and the status of each comparison is recorded in
+        self.not_computed, keyed by (query, subject) tuple. Comparisons
+        with a query or subject not in these results are ignored.
+        """
+        if not self.square:
+            sym = False
+        rows = {label: idx for idx, label in
+                enumerate(self.alignment_lengths.index)}
+        cols = {label: idx for idx, label in
+                enumerate(self.alignment_lengths.columns)}
+        pairs = [(qname, sname) for qname, sname in pairs if
+                 qname in rows and sname in cols]
+        for qname, sname in pairs:
+            self.not_computed[(qname, sname)] = status
+            if sym:
+                self.not_computed[(sname, qname)] = status
+        rowidx = [rows[qname] for qname, _ in pairs]
+        colidx = [cols[sname] for _, sname in pairs]
+        for attr in ('alignment_lengths', 'similarity_errors',
+                     'percentage_identity', 'alignment_coverage',
+                     'covered_bases', 'covered_fraction'):
+            setattr(self, attr, set_cells(getattr(self, attr), rowidx,
+                                          colidx, float('nan'), sym))
+
+    @property
+    def not_computed_table(self):
+        """Return dataframe of (query, subject, status) for comparisons
+        that were not computed.
+        """
+        return pd.DataFrame([(qname, sname, status) for
+                             (qname, sname), status in
+                             sorted(self.not_computed.items())],
+                            columns=['query', 'subject', 'status'])
+
     @property
     def hadamard(self):
         """Return Hadamard matrix (identity * coverage)."""
         return self.percentage_identity * self.alignment_coverage
 
+    def add_covered_bases(self, rows, cols, qbases, qfractions, sbases=None,
+                          sfractions=None):
+        """Add arrays of covered base counts for many comparisons at once.
+
+        - rows - integer positions of the query sequences
+        - cols - integer positions of the subject sequences
+        - qbases, qfractions - arrays of query bases covered by the
+          alignment, as a count and as a fraction of query length
+        - sbases, sfractions - arrays of subject bases covered by the
+          alignment (optional)
+
+        Subject values are not assigned in rectangular results.
+        """
+        self.covered_bases = set_cells(self.covered_bases, rows, cols,
+                                       qbases, sym=False)
+        self.covered_fraction = set_cells(self.covered_fraction, rows, cols,
+                                          qfractions, sym=False)
+        if sbases is not None and self.square:
+            self.covered_bases = set_cells(self.covered_bases, cols, rows,
+                                           sbases, sym=False)
+            self.covered_fraction = set_cells(self.covered_fraction, cols,
+                                              rows, sfractions, sym=False)
+
     @property
     def data(self):
-        """Return list of (dataframe, filestem) tuples."""
+        """Return list of (dataframe, filestem) tuples.
+
+        Covered bases are only calculated for ANIm, so only ANIm results
+        include the covered_bases and covered_fraction dataframes.
+        """
         stemdict = {"ANIm": pyani_config.ANIM_FILESTEMS,
                     "ANIb": pyani_config.ANIB_FILESTEMS,
                     "ANIblastall": pyani_config.ANIBLASTALL_FILESTEMS}
-        return zip((self.alignment_lengths, self.percentage_identity,
-                    self.alignment_coverage, self.similarity_errors,
-                    self.hadamard), stemdict[self.mode])
+        dataframes = [self.alignment_lengths, self.percentage_identity,
+                      self.alignment_coverage, self.similarity_errors,
+                      self.hadamard]
+        if self.mode == "ANIm":
+            dataframes += [self.covered_bases, self.covered_fraction]
+        return zip(dataframes, stemdict[self.mode])
         #return [(self.alignment_lengths, "ANIm_alignment_lengths"),
         #        (self.percentage_identity, "ANIm_percentage_identity"),
         #        (self.alignment_coverage, "ANIm_alignment_coverage"),
@@ -72,6 +208,23 @@ class ANIResults(object):
         #        (self.hadamard, "ANIm_hadamard")]
 
 
+# Assign many values to a dataframe at once
+def set_cells(dfr, rows, cols, values, sym=True):
+    """Returns a copy of the dataframe with the passed cells assigned.
+
+    - dfr - dataframe to be modified
+    - rows - integer row positions of the cells
+    - cols - integer column positions of the cells
+    - values - values to be assigned
+    - sym - if True, also assign values to the transposed cells
+    """
+    data = dfr.values.copy()
+    data[rows, cols] = values
+    if sym:
+        data[cols, rows] = values
+    return pd.DataFrame(data, index=dfr.index, columns=dfr.columns)
+
+
 # Class to hold BLAST functions
 class BLASTfunctions(object):
     """Class to hold BLAST functions."""
@@ -93,11 +246,13 @@ class BLASTcmds(object):
     """Class to hold BLAST command data for construction of BLASTN and
     database formatting commands.
     """
-    def __init__(self, funcs, exes, prefix, outdir):
+    def __init__(self, funcs, exes, prefix, outdir, threads=1, reducer=None):
         self.funcs = funcs
         self.exes = exes
         self.prefix = prefix
         self.outdir = outdir
+        self.threads = threads
+        self.reducer = reducer
 
     def build_db_cmd(self, fname):
         """Return database format/build command"""
@@ -111,8 +266,14 @@ class BLASTcmds(object):
 
     def build_blast_cmd(self, fname, dbname):
         """Return BLASTN command"""
+        if self.reducer is not None:
+            return self.funcs.blastn_func(fname, dbname, self.outdir,
+                                          self.exes.blast_exe,
+                                          threads=self.threads,
+                                          reducer=self.reducer)
         return self.funcs.blastn_func(fname, dbname, self.outdir,
-                                      self.exes.blast_exe)
+                                      self.exes.blast_exe,
+                                      threads=self.threads)
 
 
 # Read sequence annotations in from file
@@ -8,10 +8,15 @@
 """Code to run a set of command-line jobs using multiprocessing.
 
 For parallelisation on multi-core desktop/laptop systems, etc. we use
-Python's multiprocessing module to distribute command-line jobs.
+Python's multiprocessing module to distribute command-line jobs. Job
+dependency graphs are run by starting each job as soon as its own
+dependencies have completed.
 """
 
+import functools
+import heapq
 import multiprocessing
+import queue
 import subprocess
 import sys
 
@@ -20,34 +25,112 @@ CUMRETVAL = 0
 
 # Run a job dependency graph with multiprocessing
 def run_dependency_graph(jobgraph, workers=None, logger=None):
-    """Creates and runs pools of jobs based on the passed jobgraph.
+    """Runs the passed jobgraph, starting each job when it becomes runnable.
 
     - jobgraph - list of jobs, which may have dependencies.
-    - verbose - flag for multiprocessing verbosity
+    - workers - number of cores to use (None: all available cores)
     - logger - a logger module logger (optional)
 
-    The strategy here is to loop over each job in the list of jobs (jobgraph),
-    and create/populate a series of Sets of commands, to be run in
-    reverse order with multiprocessing_run as asynchronous pools.
+    Jobs are identified by their command lines, so that a dependency shared
+    by several Jobs (e.g. a BLAST database) is run once. A command becomes
+    runnable as soon as all of its own dependencies have completed, rather
+    than waiting for every command at the same depth of the graph.
+
+    Runnable commands are started in descending order of the estimated cost
+    of their Jobs, so that long-running jobs do not start last and leave a
+    tail of idle workers. Commands are started while the total number of
+    threads used by running Jobs does not exceed the number of cores (see
+    get_threads_per_job()); a command that needs more threads than are
+    free waits for running commands to finish.
+
+    Returns the sum of exit codes from each command. As before, dependent
+    commands are run even if a dependency fails.
     """
-    cmdsets = []
-    for job in jobgraph:
-        cmdsets = populate_cmdsets(job, cmdsets, depth=1)
-
-    # Put command sets in reverse order, and submit to multiprocessing_run
-    cmdsets.reverse()
-    cumretval = 0
-    for cmdset in cmdsets:
-        if logger:  # Try to be informative, if the logger module is being used
-            logger.info("Command pool now running:")
-            for cmd in cmdset:
-                logger.info(cmd)
-        cumretval += multiprocessing_run(cmdset, workers)
-        if logger:  # Try to be informative, if the logger module is being used
-            logger.info("Command pool done.")
+    jobs = list(iter_jobs(jobgraph))
+    graph = get_command_graph(jobs)
+    costs = get_command_costs(jobs)
+    threads = get_command_threads(jobs)
+    cores = workers or multiprocessing.cpu_count()
+    pending = {cmd: len(deps) for cmd, deps in graph.items()}
+    dependents = {cmd: [] for cmd in graph}
+    for cmd, deps in graph.items():
+        for dep in deps:
+            dependents[dep].append(cmd)
+    runnable = [(-costs[cmd], cmd) for cmd, npend in pending.items() if
+                not npend]
+    heapq.heapify(runnable)
+    finished = queue.Queue()  # (command, exit code) of completed commands
+    cumretval, running, free = 0, 0, cores
+    with multiprocessing.Pool(processes=cores) as pool:
+        while runnable or running:
+            while runnable and (not running or
+                                threads[runnable[0][1]] <= free):
+                cmd = heapq.heappop(runnable)[1]
+                if logger:
+                    logger.info("Starting command: %s", cmd)
+                pool.apply_async(subprocess.run, (str(cmd), ),
+                                 {'shell': sys.platform != "win32",
+                                  'stdout': subprocess.PIPE,
+                                  'stderr': subprocess.PIPE},
+                                 callback=functools.partial(
+                                     _put_returncode, finished, cmd),
+                                 error_callback=functools.partial(
+                                     _put_error, finished, cmd))
+                running += 1
+                free -= threads[cmd]
+            cmd, retval = finished.get()
+            if logger:
+                logger.info("Command done (exit code %d): %s", retval, cmd)
+            running -= 1
+            free += threads[cmd]
+            cumretval += retval
+            for dependent in dependents[cmd]:
+                pending[dependent] -= 1
+                if not pending[dependent]:
+                    heapq.heappush(runnable, (-costs[dependent], dependent))
     return cumretval
 
 
+def _put_returncode(finished, cmd, result):
+    """Report the exit code of a completed command to the executor."""
+    finished.put((cmd, result.returncode))
+
+
+def _put_error(finished, cmd, exc):
+    """Report a command that could not be run to the executor."""
+    finished.put((cmd, 1))
+
+
+def iter_jobs(jobgraph):
+    """Yields each Job in the passed jobgraph and its dependencies once.
+
+    A Job shared as a dependency by several Jobs (e.g. one database
+    building Job under many BLASTN Jobs) is only descended once.
+    """
+    seen = set()
+    waiting = list(jobgraph)
+    while waiting:
+        job = waiting.pop()
+        if id(job) in seen:
+            continue
+        seen.add(id(job))
+        yield job
+        waiting.extend(job.dependencies)
+
+
+def get_command_graph(jobgraph):
+    """Returns dictionary of dependency command lines, keyed by command line.
+
+    Where the same command occurs in more than one Job (see iter_jobs()),
+    the dependencies of all those Jobs are combined.
+    """
+    graph = {}
+    for job in iter_jobs(jobgraph):
+        graph.setdefault(job.command, set()).update(dep.command for dep in
+                                                    job.dependencies)
+    return graph
+
+
 def populate_cmdsets(job, cmdsets, depth):
     """Creates a list of sets containing jobs at different depths of the
     dependency tree.
@@ -65,6 +148,47 @@ def populate_cmdsets(job, cmdsets, depth):
     return cmdsets
 
 
+def get_command_costs(jobgraph):
+    """Returns dictionary of estimated Job costs, keyed by command line.
+
+    Where the same command occurs in more than one Job (see iter_jobs()),
+    the largest cost is retained.
+    """
+    costs = {}
+    for job in iter_jobs(jobgraph):
+        costs[job.command] = max(costs.get(job.command, 0),
+                                 getattr(job, 'cost', 0))
+    return costs
+
+
+def get_command_threads(jobgraph):
+    """Returns dictionary of Job thread counts, keyed by command line.
+
+    Where the same command occurs in more than one Job (see iter_jobs()),
+    the largest thread count is retained.
+    """
+    threads = {}
+    for job in iter_jobs(jobgraph):
+        threads[job.command] = max(threads.get(job.command, 1),
+                                   getattr(job, 'threads', 1))
+    return threads
+
+
+# Share the available cores between concurrent jobs
+def get_threads_per_job(njobs, workers=None):
+    """Returns the number of threads to be used by each of a set of jobs.
+
+    - njobs - number of jobs to be run
+    - workers - number of cores to use (None: all available cores)
+
+    When there are fewer jobs than cores, the spare cores are shared
+    between the jobs as threads, so that they are not left idle; with
+    more jobs than cores, each job is run with a single thread.
+    """
+    cores = workers or multiprocessing.cpu_count()
+    return max(1, cores // max(1, njobs))
+
+
 # Run a set of command lines using multiprocessing
 def multiprocessing_run(cmdlines, workers=None):
     """Distributes passed command-line jobs using multiprocessing.
@@ -31,11 +31,24 @@ def split_seq(iterable, size):
 
 # Build a list of SGE jobs from a graph
 def build_joblist(jobgraph):
-    """Returns a list of jobs, from a passed jobgraph."""
+    """Returns a list of jobs, from a passed jobgraph.
+
+    Jobs are placed in descending order of estimated cost.
+    """
     jobset = set()
     for job in jobgraph:
         jobset = populate_jobset(job, jobset, depth=1)
-    return list(jobset)
+    return sort_jobs_by_cost(jobset)
+
+
+# Order jobs so that the most costly are submitted first
+def sort_jobs_by_cost(jobs):
+    """Returns list of the passed jobs, in descending order of cost.
+
+    Jobs with equal cost are ordered by name, so that submission order is
+    reproducible.
+    """
+    return sorted(jobs, key=lambda job: (-getattr(job, 'cost', 0), job.name))
 
 
 # Convert joblist into jobgroups
@@ -175,7 +188,7 @@ def extract_submittable_jobs(waiting):
                            job.dependencies])
         if unsatisfied == 0:
             submittable.add(job)
-    return list(submittable)
+    return sort_jobs_by_cost(submittable)
 
 
 def submit_safe_jobs(root_dir, jobs, sgeargs=None):
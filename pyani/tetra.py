@@ -20,88 +20,306 @@ assignment of genomic fragments. Env. Microbiol. 6(9): 938-947.
 doi:10.1111/j.1462-2920.2004.00624.x
 """
 
-import collections
+import itertools
+import multiprocessing
 import os
 import math
 
+import numpy as np
 import pandas as pd
 
-from Bio import SeqIO
+from . import pyani_cache
+
+
+# Translation table encoding nucleotides (either case) as 2-bit codes
+# A=0, C=1, G=2, T=3; all other symbols, e.g. IUPAC ambiguity codes, are
+# encoded as 4
+NT_CODES = bytes({'A': 0, 'C': 1, 'G': 2, 'T': 3}.get(chr(char).upper(), 4)
+                 for char in range(256))
+
+# Whitespace characters removed from sequence lines
+WHITESPACE = b' \t\r\n\v\f'
+
+# Size (in bytes) of blocks read from sequence files
+TETRA_BLOCKSIZE = 1 << 20
+
+# Names of files within a TetraIndex directory: normalised Z-score vectors
+# are held as rows of the binary vector file, labelled by the SQLite
+# database (see pyani_cache.SignatureCache)
+INDEX_VECTOR_FILE = 'tetra_index.bin'
+INDEX_DBNAME = 'tetra_index.sqlite'
+
+# Number of indexed vectors multiplied at a time by TetraIndex queries
+INDEX_BLOCKSIZE = 1 << 16
+
+# Tetranucleotides, in the order of their 2-bit codes (which is also
+# alphabetical order)
+TETRANUCLEOTIDES = [''.join(tet) for tet in itertools.product('ACGT',
+                                                              repeat=4)]
 
 
 # Calculate tetranucleotide Z-score for a set of input sequences
-def calculate_tetra_zscores(infilenames):
+def calculate_tetra_zscores(infilenames, workers=None):
     """Returns dictionary of TETRA Z-scores for each input file.
 
     - infilenames - collection of paths to sequence files
+    - workers - number of worker processes (None: all available cores;
+      1: calculate Z-scores in the calling process)
+
+    Files are processed in parallel by calculate_tetra_zscore_arrays().
     """
+    infilenames = list(infilenames)
     org_tetraz = {}
-    for filename in infilenames:
+    for filename, zscores in zip(infilenames,
+                                 calculate_tetra_zscore_arrays(infilenames,
+                                                               workers)):
         org = os.path.splitext(os.path.split(filename)[-1])[0]
-        org_tetraz[org] = calculate_tetra_zscore(filename)
+        org_tetraz[org] = get_zscore_dict(zscores)
     return org_tetraz
 
 
+# Calculate tetranucleotide Z-scores for a set of input sequences, as arrays
+def calculate_tetra_zscore_arrays(infilenames, workers=None):
+    """Returns (files x 256) array of TETRA Z-scores, in input file order.
+
+    - infilenames - collection of paths to sequence files
+    - workers - number of worker processes (None: all available cores;
+      1: calculate Z-scores in the calling process)
+
+    Files are processed in parallel by calculate_tetra_zscore_array(), so
+    that each worker returns only an array of 256 Z-scores.
+    """
+    infilenames = list(infilenames)
+    if workers == 1 or len(infilenames) < 2:
+        arrays = [calculate_tetra_zscore_array(fname) for fname in
+                  infilenames]
+    else:
+        with multiprocessing.Pool(processes=workers) as pool:
+            arrays = pool.map(calculate_tetra_zscore_array, infilenames,
+                              chunksize=1)
+    return np.array(arrays).reshape(len(infilenames), len(TETRANUCLEOTIDES))
+
+
 # Calculate tetranucleotide Z-score for a single sequence file
 def calculate_tetra_zscore(filename):
     """Returns TETRA Z-score for the sequence in the passed file.
 
     - filename - path to sequence file
 
-    Calculates mono-, di-, tri- and tetranucleotide frequencies
-    for each sequence, on each strand, and follows Teeling et al. (2004)
-    in calculating a corresponding Z-score for each observed
-    tetranucleotide frequency, dependent on the mono-, di- and tri-
-    nucleotide frequencies for that input sequence.
+    Z-scores are returned as a dictionary keyed by tetranucleotide, for
+    all tetranucleotides observed in the sequence (see
+    calculate_tetra_zscore_array()).
+    """
+    return get_zscore_dict(calculate_tetra_zscore_array(filename))
+
+
+# Calculate tetranucleotide Z-scores for a single sequence file, as an array
+def calculate_tetra_zscore_array(filename):
+    """Returns array of TETRA Z-scores for the sequence in the passed file.
+
+    - filename - path to sequence file
+
+    Calculates di-, tri- and tetranucleotide frequencies for each
+    sequence, on each strand, and follows Teeling et al. (2004) in
+    calculating a corresponding Z-score for each observed tetranucleotide
+    frequency, dependent on the di- and trinucleotide frequencies for
+    that input sequence.
+
+    Oligonucleotides are counted as 2-bit codes (see get_kmer_counts()),
+    and the Z-scores of all tetranucleotides are calculated together as
+    NumPy arrays, with the same arithmetic as the per-tetranucleotide
+    calculation they replace, so that the results are identical. The
+    returned float array is indexed by tetranucleotide code (see
+    TETRANUCLEOTIDES), and holds NaN for tetranucleotides that are not
+    observed.
     """
     # For the Teeling et al. method, the Z-scores require us to count
-    # mono, di, tri and tetranucleotide sequences - these are stored
-    # (in order) in the counts tuple
-    counts = (collections.defaultdict(int), collections.defaultdict(int),
-              collections.defaultdict(int), collections.defaultdict(int))
-    for rec in SeqIO.parse(filename, 'fasta'):
-        for seq in [str(rec.seq).upper(),
-                    str(rec.seq.reverse_complement()).upper()]:
-            # The Teeling et al. algorithm requires us to consider
-            # both strand orientations, so monocounts are easy
-            for base in ('G', 'C', 'T', 'A'):
-                counts[0][base] += seq.count(base)
-            # For di, tri and tetranucleotide counts, loop over the
-            # sequence and its reverse complement, until near the end:
-            for i in range(len(seq[:-4])):
-                din, tri, tetra = seq[i:i+2], seq[i:i+3], seq[i:i+4]
-                counts[1][str(din)] += 1
-                counts[2][str(tri)] += 1
-                counts[3][str(tetra)] += 1
-            # Then clean up the straggling bit at the end:
-            counts[2][str(seq[-4:-1])] += 1
-            counts[2][str(seq[-3:])] += 1
-            counts[1][str(seq[-4:-2])] += 1
-            counts[1][str(seq[-3:-1])] += 1
-            counts[1][str(seq[-2:])] += 1
+    # di, tri and tetranucleotide sequences on both strands
+    dicounts, tricounts, tetracounts = get_kmer_counts(filename)
     # Following Teeling (2004), calculate expected frequencies for each
-    # tetranucleotide; we ignore ambiguity symbols
-    tetra_exp = {}
-    for tet in [tetn for tetn in counts[3] if tetra_clean(tetn)]:
-        tetra_exp[tet] = 1. * counts[2][tet[:3]] * counts[2][tet[1:]] / \
-                         counts[1][tet[1:3]]
+    # observed tetranucleotide; we ignore ambiguity symbols
+    tets = np.flatnonzero(tetracounts)
+    tri1, tri2 = tricounts[tets >> 2], tricounts[tets & 63]
+    den = dicounts[(tets >> 2) & 15]
+    tetra_exp = 1. * tri1 * tri2 / den
     # Following Teeling (2004) we approximate the std dev and Z-score for each
     # tetranucleotide
-    tetra_sd = {}
-    tetra_z = {}
-    for tet, exp in list(tetra_exp.items()):
-        den = counts[1][tet[1:3]]
-        tetra_sd[tet] = math.sqrt(exp * (den - counts[2][tet[:3]]) *
-                                  (den - counts[2][tet[1:]]) / (den * den))
-        try:
-            tetra_z[tet] = (counts[3][tet] - exp)/tetra_sd[tet]
-        except ZeroDivisionError:
-            # To record if we hit a zero in the estimation of variance
-            # zeroes = [k for k, v in list(tetra_sd.items()) if v == 0]
-            tetra_z[tet] = 1 / (counts[1][tet[1:3]] * counts[1][tet[1:3]])
+    tetra_sd = np.sqrt(tetra_exp * (den - tri1) * (den - tri2) / (den * den))
+    tetra_z = np.full(len(tetracounts), np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tetra_z[tets] = np.where(tetra_sd != 0,
+                                 (tetracounts[tets] - tetra_exp) / tetra_sd,
+                                 # To record if we hit a zero in the
+                                 # estimation of variance
+                                 1 / (den * den))
     return tetra_z
 
 
+# Convert an array of Z-scores to a dictionary keyed by tetranucleotide
+def get_zscore_dict(zscores):
+    """Returns dictionary of the observed Z-scores in the passed array."""
+    return {TETRANUCLEOTIDES[tet]: zscore for tet, zscore in
+            enumerate(zscores.tolist()) if not math.isnan(zscore)}
+
+
+# Count di, tri and tetranucleotides on both strands of a sequence file
+def get_kmer_counts(filename, blocksize=TETRA_BLOCKSIZE):
+    """Returns (di, tri, tetranucleotide) count arrays for a sequence file.
+
+    - filename - path to sequence file
+    - blocksize - size (bytes) of the blocks read from the file
+
+    Each array is indexed by oligonucleotide code, in which each base is
+    represented by two bits (see NT_CODES), with the first base in the
+    most significant position. Counts are totals over both strands of
+    all sequences in the file, and exclude oligonucleotides containing
+    ambiguity symbols.
+
+    The file is read in blocks (see iter_sequence_blocks()), which are
+    counted by an OligoCounter, so that memory use does not depend on the
+    size of the file or of the sequences in it.
+
+    For compatibility with earlier versions of pyani, the last
+    tetranucleotide of each strand is not counted; on the forward strand
+    this is the tetranucleotide at the 3' end of the sequence, and on
+    the reverse strand the reverse complement of the tetranucleotide at
+    its 5' end.
+    """
+    counter = OligoCounter()
+    with open(filename, 'rb') as ifh:
+        for block in iter_sequence_blocks(ifh, blocksize):
+            if block is None:
+                counter.end_record()
+            else:
+                counter.add(block)
+    counter.end_record()
+    return counter.get_counts()
+
+
+# Generate encoded sequence blocks from a FASTA file
+def iter_sequence_blocks(handle, blocksize=TETRA_BLOCKSIZE):
+    """Yields blocks of encoded sequence from a FASTA file, in order.
+
+    - handle - FASTA file handle, opened in binary mode
+    - blocksize - size (bytes) of the blocks read from the file
+
+    Sequence lines are encoded with NT_CODES, and whitespace removed, so
+    that each yielded block is a bytes object of 2-bit codes. None is
+    yielded at the start of each record; as with SimpleFastaParser, text
+    before the first header line is ignored.
+    """
+    in_header, in_record, line_start = False, False, True
+    for block in iter(lambda: handle.read(blocksize), b''):
+        pos = 0
+        while pos < len(block):
+            if in_header:  # skip to the end of the header line
+                end = block.find(b'\n', pos)
+                if end < 0:
+                    break
+                in_header, line_start, pos = False, True, end + 1
+                continue
+            if line_start and block.startswith(b'>', pos):
+                start = pos
+            else:
+                start = block.find(b'\n>', pos)
+                start = len(block) if start < 0 else start + 1
+            if in_record and start > pos:
+                yield block[pos:start].translate(NT_CODES, WHITESPACE)
+            if start == len(block):
+                line_start = block.endswith(b'\n')
+                break
+            yield None
+            in_header, in_record, pos = True, True, start + 1
+
+
+# Class to count oligonucleotides in blocks of encoded sequence
+class OligoCounter(object):
+    """Accumulates di, tri and tetranucleotide counts over both strands.
+
+    Blocks of a sequence are passed to add() in order, with the last three
+    bases of each block carried over, so that oligonucleotides spanning
+    block boundaries are counted; end_record() is called at the end of
+    each sequence.
+    """
+    def __init__(self):
+        # Forward strand counts of all di, tri and tetranucleotides
+        self.counts = [np.zeros(4 ** size, dtype=np.int64) for size in
+                       (2, 3, 4)]
+        # Counts of the first and last tetranucleotides of each sequence
+        self.first = np.zeros(256, dtype=np.int64)
+        self.last = np.zeros(256, dtype=np.int64)
+        # First and last (up to) four bases of the current sequence
+        self.head, self.tail = b'', b''
+
+    def add(self, block):
+        """Count oligonucleotides in the next block of encoded sequence."""
+        if len(self.head) < 4:
+            self.head += block[:4 - len(self.head)]
+        overlap = self.tail[-3:]
+        bases = np.frombuffer(overlap + block, dtype=np.uint8)
+        for idx, size in enumerate((2, 3, 4)):
+            # Oligonucleotides within the overlap were counted already
+            self.counts[idx] += count_oligos(
+                bases[max(0, len(overlap) - size + 1):], size)
+        self.tail = (self.tail + block)[-4:]
+
+    def end_record(self):
+        """Record the end of the current sequence."""
+        if len(self.head) == 4:
+            for bases, counts in ((self.head, self.first),
+                                  (self.tail, self.last)):
+                counts += count_oligos(np.frombuffer(bases, dtype=np.uint8),
+                                       4)
+        self.head, self.tail = b'', b''
+
+    def get_counts(self):
+        """Returns (di, tri, tetranucleotide) counts over both strands."""
+        dicounts, tricounts, tetracounts = self.counts
+        # The last window on each strand is not counted
+        forward, reverse = tetracounts - self.last, tetracounts - self.first
+        return (dicounts + dicounts[get_revcomp_codes(2)],
+                tricounts + tricounts[get_revcomp_codes(3)],
+                forward + reverse[get_revcomp_codes(4)])
+
+
+# Count the unambiguous oligonucleotides in an encoded sequence
+def count_oligos(bases, size):
+    """Returns array of oligonucleotide counts, indexed by code.
+
+    - bases - uint8 array of 2-bit base codes (see NT_CODES)
+    - size - length of the oligonucleotides
+
+    Oligonucleotide codes are calculated by shifts over the whole array,
+    and those containing ambiguity symbols are excluded using prefix sums.
+    """
+    nwindows = len(bases) - size + 1
+    if nwindows < 1:
+        return np.zeros(4 ** size, dtype=np.int64)
+    codes = np.zeros(nwindows, dtype=np.int64)
+    for offset in range(size):
+        codes = (codes << 2) | bases[offset:offset + nwindows]
+    ambiguous = np.concatenate(([0], np.cumsum(bases == 4)))
+    clean = ambiguous[size:] == ambiguous[:nwindows]
+    return np.bincount(codes[clean], minlength=4 ** size)
+
+
+# Get the codes of the reverse complements of all oligonucleotides
+def get_revcomp_codes(size):
+    """Returns array of reverse complement codes, indexed by code.
+
+    - size - length of the oligonucleotides
+
+    With 2-bit codes A=0, C=1, G=2, T=3, the complement of a base is
+    3 - base, and reverse complementing reverses the order of the bases.
+    """
+    codes = np.arange(4 ** size)
+    revcomp = np.zeros(4 ** size, dtype=np.int64)
+    for _ in range(size):
+        revcomp = (revcomp << 2) | (3 - (codes & 3))
+        codes = codes >> 2
+    return revcomp
+
+
 # Returns true if the passed string contains only A, C, G or T
 def tetra_clean(string):
     """ Checks that a passed string contains only unambiguous IUPAC nucleotide
@@ -115,35 +333,225 @@ def tetra_clean(string):
 
 # Calculate Pearson's correlation coefficient from the Z-scores for each
 # tetranucleotide.
-def calculate_correlations(tetra_z):
+def calculate_correlations(tetra_z, blocksize=1024):
     """Returns dataframe of Pearson correlation coefficients.
 
     - tetra_z - dictionary of Z-scores, keyed by sequence ID
+    - blocksize - number of sequences in each block of the correlation
+      matrix calculated at a time
 
     Calculates Pearson correlation coefficient from Z scores for each
-    tetranucleotide. This is done longhand here, which is fast enough,
-    but for robustness we might want to do something else... (TODO).
+    tetranucleotide. The Z-scores are held as an array with one row per
+    sequence (see get_zscore_matrix()); each row is centred and scaled to
+    unit length, so that the correlation matrix is the product of this
+    array with its transpose. The product is calculated in square blocks,
+    to limit the size of intermediate arrays for large numbers of
+    sequences, and only blocks on or above the diagonal are calculated,
+    so that the matrix is exactly symmetrical.
 
     Note that we report a correlation by this method, rather than a
     percentage identity.
     """
+    orgs, _, zscores = get_zscore_matrix(tetra_z)
+    return calculate_correlation_matrix(orgs, zscores, blocksize)
+
+
+# Calculate Pearson's correlation coefficients from an array of Z-scores
+def calculate_correlation_matrix(orgs, zscores, blocksize=1024):
+    """Returns dataframe of Pearson correlation coefficients.
+
+    - orgs - sequence IDs, labelling the rows of zscores
+    - zscores - (sequences x tetranucleotides) array of Z-scores, e.g. as
+      returned by get_zscore_matrix(), calculate_tetra_zscore_arrays() or
+      pyani_cache.SignatureCache.get()
+    - blocksize - number of sequences in each block of the correlation
+      matrix calculated at a time
+
+    Columns of NaN, for tetranucleotides observed in no sequence, are
+    ignored; every sequence must have Z-scores for the remaining
+    tetranucleotides, or a ValueError is raised. See
+    calculate_correlations().
+    """
+    zscores = zscores[:, ~np.isnan(zscores).all(axis=0)]
+    missing = np.isnan(zscores).any(axis=1)
+    if missing.any():
+        raise ValueError("TETRA correlations require Z-scores for the " +
+                         "same tetranucleotides in every sequence (%s)" %
+                         ", ".join(str(org) for org in
+                                   np.asarray(orgs)[missing]))
+    zdiffs = normalise_zscores(zscores)
+    correlations = np.empty((len(orgs), len(orgs)))
+    for start1 in range(0, len(orgs), blocksize):
+        block1 = zdiffs[start1:start1 + blocksize]
+        for start2 in range(start1, len(orgs), blocksize):
+            block = block1 @ zdiffs[start2:start2 + blocksize].T
+            correlations[start1:start1 + blocksize,
+                         start2:start2 + blocksize] = block
+            correlations[start2:start2 + blocksize,
+                         start1:start1 + blocksize] = block.T
+    np.fill_diagonal(correlations, 1.0)
+    return pd.DataFrame(correlations, index=orgs, columns=orgs)
+
+
+# Centre and scale Z-score vectors for correlation by matrix products
+def normalise_zscores(zscores):
+    """Returns Z-score array with rows centred and scaled to unit length.
+
+    - zscores - (sequences x tetranucleotides) array of Z-scores
+
+    The Pearson correlation of two sequences is the dot product of their
+    normalised rows.
+    """
+    zdiffs = zscores - zscores.mean(axis=-1, keepdims=True)
+    zdiffs /= np.sqrt((zdiffs * zdiffs).sum(axis=-1, keepdims=True))
+    return zdiffs
+
+
+# Split comparisons by the TETRA correlation of their sequences
+def filter_pairs(pairs, correlations, threshold):
+    """Returns (retained pairs, prefiltered pairs).
+
+    - pairs - (query, subject) label tuples of comparisons
+    - correlations - dataframe of TETRA correlations, labelled by sequence
+    - threshold - minimum correlation of retained comparisons
+
+    Comparisons between sequences whose TETRA correlation is below the
+    threshold are too dissimilar to be worth aligning, and are returned
+    as prefiltered. Comparisons with an undefined (NaN) correlation are
+    retained. Both lists keep the order of the passed pairs.
+    """
+    if not pairs:
+        return [], []
+    rows = correlations.index.get_indexer([qname for qname, _ in pairs])
+    cols = correlations.columns.get_indexer([sname for _, sname in pairs])
+    keep = ~(correlations.values[rows, cols] < threshold)
+    return ([pair for pair, kept in zip(pairs, keep) if kept],
+            [pair for pair, kept in zip(pairs, keep) if not kept])
+
+
+# Pack the Z-scores of several sequences into a single array
+def get_zscore_matrix(tetra_z):
+    """Returns (sequence IDs, tetranucleotides, Z-score array).
+
+    - tetra_z - dictionary of Z-scores, keyed by sequence ID
+
+    Sequence IDs and tetranucleotides are sorted, and index the rows and
+    columns, respectively, of the float array of Z-scores. Every sequence
+    must have Z-scores for the same tetranucleotides.
+    """
     orgs = sorted(tetra_z.keys())
-    correlations = pd.DataFrame(index=orgs, columns=orgs,
-                                dtype=float).fillna(1.0)
-    for idx, org1 in enumerate(orgs[:-1]):
-        for org2 in orgs[idx+1:]:
-            assert sorted(tetra_z[org1].keys()) == sorted(tetra_z[org2].keys())
-            tets = sorted(tetra_z[org1].keys())
-            zscores = [[tetra_z[org1][t] for t in tets],
-                       [tetra_z[org2][t] for t in tets]]
-            zmeans = [sum(zscore)/len(zscore) for zscore in zscores]
-            zdiffs = [[z - zmeans[0] for z in zscores[0]],
-                      [z - zmeans[1] for z in zscores[1]]]
-            diffprods = sum([zdiffs[0][i] * zdiffs[1][i] for i in
-                             range(len(zdiffs[0]))])
-            zdiffs2 = [sum([z * z for z in zdiffs[0]]),
-                       sum([z * z for z in zdiffs[1]])]
-            correlations[org1][org2] = diffprods / \
-                                       math.sqrt(zdiffs2[0] * zdiffs2[1])
-            correlations[org2][org1] = correlations[org1][org2]
-    return correlations
+    tets = sorted(tetra_z[orgs[0]].keys()) if orgs else []
+    for org in orgs:
+        assert sorted(tetra_z[org].keys()) == tets
+    zscores = np.array([[tetra_z[org][tet] for tet in tets] for org in orgs],
+                       dtype=float).reshape(len(orgs), len(tets))
+    return orgs, tets, zscores
+
+
+# Class to hold a persistent index of TETRA signatures for searching
+class TetraIndex(object):
+    """Persistent index of normalised TETRA Z-score vectors.
+
+    The index answers queries for the sequences most correlated with a
+    query sequence, without calculating a full correlation matrix. Each
+    indexed sequence is held as a normalised row (see normalise_zscores())
+    of a binary float64 file, so the correlations of a query with all
+    indexed sequences are a matrix-vector product. This is calculated in
+    blocks of rows read from the memory-mapped file. Rows are allocated
+    and labelled by a pyani_cache.SignatureCache keyed by sequence label,
+    so that sequences may be added to the index at any time, including by
+    concurrent runs.
+    """
+    def __init__(self, indexdir):
+        """Open (creating, if necessary) the index in the passed directory.
+
+        - indexdir - path to the index directory
+        """
+        self.cache = pyani_cache.SignatureCache(indexdir, INDEX_DBNAME,
+                                                INDEX_VECTOR_FILE)
+        self.labels = self.cache.genomes()
+
+    def __len__(self):
+        return len(self.labels)
+
+    def add(self, label, zscores):
+        """Add (or replace) the Z-scores of a sequence; return its row.
+
+        - label - sequence label
+        - zscores - array of 256 Z-scores, as returned by
+          calculate_tetra_zscore_array()
+
+        Raises a ValueError if any tetranucleotide was not observed. The
+        labels are read again once the vector is stored, so that rows
+        added by other runs are included.
+        """
+        zscores = np.asarray(zscores, dtype=float)
+        if zscores.shape != (len(TETRANUCLEOTIDES),) or \
+           not np.isfinite(zscores).all():
+            raise ValueError("TETRA index requires Z-scores for all " +
+                             "%d tetranucleotides (%s)" %
+                             (len(TETRANUCLEOTIDES), label))
+        row = self.cache.put(label, normalise_zscores(zscores))
+        self.labels = self.cache.genomes()
+        return row
+
+    def add_files(self, filenames, workers=None):
+        """Add sequence files to the index; return their labels.
+
+        - filenames - paths to sequence files, labelled by file stem
+        - workers - number of worker processes used to calculate Z-scores
+          (see calculate_tetra_zscore_arrays())
+        """
+        labels = [os.path.splitext(os.path.split(fname)[-1])[0] for fname
+                  in filenames]
+        for label, zscores in zip(labels,
+                                  calculate_tetra_zscore_arrays(filenames,
+                                                                workers)):
+            self.add(label, zscores)
+        return labels
+
+    def vectors(self):
+        """Return the indexed vectors as a read-only memory-mapped array.
+
+        The labels are read again, so that rows added by other runs are
+        included; the array rows are those labelled by self.labels.
+        """
+        self.labels = self.cache.genomes()
+        return self.cache.signatures()[:len(self.labels)]
+
+    def close(self):
+        """Close the index."""
+        self.cache.close()
+
+    def query(self, zscores, k=10, blocksize=INDEX_BLOCKSIZE):
+        """Returns [(label, correlation)] for the k most correlated sequences.
+
+        - zscores - array of 256 Z-scores for the query sequence
+        - k - number of indexed sequences to return
+        - blocksize - number of indexed vectors multiplied at a time
+
+        Results are in order of decreasing correlation. The k best rows of
+        each block are kept with np.argpartition(), and the best of these
+        are then sorted, so that only a few rows are sorted.
+        """
+        if k < 1:
+            return []
+        zscores = np.asarray(zscores, dtype=float)
+        if not np.isfinite(zscores).all():
+            raise ValueError("TETRA index query requires Z-scores for all " +
+                             "%d tetranucleotides" % len(TETRANUCLEOTIDES))
+        vector = normalise_zscores(zscores)
+        vectors = self.vectors()
+        rows, scores = [], []
+        for start in range(0, len(vectors), blocksize):
+            block = vectors[start:start + blocksize] @ vector
+            best = np.argpartition(-block, k - 1)[:k] if k < len(block) \
+                else np.arange(len(block))
+            rows.append(best + start)
+            scores.append(block[best])
+        if not rows:
+            return []
+        rows, scores = np.concatenate(rows), np.concatenate(scores)
+        order = np.lexsort((rows, -scores))[:k]
+        return [(self.labels[row], float(score)) for row, score in
+                zip(rows[order].tolist(), scores[order])]
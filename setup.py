@@ -42,12 +42,16 @@ setup(
     download_url="https://github.com/widdowquinn/pyani/releases",
     scripts=[os.path.join('bin', 'average_nucleotide_identity.py'),
              os.path.join('bin', 'genbank_get_genomes_by_taxon.py'),
-             os.path.join('bin', 'delta_filter_wrapper.py')],
+             os.path.join('bin', 'delta_filter_wrapper.py'),
+             os.path.join('bin', 'blast_reducer_wrapper.py'),
+             os.path.join('bin', 'manage_comparison_cache.py'),
+             os.path.join('bin', 'manage_tetra_index.py')],
     packages=['pyani'],
     package_data={'pyani': ['tests/test_JSpecies/*.tab']},
     include_package_date=True,
     install_requires=['biopython',
                       'matplotlib',
+                      'numpy',
                       'pandas',
                       'scipy',
                       'seaborn'],
@@ -51,14 +51,21 @@ THE SOFTWARE.
 """
 
 import os
+import shutil
+import subprocess
+import sys
 import unittest
 
+import numpy as np
 import pandas as pd
 
-from nose.tools import (assert_equal,)
+from Bio import SeqIO
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+from nose.tools import (assert_equal, assert_raises)
 from pandas.util.testing import (assert_frame_equal,)
 
-from pyani import (anib, pyani_files)
+from pyani import (anib, pyani_archive, pyani_files)
 
 
 class TestBLASTCmdline(unittest.TestCase):
@@ -216,6 +223,17 @@ class TestBLASTCmdline(unittest.TestCase):
                                             self.outdir)
         assert_equal(cmd, self.blastncmd)
 
+    def test_blastn_threads_generation(self):
+        """generate multithreaded BLASTN+ and legacy BLASTN command-lines."""
+        cmd = anib.construct_blastn_cmdline(self.blastdbfnames[0],
+                                            self.blastdbfnames[1],
+                                            self.outdir, threads=4)
+        assert_equal(cmd, self.blastncmd + " -num_threads 4")
+        cmd = anib.construct_blastall_cmdline(self.blastdbfnames[0],
+                                              self.blastdbfnames[1],
+                                              self.outdir, threads=4)
+        assert_equal(cmd, self.blastallcmd + " -a 4")
+
     def test_blastall_generation(self):
         """generate legacy BLASTN command-line."""
         cmd = anib.construct_blastall_cmdline(self.blastdbfnames[0],
@@ -223,6 +241,31 @@ class TestBLASTCmdline(unittest.TestCase):
                                               self.outdir)
         assert_equal(cmd, self.blastallcmd)
 
+    def test_reducer_generation(self):
+        """generate BLAST command-lines with output reduction."""
+        prefix = os.path.join(self.outdir, "NC_002696_vs_NC_010338")
+        cmd = anib.construct_blastn_cmdline(self.blastdbfnames[0],
+                                            self.blastdbfnames[1],
+                                            self.outdir,
+                                            reducer={'hits': True})
+        assert_equal(cmd, ' '.join(["blast_reducer_wrapper.py --mode ANIb",
+                                    "--identity 0.3 --coverage 0.7 --hits",
+                                    prefix + ".blast_tab",
+                                    prefix + ".blast_totals",
+                                    self.blastncmd.replace(
+                                        "-out %s.blast_tab " % prefix,
+                                        "")]))
+        cmd = anib.construct_blastall_cmdline(self.blastdbfnames[0],
+                                              self.blastdbfnames[1],
+                                              self.outdir, reducer={})
+        assert_equal(cmd, ' '.join(["blast_reducer_wrapper.py",
+                                    "--mode ANIblastall",
+                                    "--identity 0.3 --coverage 0.7",
+                                    "--fragments", self.blastdbfnames[0],
+                                    prefix + ".blast_totals",
+                                    self.blastallcmd.replace(
+                                        "-o %s.blast_tab " % prefix, "")]))
+
     def test_blastn_commands(self):
         """generate both BLASTN+ and legacy BLASTN commands."""
         # BLAST+
@@ -262,6 +305,35 @@ class TestBLASTCmdline(unittest.TestCase):
             dep = job.dependencies[0]
             assert(dep.script.startswith('makeblastdb'))
 
+    def test_combined_jobs(self):
+        """create BLASTN jobs against a combined database."""
+        fragfiles = anib.fragment_fasta_files(self.infiles, self.outdir,
+                                              self.fraglen)[0]
+        stems = sorted(pyani_files.get_file_stem(fname) for fname in
+                       self.infiles)
+        joblist, batches = anib.make_combined_jobs(self.infiles, fragfiles,
+                                                   self.outdir,
+                                                   pairs=set([tuple(stems)]))
+        batchdir = os.path.join(self.outdir, 'batches')
+        assert_equal(batches,
+                     [(os.path.join(batchdir, '%s_vs_combined.blast_tab' %
+                                    stems[0]), stems[0], (stems[1],),
+                       (1.0,))])
+        # One BLASTN job per query genome, depending on a single database
+        # of the subject genomes
+        with open(os.path.join(batchdir, 'combined.fna'), 'r') as ifh:
+            tags = set(line[1:].split('::')[0] for line in ifh if
+                       line.startswith('>'))
+        assert_equal(tags, set(stems[1:]))
+        assert_equal(len(joblist), 1)
+        assert joblist[0].script.startswith('blastn')
+        assert "ppos gaps evalue stitle'" in joblist[0].script
+        # E-values are calculated over the subject genome's length
+        dbsize = pyani_files.get_sequence_lengths(self.infiles)[stems[1]]
+        assert joblist[0].script.endswith(" -dbsize %d" % dbsize)
+        assert_equal([dep.script.split()[0] for dep in
+                      joblist[0].dependencies], ['makeblastdb'])
+
     def test_blastall_graph(self):
         """create jobgraph for legacy BLASTN jobs."""
         fragresult = anib.fragment_fasta_files(self.infiles, self.outdir,
@@ -308,6 +380,58 @@ class TestFragments(unittest.TestCase):
             for fragname, fraglen in fragdict.items():
                 assert fraglen <= self.fraglen
 
+    def test_fragment_streaming(self):
+        """streamed fragments match fragments written by Biopython."""
+        infnames = []
+        for idx, seqlen in enumerate((2500, 1000, 0, 61)):
+            infname = os.path.join(self.outdir, 'stream%d.fna' % idx)
+            records = [SeqRecord(Seq('ACGT' * (seqlen // 4) + 'A' *
+                                     (seqlen % 4)), id='seq%d' % num,
+                                 description='seq%d test sequence' % num)
+                       for num in range(2)]
+            SeqIO.write(records, infname, 'fasta')
+            infnames.append(infname)
+        for workers in (1, 2):
+            outfnames, fraglengths = anib.fragment_fasta_files(
+                infnames, self.outdir, self.fraglen, workers)
+            for infname, outfname in zip(infnames, outfnames):
+                expected, count = [], 0
+                for seq in SeqIO.parse(infname, 'fasta'):
+                    for idx in range(0, len(seq), self.fraglen):
+                        count += 1
+                        expected.append(seq[idx:idx + self.fraglen])
+                        expected[-1].id = "frag%05d" % count
+                tgtfname = outfname + '.expected'
+                SeqIO.write(expected, tgtfname, 'fasta')
+                with open(outfname) as ofh, open(tgtfname) as tfh:
+                    assert_equal(ofh.read(), tfh.read())
+                assert_equal(fraglengths[
+                    os.path.split(outfname)[-1].split('-fragments')[0]].tolist(),
+                             anib.get_fragment_lengths(outfname).tolist())
+
+
+    def test_fraglengths_binary(self):
+        """writes and reads fragment length arrays, also from an archive."""
+        lengthdir = os.path.join(self.outdir, 'fraglengths')
+        if os.path.isdir(lengthdir):
+            shutil.rmtree(lengthdir)
+        os.makedirs(lengthdir)
+        _, fraglengths = anib.fragment_fasta_files(self.infnames[::2],
+                                                   lengthdir, self.fraglen)
+        assert_equal(anib.get_fragment_ordinals(['frag00001',
+                                                 'frag00010']).tolist(),
+                     [0, 9])
+        fname = os.path.join(lengthdir, 'fraglengths.npz')
+        anib.write_fraglengths(fraglengths, fname)
+        target = {qname: lengths.tolist() for qname, lengths in
+                  fraglengths.items()}
+        for archive in (None, pyani_archive.archive_dir(lengthdir)):
+            if archive is not None:
+                fname = os.path.split(fname)[-1]
+            result = anib.read_fraglengths(fname, archive)
+            assert_equal({qname: lengths.tolist() for qname, lengths in
+                          result.items()}, target)
+
 
 class TestParsing(unittest.TestCase):
 
@@ -361,6 +485,190 @@ class TestParsing(unittest.TestCase):
                                       0.3, 0.7, mode="ANIblastall")
         assert_equal(result, (1966922, 406104, 78.578978313253018))
 
+    def test_blasttab_dataframe(self):
+        """writes .dataframe files of best BLAST hits only on request."""
+        outdir = os.path.join('tests', 'test_output', 'anib')
+        os.makedirs(outdir, exist_ok=True)
+        fname = os.path.join(outdir, 'NC_002696_vs_NC_011916.blast_tab')
+        shutil.copy(os.path.join(self.anibdir,
+                                 os.path.split(fname)[-1]), fname)
+        if os.path.isfile(fname + '.dataframe'):
+            os.remove(fname + '.dataframe')
+        result = anib.parse_blast_tab(fname, None, 0.3, 0.7, mode="ANIb")
+        assert not os.path.isfile(fname + '.dataframe')
+        assert_equal(anib.parse_blast_tab(fname, None, 0.3, 0.7, mode="ANIb",
+                                          write_dataframe=True), result)
+        dfr = pd.read_csv(fname + '.dataframe', sep='\t', index_col=0)
+        assert dfr.index.is_unique
+        assert_equal(dfr['ani_alnlen'].sum(), result[0])
+        assert_equal(dfr['mismatch'].sum() + dfr['gaps'].sum(), result[1])
+
+    def test_blasttab_long_qids(self):
+        """rejects query IDs that would be truncated when loaded."""
+        outdir = os.path.join('tests', 'test_output', 'anib')
+        os.makedirs(outdir, exist_ok=True)
+        fname = os.path.join(outdir, 'long_vs_NC_011916.blast_tab')
+        with open(fname, 'w') as ofh:
+            for qid in ('frag%s1' % ('0' * 70), 'frag%s2' % ('0' * 70)):
+                ofh.write('\t'.join([qid, 'NC_011916', '1000', '10',
+                                     '99.0', '990', '1020', '5000', '1',
+                                     '1000', '1', '1000', '0.0', '1800',
+                                     '0']) + '\n')
+        assert_raises(ValueError, anib.load_blast_tab, fname, None)
+
+    def test_reduce_blasttab(self):
+        """reduces BLAST output to the totals of parse_blast_tab()."""
+        outdir = os.path.join('tests', 'test_output', 'anib', 'reduced')
+        os.makedirs(outdir, exist_ok=True)
+        hitsfile = os.path.join(outdir, 'NC_002696_vs_NC_011916.blast_tab')
+        fname = os.path.join(self.anibdir, os.path.split(hitsfile)[-1])
+        result = anib.parse_blast_tab(fname, None, 0.3, 0.7, mode="ANIb")
+        with open(fname, 'r') as ifh, open(hitsfile, 'w') as ofh:
+            assert_equal(anib.reduce_blast_tab(ifh, hitsfh=ofh), result)
+        # The best hits alone give the same totals
+        assert_equal(anib.parse_blast_tab(hitsfile, None, 0.3, 0.7,
+                                          mode="ANIb"), result)
+        # BLASTALL output needs the query fragment lengths
+        fname = os.path.join(self.aniblastalldir,
+                             'NC_002696_vs_NC_011916.blast_tab')
+        fraglengths = {'NC_002696': np.full(5000, 1020, dtype=np.int32)}
+        with open(fname, 'r') as ifh:
+            assert_equal(anib.reduce_blast_tab(ifh, mode="ANIblastall",
+                                               fraglengths=fraglengths[
+                                                   'NC_002696']),
+                         anib.parse_blast_tab(fname, fraglengths, 0.3, 0.7,
+                                              mode="ANIblastall"))
+        assert_equal(anib.reduce_blast_tab([]), (0, 0, 0))
+
+    def test_reduced_blastdir_processing(self):
+        """processes .blast_totals written by blast_reducer_wrapper.py."""
+        outdir = os.path.join('tests', 'test_output', 'anib', 'reduced')
+        if os.path.isdir(outdir):
+            shutil.rmtree(outdir)
+        os.makedirs(outdir)
+        wrapper = os.path.join('bin', 'blast_reducer_wrapper.py')
+        env = dict(os.environ, PYTHONPATH=os.getcwd())
+        # Stand in for BLASTN by writing existing output to STDOUT
+        for fname in os.listdir(self.anibdir):
+            if not fname.endswith('.blast_tab'):
+                continue
+            prefix = os.path.join(outdir, os.path.splitext(fname)[0])
+            subprocess.run([sys.executable, wrapper, '--mode', 'ANIb',
+                            prefix + '.blast_totals', 'cat',
+                            os.path.join(self.anibdir, fname)],
+                           env=env, check=True)
+        # A failed command writes no totals
+        assert subprocess.run([sys.executable, wrapper,
+                               os.path.join(outdir, 'failed.blast_totals'),
+                               'false'], env=env).returncode
+        assert not os.path.isfile(os.path.join(outdir, 'failed.blast_totals'))
+        orglengths = {os.path.split(fname)[-1].split('.')[0]: 5000000 for
+                      fname in self.infnames}
+        expected = anib.process_blast(self.anibdir, orglengths, mode="ANIb")
+        result = anib.process_blast(outdir, orglengths, mode="ANIb",
+                                    reduced=True)
+        for dfr in ('alignment_lengths', 'similarity_errors',
+                    'percentage_identity'):
+            assert_frame_equal(getattr(result, dfr), getattr(expected, dfr))
+
+    def test_split_combined_blast(self):
+        """split BLASTN output against a combined database by genome."""
+        batchdir = os.path.join('tests', 'test_output', 'anib', 'batches')
+        outdir = os.path.join('tests', 'test_output', 'anib', 'split')
+        os.makedirs(batchdir, exist_ok=True)
+        os.makedirs(outdir, exist_ok=True)
+        stems = ['NC_010338', 'NC_011916', 'NC_014100']
+        # Interleave pairwise output by fragment, tagging subject titles,
+        # and add a lower-ranked hit to another sequence of each genome
+        hits, targets = {}, {}
+        for stem in stems:
+            fname = os.path.join(self.anibdir,
+                                 'NC_002696_vs_%s.blast_tab' % stem)
+            with open(fname, 'r') as ifh:
+                targets[stem] = ifh.readlines()
+            for line in targets[stem]:
+                fields = line.rstrip('\n').split('\t')
+                hits.setdefault(fields[0], []).append(
+                    line.rstrip('\n') + '\t0.0\t%s::%s desc' %
+                    (stem, fields[1]))
+            for fragment in set(line.split('\t', 1)[0] for line in
+                                targets[stem]):
+                hits[fragment].append('\t'.join([fragment, 'other'] +
+                                                 ['100'] * 13 +
+                                                 ['0.0', '%s::other' % stem]))
+        blastfile = os.path.join(batchdir, 'NC_002696_vs_combined.blast_tab')
+        with open(blastfile, 'w') as ofh:
+            for fragment in sorted(hits):
+                ofh.write('\n'.join(hits[fragment]) + '\n')
+        outfiles = anib.split_combined_blast([(blastfile, 'NC_002696',
+                                               tuple(stems), (1, 1, 1))],
+                                             outdir)
+        for stem, outfile in zip(stems, outfiles):
+            assert_equal(os.path.split(outfile)[-1],
+                         'NC_002696_vs_%s.blast_tab' % stem)
+            with open(outfile, 'r') as ifh:
+                assert_equal(sorted(ifh.readlines()), sorted(targets[stem]))
+        # Partly written output is removed if a batch cannot be split
+        with open(blastfile, 'a') as ofh:
+            ofh.write('fragment\tother\t1e-\tNC_010338::other')
+        with self.assertRaises(ValueError):
+            anib.split_combined_blast([(blastfile, 'NC_002696', tuple(stems),
+                                        (1, 1, 1))], outdir)
+        for outfile in outfiles:
+            assert not os.path.isfile(outfile)
+
+    def test_split_combined_evalues(self):
+        """split combined BLASTN output gives the totals of pairwise runs."""
+        batchdir = os.path.join('tests', 'test_output', 'anib', 'batches')
+        outdir = os.path.join('tests', 'test_output', 'anib', 'split_evalue')
+        os.makedirs(batchdir, exist_ok=True)
+        os.makedirs(outdir, exist_ok=True)
+        # Each bundled genome is a single sequence, so subject lengths give
+        # the genome lengths
+        pairs, lengths = [], {}
+        for fname in pyani_files.get_input_files(self.anibdir, '.blast_tab'):
+            qstem, sstem = os.path.split(fname)[-1].split('.')[0].split('_vs_')
+            pairs.append((qstem, sstem))
+            with open(fname, 'r') as ifh:
+                lengths[sstem] = int(ifh.readline().split('\t')[7])
+        # Combined output for each query genome, with E-values reported over
+        # the smallest subject genome (as for make_combined_jobs()). Each
+        # fragment's top-ranked hit is to a decoy sequence that passes the
+        # E-value threshold only over the smallest subject genome.
+        batches = []
+        for qstem in sorted(lengths):
+            sstems = tuple(sorted(sstem for qry, sstem in pairs if
+                                  qry == qstem))
+            dbsize = min(lengths[sstem] for sstem in sstems)
+            scales = tuple(lengths[sstem] / dbsize for sstem in sstems)
+            blastfile = os.path.join(batchdir,
+                                     '%s_vs_combined.blast_tab' % qstem)
+            with open(blastfile, 'w') as ofh:
+                for sstem, scale in zip(sstems, scales):
+                    fname = os.path.join(self.anibdir, '%s_vs_%s.blast_tab' %
+                                         (qstem, sstem))
+                    with open(fname, 'r') as ifh:
+                        lines = ifh.readlines()
+                    for line in lines:
+                        fields = line.rstrip('\n').split('\t')
+                        if scale > 1.01:
+                            ofh.write('\t'.join(
+                                [fields[0], 'decoy', '1000', '0', '100.00',
+                                 '1000', '1000', '1000', '1', '1000', '1',
+                                 '1000', '1000', '100.00', '0',
+                                 '%.3g' % (1.01e-15 / scale),
+                                 '%s::decoy' % sstem]) + '\n')
+                        ofh.write(line.rstrip('\n') + '\t0.0\t%s::%s\n' %
+                                  (sstem, fields[1]))
+            batches.append((blastfile, qstem, sstems, scales))
+        assert any(scale > 1.01 for batch in batches for scale in batch[3])
+        outfiles = anib.split_combined_blast(batches, outdir)
+        assert_equal(len(outfiles), len(pairs))
+        for outfile in outfiles:
+            pairwise = os.path.join(self.anibdir, os.path.split(outfile)[-1])
+            assert_equal(anib.parse_blast_tab(outfile, None, 0.3, 0.7),
+                         anib.parse_blast_tab(pairwise, None, 0.3, 0.7))
+
     def test_blastdir_processing(self):
         """parses directory of .blast_tab output."""
         orglengths = pyani_files.get_sequence_lengths(self.infnames)
@@ -54,12 +54,13 @@ THE SOFTWARE.
 import os
 import unittest
 
+import numpy as np
 import pandas as pd
 
-from nose.tools import (assert_equal,)
+from nose.tools import (assert_equal, assert_true)
 from pandas.util.testing import (assert_frame_equal,)
 
-from pyani import (anim, pyani_files)
+from pyani import (anim, pyani_config, pyani_files)
 
 
 class TestNUCmerCmdline(unittest.TestCase):
@@ -123,6 +124,14 @@ class TestNUCmerCmdline(unittest.TestCase):
                                                    maxmatch=True)
         assert_equal(ncmd, self.ntgtmax)
 
+    def test_threads_cmd_generation(self):
+        """generate NUCmer command line with multiple threads."""
+        ncmd, fcmd = anim.construct_nucmer_cmdline("file1.fna", "file2.fna",
+                                                   outdir=self.outdir,
+                                                   threads=4)
+        assert_equal(ncmd, self.ntgt.replace("--mum", "--mum -t 4"))
+        assert_equal(fcmd, self.ftgt)
+
     def test_multi_cmd_generation(self):
         """generate multiple abstract NUCmer/delta-filter command-lines.
 
@@ -145,6 +154,126 @@ class TestNUCmerCmdline(unittest.TestCase):
             assert_equal(job.dependencies[0].name,
                          "test_%06d-n" % idx)            # NUCmer job name
 
+    def test_nucmer_job_costs(self):
+        """generate NUCmer jobs with costs from sequence lengths."""
+        lengths = {'file1': 1, 'file2': 20, 'file3': 300, 'file4': 4000}
+        joblist = anim.generate_nucmer_jobs(self.files, jobprefix="test",
+                                            org_lengths=lengths)
+        assert_equal([job.cost for job in joblist],
+                     [21, 301, 4001, 320, 4020, 4300])
+        assert_equal([job.dependencies[0].cost for job in joblist],
+                     [21, 301, 4001, 320, 4020, 4300])
+
+    def test_nucmer_job_generation_native(self):
+        """generate NUCmer jobs only, for the native 1-to-1 filter."""
+        joblist = anim.generate_nucmer_jobs(self.files,
+                                            jobprefix="test",
+                                            filter_engine="native")
+        assert_equal(len(joblist), 6)
+        for idx, job in enumerate(joblist):
+            assert_equal(job.name, "test_%06d-n" % idx)  # NUCmer job name
+            assert_equal(job.command, self.ncmdlist[idx])
+            assert_equal(len(job.dependencies), 0)
+
+
+class TestNUCmerBatches(unittest.TestCase):
+
+    """Class defining tests of batched NUCmer runs."""
+
+    def setUp(self):
+        """Set parameters for tests."""
+        self.outdir = os.path.join('tests', 'test_output', 'anim_batch')
+        self.deltadir = os.path.join('tests', 'test_input', 'anim',
+                                     'deltadir')
+        self.batchdir = os.path.join(self.outdir, 'nucmer_output', 'batches')
+        os.makedirs(self.outdir, exist_ok=True)
+        self.files = []
+        for stem in ('file1', 'file2', 'file3', 'file4'):
+            fname = os.path.join(self.outdir, stem + '.fna')
+            with open(fname, 'w') as ofh:
+                ofh.write(">seq1 %s\nACGT\n>seq2\nGGCC\n" % stem)
+            self.files.append(fname)
+
+    def test_batch_job_generation(self):
+        """generate batched NUCmer jobs and tagged query files."""
+        joblist, batches = anim.generate_nucmer_batch_jobs(self.files,
+                                                           self.outdir,
+                                                           jobprefix="test",
+                                                           batchsize=2)
+        batchfiles = [os.path.join(self.batchdir, "batch_%06d.fna" % idx)
+                      for idx in range(3)]
+        # file1 queries: [file2], [file3, file4]; file2: [file3, file4];
+        # file3: [file4]
+        assert_equal([job.command.split()[-1] for job in joblist],
+                     [batchfiles[0], batchfiles[1], batchfiles[1],
+                      batchfiles[2]])
+        assert_equal([job.name for job in joblist],
+                     ["test_%06d-n" % idx for idx in range(4)])
+        assert_equal([batch[1:] for batch in batches],
+                     [('file1', tuple(self.files[1:2])),
+                      ('file1', tuple(self.files[2:])),
+                      ('file2', tuple(self.files[2:])),
+                      ('file3', tuple(self.files[3:]))])
+        assert_equal(batches[1][0],
+                     os.path.join(self.batchdir,
+                                  'file1_vs_batch_000001.delta'))
+        with open(batchfiles[1], 'r') as ifh:
+            assert_equal([line for line in ifh if line.startswith('>')],
+                         [">file3::seq1 file3\n", ">file3::seq2\n",
+                          ">file4::seq1 file4\n", ">file4::seq2\n"])
+
+    def test_batch_stems(self):
+        """rejects file stems containing the batch tag separator."""
+        fname = os.path.join(self.outdir, 'file::5.fna')
+        with open(fname, 'w') as ofh:
+            ofh.write(">seq1\nACGT\n")
+        with self.assertRaises(ValueError):
+            anim.generate_nucmer_batch_jobs(self.files + [fname],
+                                            self.outdir)
+
+    def test_split_batch_deltas(self):
+        """split batched NUCmer output into per-comparison .delta files."""
+        os.makedirs(self.batchdir, exist_ok=True)
+        stems = ['NC_010338', 'NC_011916', 'NC_014100']
+        batchdelta = os.path.join(self.batchdir, 'batch.delta')
+        with open(batchdelta, 'w') as ofh:
+            for idx, stem in enumerate(stems):
+                fname = os.path.join(self.deltadir,
+                                     'NC_002696_vs_%s.delta' % stem)
+                with open(fname, 'r') as ifh:
+                    preamble = ifh.readline() + ifh.readline()
+                    if not idx:
+                        ofh.write(preamble)
+                    for line in ifh:
+                        if line.startswith('>'):
+                            ref, qry = line.split(' ', 1)
+                            line = '%s %s::%s' % (ref, stem, qry)
+                        ofh.write(line)
+        qfiles = tuple(os.path.join('tests', 'test_input', 'sequences',
+                                    stem + '.fna') for stem in stems)
+        outfiles = anim.split_batch_deltas([(batchdelta, 'NC_002696',
+                                             qfiles)], self.outdir)
+        for stem, qfile, outfile in zip(stems, qfiles, outfiles):
+            assert_equal(outfile,
+                         os.path.join(self.outdir,
+                                      'NC_002696_vs_%s.delta' % stem))
+            fname = os.path.join(self.deltadir,
+                                 'NC_002696_vs_%s.delta' % stem)
+            with open(fname, 'r') as ifh:
+                target = ifh.readlines()
+            with open(outfile, 'r') as ifh:
+                result = ifh.readlines()
+            # The header names the query genome, not the batch file
+            assert_equal(result[0], '%s %s\n' % (target[0].split()[0],
+                                                  os.path.abspath(qfile)))
+            assert_equal(result[1:], target[1:])
+        # Partly written output is removed if a batch cannot be split
+        with self.assertRaises(KeyError):
+            anim.split_batch_deltas([(batchdelta, 'NC_002696', qfiles[:2])],
+                                    self.outdir)
+        for outfile in outfiles[:2]:
+            assert not os.path.isfile(outfile)
+
 
 class TestDeltafileProcessing(unittest.TestCase):
 
@@ -170,6 +299,86 @@ class TestDeltafileProcessing(unittest.TestCase):
         result = anim.parse_delta(self.deltafile)
         assert_equal(result, (4073917, 2191))
 
+    def test_deltafile_chunked_import(self):
+        """parses NUCmer .delta/.filter file in small blocks."""
+        result = anim.parse_delta(self.deltafile, chunksize=17)
+        assert_equal(result, (4073917, 2191))
+
+    def test_deltafile_whitespace_import(self):
+        """parses .delta file with tab separators and CRLF line endings."""
+        outdir = os.path.join('tests', 'test_output', 'anim')
+        os.makedirs(outdir, exist_ok=True)
+        fname = os.path.join(outdir, 'whitespace.delta')
+        with open(self.deltafile, 'r') as ifh:
+            lines = ifh.read().split('\n')
+        with open(fname, 'w', newline='') as ofh:
+            ofh.write('\r\n'.join(lines[:2] +
+                                   [line.replace(' ', '\t') + ' '
+                                    if not line.startswith('>') else line
+                                    for line in lines[2:]]))
+        result = anim.parse_delta(fname)
+        assert_equal(result, (4073917, 2191))
+
+    def test_deltafile_records(self):
+        """parses per-alignment records from NUCmer .delta/.filter file."""
+        aln_length, sim_errors, records = anim.parse_delta(self.deltafile,
+                                                           records=True)
+        assert_equal((aln_length, sim_errors), (4073917, 2191))
+        assert_equal(len(records), 84)
+        assert_equal(records.dtype, np.dtype(anim.DELTA_DTYPE))
+        assert_equal(tuple(records[0]), (0, 0, 1, 473068, 1, 473068, 6, 6, 0))
+        assert_equal(int(records['sim_errors'].sum()), sim_errors)
+
+    def test_native_filter(self):
+        """native 1-to-1 filter of .delta matches delta-filter -1 output."""
+        deltafiles = pyani_files.get_input_files(self.deltadir, '.delta')
+        assert_equal(len(deltafiles), 6)
+        for deltafile in deltafiles:
+            filterfile = os.path.splitext(deltafile)[0] + '.filter'
+            records = anim.parse_delta(deltafile, records=True)[2]
+            filtered = anim.parse_delta(filterfile, records=True)[2]
+            assert_equal(records[anim.filter_delta_1to1(records)].tolist(),
+                         filtered.tolist())
+            result = anim.parse_delta_native_task((0, 1, deltafile))
+            assert_equal(result,
+                         [(0, 1) + anim.parse_delta(filterfile) +
+                          anim.get_delta_coverage(filtered)])
+
+    def test_chain_intervals(self):
+        """chains sorted intervals, skipping contained repeats."""
+        lows = np.array([1, 50, 120, 300])
+        highs = np.array([100, 80, 250, 400])
+        identity = np.array([1.0, 0.9, 0.95, 1.0])
+        assert_equal(anim.chain_intervals(lows, highs, identity).tolist(),
+                     [0, 2, 3])
+
+    def test_covered_bases(self):
+        """counts bases covered by overlapping intervals once."""
+        seqids = np.array([0, 0, 1, 0, 1, 0])
+        starts = np.array([1, 50, 10, 200, 30, 301])
+        ends = np.array([100, 150, 20, 300, 15, 400])
+        # 1-150 and 200-400 on sequence 0; 10-30 on sequence 1
+        assert_equal(anim.get_covered_bases(seqids, starts, ends),
+                     150 + 201 + 21)
+        assert_equal(anim.get_covered_bases(seqids[:0], starts[:0],
+                                            ends[:0]), 0)
+
+    def test_delta_coverage(self):
+        """counts reference and query bases covered by .filter records."""
+        records = anim.parse_delta(self.deltafile, records=True)[2]
+        expected = []
+        for side in ('ref', 'qry'):
+            starts, ends = records[side + '_start'], records[side + '_end']
+            covered = 0
+            for seqid in np.unique(records[side + '_id']):
+                mask = np.zeros(max(starts.max(), ends.max()) + 1, dtype=bool)
+                for start, end in zip(starts[records[side + '_id'] == seqid],
+                                      ends[records[side + '_id'] == seqid]):
+                    mask[min(start, end):max(start, end) + 1] = True
+                covered += mask.sum()
+            expected.append(covered)
+        assert_equal(anim.get_delta_coverage(records), tuple(expected))
+
     def test_process_deltadir(self):
         """processes directory of .delta files into ANIResults."""
         seqfiles = pyani_files.get_fasta_files(self.seqdir)
@@ -177,3 +386,43 @@ class TestDeltafileProcessing(unittest.TestCase):
         result = anim.process_deltadir(self.deltadir, orglengths)
         assert_frame_equal(result.percentage_identity.sort_index(1).sort_index(),
                            self.df_pid.sort_index(1).sort_index())
+
+    def test_process_deltadir_rectangular(self):
+        """processes query vs reference .delta files into ANIResults."""
+        orglengths = {'NC_002696': 4042929, 'NC_010338': 5477872,
+                      'NC_011916': 4042929, 'NC_014100': 4655622}
+        queries, references = ['NC_002696', 'NC_010338'], ['NC_011916',
+                                                            'NC_014100']
+        result = anim.process_deltadir(self.deltadir, orglengths,
+                                       labels=queries, columns=references)
+        assert_equal(result.percentage_identity.shape, (2, 2))
+        assert_frame_equal(result.percentage_identity,
+                           self.df_pid.loc[queries, references])
+        # Covered bases are output with the other ANIm results
+        data = {stem: dfr for dfr, stem in result.data}
+        assert_equal(sorted(data), sorted(pyani_config.ANIM_FILESTEMS))
+        assert_frame_equal(data['ANIm_covered_bases'], result.covered_bases)
+        assert_frame_equal(data['ANIm_covered_fraction'],
+                           result.covered_fraction)
+
+    def test_prefiltered_results(self):
+        """marks prefiltered comparisons as not computed in ANIResults."""
+        orglengths = {'NC_002696': 4042929, 'NC_010338': 5477872,
+                      'NC_011916': 4042929, 'NC_014100': 4655622}
+        result = anim.process_deltadir(self.deltadir, orglengths)
+        pairs = [('NC_002696', 'NC_010338'), ('NC_011916', 'NC_014100')]
+        result.add_not_computed(pairs, pyani_config.PREFILTERED)
+        for qname, sname in pairs:
+            for dfr in (result.percentage_identity,
+                        result.alignment_coverage,
+                        result.alignment_lengths, result.hadamard):
+                assert_true(np.isnan(dfr.loc[qname, sname]))
+                assert_true(np.isnan(dfr.loc[sname, qname]))
+        target = anim.process_deltadir(self.deltadir, orglengths)
+        assert_equal(result.percentage_identity.loc['NC_002696',
+                                                    'NC_011916'],
+                     target.percentage_identity.loc['NC_002696',
+                                                    'NC_011916'])
+        table = result.not_computed_table
+        assert_equal(len(table), 4)
+        assert_equal(set(table['status']), {pyani_config.PREFILTERED})
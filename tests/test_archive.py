@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""test_archive.py
+
+Test pyani_archive.py module.
+
+These tests are intended to be run from the repository root using:
+
+nosetests -v
+
+print() statements will be caught by nosetests unless there is an
+error. They can also be recovered with the -s option.
+
+(c) The James Hutton Institute 2017
+Author: Leighton Pritchard
+
+Contact:
+leighton.pritchard@hutton.ac.uk
+
+Leighton Pritchard,
+Information and Computing Sciences,
+James Hutton Institute,
+Errol Road,
+Invergowrie,
+Dundee,
+DD6 9LH,
+Scotland,
+UK
+
+The MIT License
+
+Copyright (c) 2017 The James Hutton Institute
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+import os
+import shutil
+import unittest
+
+from nose.tools import (assert_equal, )
+from pandas.util.testing import (assert_frame_equal,)
+
+from pyani import (anib, anim, pyani_archive, pyani_files)
+
+
+class TestArchive(unittest.TestCase):
+
+    """Class defining tests of comparison output archives."""
+
+    def setUp(self):
+        """Define parameters and values for tests."""
+        self.deltadir = os.path.join('tests', 'test_input', 'anim',
+                                     'deltadir')
+        self.blastdir = os.path.join('tests', 'test_input', 'anib', 'blastn')
+        self.orglengths = {'NC_002696': 4042929, 'NC_010338': 5477872,
+                           'NC_011916': 4042929, 'NC_014100': 4655622}
+        self.outdir = os.path.join('tests', 'test_output', 'archive')
+        if os.path.isdir(self.outdir):
+            shutil.rmtree(self.outdir)
+        os.makedirs(self.outdir)
+
+    def copy_files(self, indir, ext):
+        """Returns path to a copy of the files in indir with extension ext."""
+        outdir = os.path.join(self.outdir, os.path.split(indir)[-1])
+        os.makedirs(outdir)
+        for filename in pyani_files.get_input_files(indir, ext):
+            shutil.copy(filename, outdir)
+        return outdir
+
+    def test_archive_members(self):
+        """reads individual files back from an archived directory."""
+        outdir = self.copy_files(self.deltadir, '.filter')
+        os.makedirs(os.path.join(outdir, 'subdir'))
+        shutil.copy(os.path.join(self.deltadir,
+                                 'NC_002696_vs_NC_010338.delta'),
+                    os.path.join(outdir, 'subdir'))
+        archive = pyani_archive.archive_dir(outdir, workers=2)
+        assert_equal(archive, outdir + '.zip')
+        filenames = pyani_files.get_input_files(outdir, '.filter')
+        shutil.rmtree(outdir)
+        found, members = pyani_archive.get_output_files(outdir, '.filter')
+        assert_equal(found, archive)
+        assert_equal(sorted(members),
+                     sorted(os.path.split(fname)[-1] for fname in filenames))
+        for filename in filenames:
+            member = os.path.split(filename)[-1]
+            with pyani_archive.open_file(member, archive) as ifh:
+                with open(os.path.join(self.deltadir, member)) as tfh:
+                    assert_equal(ifh.read(), tfh.read())
+
+    def test_deltadir_archive(self):
+        """processes .delta files identically from an archive."""
+        outdir = self.copy_files(self.deltadir, '.filter')
+        text = anim.process_deltadir(outdir, self.orglengths, workers=1)
+        pyani_archive.archive_dir(outdir)
+        shutil.rmtree(outdir)
+        archived = anim.process_deltadir(outdir, self.orglengths, workers=2,
+                                         sidecar=True)
+        for (tdfr, _), (adfr, _) in zip(text.data, archived.data):
+            assert_frame_equal(tdfr, adfr)
+
+    def test_blastdir_archive(self):
+        """processes .blast_tab files identically from an archive."""
+        outdir = self.copy_files(self.blastdir, '.blast_tab')
+        text = anib.process_blast(outdir, self.orglengths, workers=1)
+        pyani_archive.archive_dir(outdir)
+        shutil.rmtree(outdir)
+        archived = anib.process_blast(outdir, self.orglengths, workers=2)
+        for (tdfr, _), (adfr, _) in zip(text.data, archived.data):
+            assert_frame_equal(tdfr, adfr)
@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""test_cache.py
+
+Test pyani_cache.py module.
+
+These tests are intended to be run from the repository root using:
+
+nosetests -v
+
+print() statements will be caught by nosetests unless there is an
+error. They can also be recovered with the -s option.
+
+(c) The James Hutton Institute 2017
+Author: Leighton Pritchard
+
+Contact:
+leighton.pritchard@hutton.ac.uk
+
+Leighton Pritchard,
+Information and Computing Sciences,
+James Hutton Institute,
+Errol Road,
+Invergowrie,
+Dundee,
+DD6 9LH,
+Scotland,
+UK
+
+The MIT License
+
+Copyright (c) 2017 The James Hutton Institute
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import os
+import shutil
+import unittest
+
+import numpy as np
+
+from nose.tools import (assert_equal, assert_true)
+from pandas.util.testing import (assert_frame_equal,)
+
+from pyani import (anib, anim, pyani_cache)
+from pyani.pyani_tools import ANIResults
+
+
+class TestResultCache(unittest.TestCase):
+
+    """Class defining tests of the pairwise comparison result cache."""
+
+    def setUp(self):
+        """Define parameters and values for tests."""
+        self.cachedir = os.path.join('tests', 'test_output', 'cache')
+        if os.path.isdir(self.cachedir):
+            shutil.rmtree(self.cachedir)
+        self.deltadir = os.path.join('tests', 'test_input', 'anim',
+                                     'deltadir')
+        self.blastdir = os.path.join('tests', 'test_input', 'anib', 'blastn')
+        self.orglengths = {'NC_002696': 4042929, 'NC_010338': 5477872,
+                           'NC_011916': 4042929, 'NC_014100': 4655622}
+        self.labels = sorted(self.orglengths)
+        # Hash order differs from label order for some pairs
+        self.hashes = dict(zip(self.labels, ['d', 'b', 'c', 'a']))
+        self.pairs = [(self.labels[idx], label) for idx in range(4)
+                      for label in self.labels[idx + 1:]]
+        self.files = ["file1", "file2", "file3", "file4"]
+
+    def test_make_key(self):
+        """symmetrical keys ignore comparison direction."""
+        key_ab = pyani_cache.make_key('a', 'b', 'ANIm', {'maxmatch': False},
+                                      '3.1')[0]
+        key_ba = pyani_cache.make_key('b', 'a', 'ANIm', {'maxmatch': False},
+                                      '3.1')[0]
+        assert_equal(key_ab, key_ba)
+        key_ab = pyani_cache.make_key('a', 'b', 'ANIb', {'fragsize': 1020},
+                                      '2.6', sym=False)[0]
+        key_ba = pyani_cache.make_key('b', 'a', 'ANIb', {'fragsize': 1020},
+                                      '2.6', sym=False)[0]
+        assert_equal(key_ab == key_ba, False)
+
+    def test_put_get(self):
+        """stores and retrieves values, persisting between sessions."""
+        cache = pyani_cache.ResultCache(self.cachedir)
+        key, components = pyani_cache.make_key('a', 'b', 'ANIm', {}, '3.1')
+        assert_equal(cache.get(key), None)
+        cache.put(key, components, (100, 2, 0.98, 0.5, 0.25))
+        cache.close()
+        cache = pyani_cache.ResultCache(self.cachedir)
+        assert_equal(cache.get(key), (100, 2, 0.98, 0.5, 0.25))
+        assert_equal(cache.info()['entries'], 1)
+
+    def test_prune(self):
+        """evicts least recently used entries beyond the size limit."""
+        cache = pyani_cache.ResultCache(self.cachedir)
+        keys = []
+        for genome in 'abcd':
+            key, components = pyani_cache.make_key(genome, 'z', 'ANIm', {},
+                                                   '3.1')
+            cache.put(key, components, (1, 2, 3, 4, 5))
+            keys.append(key)
+        cache.commit()
+        cache.get(keys[0])  # most recently used
+        size = cache.info()['size'] // 4
+        assert_equal(cache.prune(2 * size), 2)
+        assert_equal([cache.get(key) is None for key in keys],
+                     [False, True, True, False])
+
+    def test_anim_roundtrip(self):
+        """caches ANIm results, and restores them to ANIResults."""
+        cache = pyani_cache.ResultCache(self.cachedir)
+        results = anim.process_deltadir(self.deltadir, self.orglengths,
+                                        workers=1)
+        assert_equal(pyani_cache.store_results(cache, results, self.hashes,
+                                               self.pairs, {}, '3.1'), 6)
+        restored = ANIResults(list(self.orglengths.keys()), "ANIm")
+        restored.add_org_lengths(self.orglengths)
+        missing = pyani_cache.fetch_results(cache, restored, self.hashes,
+                                            [pair[::-1] for pair in
+                                             self.pairs],
+                                            {}, '3.1')
+        assert_equal(missing, [])
+        for (dfr, _), (rdfr, _) in zip(results.data, restored.data):
+            assert_frame_equal(dfr, rdfr)
+        assert_frame_equal(results.covered_bases, restored.covered_bases)
+        assert_frame_equal(results.covered_fraction,
+                           restored.covered_fraction)
+        assert_equal(pyani_cache.find_missing(cache, self.hashes, self.pairs,
+                                              "ANIm", {}, '3.2'), self.pairs)
+
+    def test_anib_roundtrip(self):
+        """caches ANIb results by direction, and restores them."""
+        cache = pyani_cache.ResultCache(self.cachedir)
+        results = anib.process_blast(self.blastdir, self.orglengths,
+                                     mode="ANIb", workers=1)
+        pairs = self.pairs + [pair[::-1] for pair in self.pairs]
+        assert_equal(pyani_cache.store_results(cache, results, self.hashes,
+                                               pairs[:9], {}, '2.6',
+                                               sym=False), 9)
+        assert_equal(pyani_cache.find_missing(cache, self.hashes, pairs,
+                                              "ANIb", {}, '2.6', sym=False),
+                     pairs[9:])
+        restored = ANIResults(list(self.orglengths.keys()), "ANIb")
+        pyani_cache.fetch_results(cache, restored, self.hashes, pairs[:9],
+                                  {}, '2.6', sym=False)
+        for qname, sname in pairs[:9]:
+            for (dfr, _), (rdfr, _) in zip(results.data, restored.data):
+                assert_equal(dfr.loc[qname, sname], rdfr.loc[qname, sname])
+
+    def test_anib_combined(self):
+        """keeps pairwise and combined database ANIb results apart."""
+        cache = pyani_cache.ResultCache(self.cachedir)
+        results = anib.process_blast(self.blastdir, self.orglengths,
+                                     mode="ANIb", workers=1)
+        pairs = self.pairs + [pair[::-1] for pair in self.pairs]
+        pairwise = anib.get_cache_params(1020)
+        combined = anib.get_cache_params(1020, combined=True)
+        assert_equal(pyani_cache.store_results(cache, results, self.hashes,
+                                               pairs, pairwise, '2.6',
+                                               sym=False), 12)
+        assert_equal(pyani_cache.find_missing(cache, self.hashes, pairs,
+                                              "ANIb", combined, '2.6',
+                                              sym=False), pairs)
+        restored = ANIResults(list(self.orglengths.keys()), "ANIb")
+        assert_equal(pyani_cache.fetch_results(cache, restored, self.hashes,
+                                               pairs, combined, '2.6',
+                                               sym=False), pairs)
+        assert_equal(pyani_cache.find_missing(cache, self.hashes, pairs,
+                                              "ANIb", pairwise, '2.6',
+                                              sym=False), [])
+
+    def test_anim_rectangular(self):
+        """caches query vs reference ANIm results for reuse in any layout."""
+        cache = pyani_cache.ResultCache(self.cachedir)
+        queries, references = self.labels[:2], self.labels[2:]
+        pairs = [(qname, sname) for qname in queries for sname in references]
+        results = anim.process_deltadir(self.deltadir, self.orglengths,
+                                        workers=1, labels=queries,
+                                        columns=references)
+        assert_equal(pyani_cache.store_results(cache, results, self.hashes,
+                                               pairs, {}, '3.1',
+                                               org_lengths=self.orglengths),
+                     4)
+        restored = ANIResults(queries, "ANIm", references)
+        pyani_cache.fetch_results(cache, restored, self.hashes, pairs, {},
+                                  '3.1')
+        for (dfr, _), (rdfr, _) in zip(results.data, restored.data):
+            assert_frame_equal(dfr, rdfr)
+        # Subject covered bases are not held in rectangular results, so
+        # these entries are recalculated for an all-vs-all analysis
+        assert_equal(pyani_cache.find_missing(cache, self.hashes, pairs,
+                                              "ANIm", {}, '3.1',
+                                              square=False), [])
+        assert_equal(pyani_cache.find_missing(cache, self.hashes, pairs,
+                                              "ANIm", {}, '3.1'), pairs)
+        square = anim.process_deltadir(self.deltadir, self.orglengths,
+                                       workers=1)
+        restored = ANIResults(self.labels, "ANIm")
+        assert_equal(pyani_cache.fetch_results(cache, restored, self.hashes,
+                                               pairs, {}, '3.1'), pairs)
+        # Cached values are then the same as those from the analysis
+        pyani_cache.store_results(cache, square, self.hashes, pairs, {},
+                                  '3.1')
+        assert_equal(pyani_cache.fetch_results(cache, restored, self.hashes,
+                                               pairs, {}, '3.1'), [])
+        for qname, sname in pairs + [pair[::-1] for pair in pairs]:
+            for (dfr, _), (rdfr, _) in zip(square.data, restored.data):
+                assert_equal(dfr.loc[qname, sname], rdfr.loc[qname, sname])
+
+    def test_nucmer_pairs(self):
+        """generates NUCmer jobs only for requested pairs."""
+        ncmds, _ = anim.generate_nucmer_commands(self.files,
+                                                 pairs={('file1', 'file3'),
+                                                        ('file2', 'file4')})
+        assert_equal(ncmds,
+                     ['nucmer --mum -p ./nucmer_output/file1_vs_file3 ' +
+                      'file1 file3',
+                      'nucmer --mum -p ./nucmer_output/file2_vs_file4 ' +
+                      'file2 file4'])
+
+    def test_blast_pairs(self):
+        """generates BLAST jobs only for requested comparisons."""
+        fragfiles = [os.path.join(self.cachedir, fname + '-fragments.fna')
+                     for fname in self.files]
+        infiles = [fname + '.fna' for fname in self.files]
+        blastcmds = anib.make_blastcmd_builder("ANIb", self.cachedir)
+        jobgraph = anib.make_job_graph(infiles, fragfiles, blastcmds,
+                                       pairs={('file1', 'file3'),
+                                              ('file4', 'file2')})
+        assert_equal([job.name for job in jobgraph],
+                     ['ANIBLAST_exe_000006_a', 'ANIBLAST_exe_000009_b'])
+        assert_equal([job.dependencies[0].command.split()[4]
+                      for job in jobgraph], ['file3.fna', 'file2.fna'])
+
+
+class TestSignatureCache(unittest.TestCase):
+
+    """Class defining tests of the TETRA signature cache."""
+
+    def setUp(self):
+        """Define parameters and values for tests."""
+        self.cachedir = os.path.join('tests', 'test_output', 'sigcache')
+        if os.path.isdir(self.cachedir):
+            shutil.rmtree(self.cachedir)
+        self.signatures = np.random.RandomState(2).randn(3, 256)
+        self.signatures[0, :4] = np.nan  # unobserved tetranucleotides
+
+    def test_put_get(self):
+        """stores and retrieves signatures, persisting between sessions."""
+        cache = pyani_cache.SignatureCache(self.cachedir)
+        assert_equal(cache.get_row('a'), None)
+        assert_equal(cache.signatures().shape, (0, 256))
+        for genome, signature in zip('abc', self.signatures):
+            cache.put(genome, signature)
+        cache.close()
+        cache = pyani_cache.SignatureCache(self.cachedir)
+        assert_equal(cache.info()['entries'], 3)
+        assert_equal([cache.get_row(genome) for genome in 'abc'], [0, 1, 2])
+        assert isinstance(cache.signatures(), np.memmap)
+        np.testing.assert_array_equal(cache.get(['c', 'a']),
+                                      self.signatures[[2, 0]])
+        # Replacing a signature reuses its row
+        assert_equal(cache.put('b', self.signatures[0]), 1)
+        np.testing.assert_array_equal(cache.signatures(),
+                                      self.signatures[[0, 0, 2]])
+        with self.assertRaises(KeyError):
+            cache.get(['a', 'd'])
+        cache.close()
+
+    def test_concurrent_put(self):
+        """gives distinct rows to signatures stored by concurrent sessions."""
+        first = pyani_cache.SignatureCache(self.cachedir)
+        second = pyani_cache.SignatureCache(self.cachedir)
+        second.conn.execute('PRAGMA busy_timeout = 0')
+        assert_equal([first.put('a', self.signatures[0]),
+                      second.put('b', self.signatures[1]),
+                      first.put('c', self.signatures[2])], [0, 1, 2])
+        assert_true(not first.conn.in_transaction)
+        np.testing.assert_array_equal(second.get(['a', 'b', 'c']),
+                                      self.signatures)
+        with self.assertRaises(ValueError):
+            first.put('d', self.signatures[0, :10])
+        assert_equal(first.get_row('d'), None)
+        first.close()
+        second.close()
+
+    def test_shared_cachedir(self):
+        """shares a cache directory with pairwise comparison results."""
+        results = pyani_cache.ResultCache(self.cachedir)
+        key, components = pyani_cache.make_key('a', 'b', 'ANIm', {}, '3.1')
+        results.put(key, components, (100, 2, 0.98))
+        results.close()
+        cache = pyani_cache.SignatureCache(self.cachedir)
+        cache.put('a', self.signatures[1])
+        cache.close()
+        assert_equal(pyani_cache.ResultCache(self.cachedir).get(key),
+                     (100, 2, 0.98))
+        np.testing.assert_array_equal(
+            pyani_cache.SignatureCache(self.cachedir).get(['a']),
+            self.signatures[[1]])
@@ -83,3 +83,30 @@ def test_svg_seaborn():
 def test_pdf_seaborn():
     """Write .pdf graphics with seaborn"""
     draw_format_method("pdf", "seaborn")
+
+
+def draw_rectangular_method(mth):
+    """Render query vs reference (non-square) output."""
+    infilename = os.path.join("tests", "target_ANIm_output",
+                              "ANIm_percentage_identity.tab")
+    outfilename = os.path.join(OUTDIR, "%s_rectangular.png" % mth)
+    stem = "ANIm_percentage_identity"
+    df = pd.read_csv(infilename, index_col=0, sep="\t").iloc[:3, 3:]
+    classes = {label: label.split('_')[0] for label in df.index}
+    os.makedirs(OUTDIR, exist_ok=True)
+    fn = {"mpl": pyani_graphics.heatmap_mpl,
+          "seaborn": pyani_graphics.heatmap_seaborn}
+    method_params = pyani_graphics.Params(pyani_config.params_mpl(df)[stem],
+                                          None, classes)
+    fn[mth](df, outfilename, title="%s:rectangular test" % mth,
+            params=method_params)
+
+
+def test_rectangular_mpl():
+    """Write query vs reference graphics with mpl"""
+    draw_rectangular_method("mpl")
+
+
+def test_rectangular_seaborn():
+    """Write query vs reference graphics with seaborn"""
+    draw_rectangular_method("seaborn")
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""test_ingest.py
+
+Test pyani_ingest.py module.
+
+These tests are intended to be run from the repository root using:
+
+nosetests -v
+
+print() statements will be caught by nosetests unless there is an
+error. They can also be recovered with the -s option.
+
+(c) The James Hutton Institute 2017
+Author: Leighton Pritchard
+
+Contact:
+leighton.pritchard@hutton.ac.uk
+
+Leighton Pritchard,
+Information and Computing Sciences,
+James Hutton Institute,
+Errol Road,
+Invergowrie,
+Dundee,
+DD6 9LH,
+Scotland,
+UK
+
+The MIT License
+
+Copyright (c) 2017 The James Hutton Institute
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import os
+import shutil
+import unittest
+
+import numpy as np
+
+from nose.tools import (assert_equal, )
+from pandas.util.testing import (assert_frame_equal,)
+
+from pyani import (anib, anim, pyani_files, pyani_ingest)
+
+
+class TestIngest(unittest.TestCase):
+
+    """Class defining tests of parallel output file ingestion."""
+
+    def setUp(self):
+        """Define parameters and values for tests."""
+        self.deltadir = os.path.join('tests', 'test_input', 'anim',
+                                     'deltadir')
+        self.blastdir = os.path.join('tests', 'test_input', 'anib', 'blastn')
+        self.orglengths = {'NC_002696': 4042929, 'NC_010338': 5477872,
+                           'NC_011916': 4042929, 'NC_014100': 4655622}
+        self.labels = sorted(self.orglengths)
+        self.outdir = os.path.join('tests', 'test_output', 'ingest')
+        if os.path.isdir(self.outdir):
+            shutil.rmtree(self.outdir)
+        os.makedirs(self.outdir)
+
+    def test_comparison_tasks(self):
+        """builds parsing tasks from output filenames."""
+        filenames = ['out/NC_002696_vs_NC_014100.filter',
+                     'out/NC_000000_vs_NC_014100.filter']
+        tasks = pyani_ingest.get_comparison_tasks(filenames, self.labels)
+        assert_equal(tasks, [(0, 3, filenames[0])])
+
+    def test_ingest_serial_parallel(self):
+        """parallel ingestion returns same values as serial ingestion."""
+        filenames = pyani_files.get_input_files(self.deltadir, '.filter')
+        tasks = pyani_ingest.get_comparison_tasks(filenames, self.labels)
+        serial = pyani_ingest.ingest(tasks, anim.parse_delta_task, 6,
+                                     workers=1)
+        parallel = pyani_ingest.ingest(tasks, anim.parse_delta_task, 6,
+                                       workers=2, chunksize=1)
+        assert_equal(serial.shape, (len(tasks), 6))
+        assert_equal(serial.tolist(), parallel.tolist())
+        for row, task in zip(serial, tasks):
+            assert_equal(tuple(row[2:4]), anim.parse_delta(task[2]))
+
+    def test_deltadir_workers(self):
+        """processes .delta files identically with one or more workers."""
+        serial = anim.process_deltadir(self.deltadir, self.orglengths,
+                                       workers=1)
+        parallel = anim.process_deltadir(self.deltadir, self.orglengths,
+                                         workers=2, chunksize=2)
+        for (sdfr, _), (pdfr, _) in zip(serial.data, parallel.data):
+            assert_frame_equal(sdfr, pdfr)
+
+    def test_blastdir_workers(self):
+        """processes .blast_tab files identically with one or more workers."""
+        serial = anib.process_blast(self.blastdir, self.orglengths,
+                                    mode="ANIb", workers=1)
+        parallel = anib.process_blast(self.blastdir, self.orglengths,
+                                      mode="ANIb", workers=2)
+        for (sdfr, _), (pdfr, _) in zip(serial.data, parallel.data):
+            assert_frame_equal(sdfr, pdfr)
+
+    def test_sidecar(self):
+        """reads sidecar arrays only while the source file is unchanged."""
+        filename = os.path.join(self.outdir, 'source.txt')
+        with open(filename, 'w') as ofh:
+            ofh.write('original')
+        pyani_ingest.write_sidecar(filename, values=np.arange(3))
+        assert_equal(pyani_ingest.read_sidecar(filename,
+                                               'values')['values'].tolist(),
+                     [0, 1, 2])
+        assert_equal(pyani_ingest.read_sidecar(filename, 'other'), None)
+        with open(filename, 'a') as ofh:
+            ofh.write(' and modified')
+        assert_equal(pyani_ingest.read_sidecar(filename, 'values'), None)
+
+    def test_deltadir_sidecar(self):
+        """processes .delta files identically with and without sidecars."""
+        deltadir = os.path.join(self.outdir, 'deltadir')
+        shutil.copytree(self.deltadir, deltadir)
+        for engine in ('delta-filter', 'native'):
+            text = anim.process_deltadir(deltadir, self.orglengths,
+                                         workers=1, filter_engine=engine)
+            for _ in range(2):  # write, then read, the sidecars
+                cached = anim.process_deltadir(deltadir, self.orglengths,
+                                               workers=1, filter_engine=engine,
+                                               sidecar=True)
+                for (tdfr, _), (cdfr, _) in zip(text.data, cached.data):
+                    assert_frame_equal(tdfr, cdfr)
+                assert_frame_equal(text.covered_bases, cached.covered_bases)
+        for filename in pyani_files.get_input_files(deltadir, '.delta',
+                                                    '.filter'):
+            assert os.path.isfile(pyani_ingest.get_sidecar_path(filename))
+
+    def test_blastdir_sidecar(self):
+        """reprocesses .blast_tab sidecars with different thresholds."""
+        blastdir = os.path.join(self.outdir, 'blastn')
+        os.makedirs(blastdir)
+        for filename in pyani_files.get_input_files(self.blastdir,
+                                                    '.blast_tab'):
+            shutil.copy(filename, blastdir)
+        for identity, coverage in ((0.3, 0.7), (0.8, 0.9)):
+            text = anib.process_blast(blastdir, self.orglengths,
+                                      identity=identity, coverage=coverage,
+                                      workers=1)
+            cached = anib.process_blast(blastdir, self.orglengths,
+                                        identity=identity, coverage=coverage,
+                                        workers=1, sidecar=True)
+            for (tdfr, _), (cdfr, _) in zip(text.data, cached.data):
+                assert_frame_equal(tdfr, cdfr)
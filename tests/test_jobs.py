@@ -76,6 +76,11 @@ class TestJob(unittest.TestCase):
         job = pyani_jobs.Job('dummy', self.cmds[0])
         assert_equal(job.script, self.cmds[0])
 
+    def test_job_cost(self):
+        """create dummy jobs with and without estimated cost."""
+        assert_equal(pyani_jobs.Job('dummy', self.cmds[0]).cost, 0)
+        assert_equal(pyani_jobs.Job('dummy', self.cmds[0], cost=10).cost, 10)
+
     def test_add_dependency(self):
         """create dummy job with dependency."""
         job1 = pyani_jobs.Job('dummy_with_dependency', self.cmds[0])
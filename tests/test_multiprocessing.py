@@ -90,6 +90,70 @@ class TestMultiprocessing(unittest.TestCase):
         target = [{cmd} for cmd in self.cmds]
         assert_equal(cmdsets, target)
 
+    def test_command_costs(self):
+        """module collects estimated job costs by command."""
+        job1 = pyani_jobs.Job('dummy_with_dependency', self.cmds[0], cost=5)
+        job2 = pyani_jobs.Job('dummy_dependency', self.cmds[1], cost=2)
+        job3 = pyani_jobs.Job('dummy_shared_dependency', self.cmds[1], cost=3)
+        job1.add_dependency(job2)
+        job1.add_dependency(job3)
+        costs = run_multiprocessing.get_command_costs([job1])
+        assert_equal(costs, {self.cmds[0]: 5, self.cmds[1]: 3})
+
+    def test_iter_jobs(self):
+        """module visits a dependency shared by several jobs once."""
+        dbjob = pyani_jobs.Job('dummy_shared_dependency', self.cmds[1])
+        jobs = [pyani_jobs.Job('dummy_%d' % idx, self.cmds[0]) for
+                idx in range(3)]
+        for job in jobs:
+            job.add_dependency(dbjob)
+        visited = list(run_multiprocessing.iter_jobs(jobs))
+        assert_equal(len(visited), 4)
+        assert_equal(visited.count(dbjob), 1)
+
+    def test_command_threads(self):
+        """module collects job thread counts by command."""
+        job1 = pyani_jobs.Job('dummy_with_dependency', self.cmds[0],
+                              threads=4)
+        job2 = pyani_jobs.Job('dummy_dependency', self.cmds[1])
+        job1.add_dependency(job2)
+        threads = run_multiprocessing.get_command_threads([job1])
+        assert_equal(threads, {self.cmds[0]: 4, self.cmds[1]: 1})
+
+    def test_threads_per_job(self):
+        """module shares cores between jobs as threads."""
+        assert_equal(run_multiprocessing.get_threads_per_job(6, 64), 10)
+        assert_equal(run_multiprocessing.get_threads_per_job(2000, 64), 1)
+        assert_equal(run_multiprocessing.get_threads_per_job(0, 4), 4)
+
+    def test_dependency_graph_order(self):
+        """module starts jobs as soon as their own dependencies complete."""
+        slowdone = os.path.join(self.outdir, 'slow.done')
+        depdone = os.path.join(self.outdir, 'dependency.done')
+        for fname in (slowdone, depdone):
+            if os.path.isfile(fname):
+                os.remove(fname)
+        slow = pyani_jobs.Job('slow', 'sleep 2 && touch %s' % slowdone,
+                              cost=10)
+        dependency = pyani_jobs.Job('dependency', 'touch %s' % depdone)
+        dependent = pyani_jobs.Job('dependent', 'test -f %s && test ! -f %s' %
+                                   (depdone, slowdone))
+        dependent.add_dependency(dependency)
+        result = run_multiprocessing.run_dependency_graph([slow, dependent],
+                                                          workers=2)
+        assert_equal(0, result)
+        assert os.path.isfile(slowdone)
+
+    def test_dependency_graph_retval(self):
+        """module sums exit codes of jobs in a dependency graph."""
+        job1 = pyani_jobs.Job('failing', 'exit 3')
+        job2 = pyani_jobs.Job('dependency', 'true')
+        job3 = pyani_jobs.Job('shared_dependency', 'true')
+        job1.add_dependency(job2)
+        job1.add_dependency(job3)
+        result = run_multiprocessing.run_dependency_graph([job1], workers=1)
+        assert_equal(3, result)
+
     def test_dependency_graph_run(self):
         """module runs dependency graph."""
         fragresult = anib.fragment_fasta_files(self.infiles, self.outdir,
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""test_store.py
+
+Test pyani_store.py module.
+
+These tests are intended to be run from the repository root using:
+
+nosetests -v
+
+print() statements will be caught by nosetests unless there is an
+error. They can also be recovered with the -s option.
+
+(c) The James Hutton Institute 2017
+Author: Leighton Pritchard
+
+Contact:
+leighton.pritchard@hutton.ac.uk
+
+Leighton Pritchard,
+Information and Computing Sciences,
+James Hutton Institute,
+Errol Road,
+Invergowrie,
+Dundee,
+DD6 9LH,
+Scotland,
+UK
+
+The MIT License
+
+Copyright (c) 2017 The James Hutton Institute
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import os
+import shutil
+import time
+import unittest
+
+from nose.tools import (assert_equal, )
+
+from pyani import (anib, pyani_cache, pyani_files, pyani_store)
+
+
+class TestArtefactStore(unittest.TestCase):
+
+    """Class defining tests of the ANIb fragment and BLAST database store."""
+
+    def setUp(self):
+        """Define parameters and values for tests."""
+        self.outdir = os.path.join('tests', 'test_output', 'store')
+        if os.path.isdir(self.outdir):
+            shutil.rmtree(self.outdir)
+        self.storedir = os.path.join(self.outdir, 'store')
+        self.blastdir = os.path.join(self.outdir, 'blastn_output')
+        self.seqdir = os.path.join('tests', 'test_input', 'sequences')
+        self.infiles = pyani_files.get_fasta_files(self.seqdir)
+        self.hashes = pyani_cache.hash_files(self.infiles)
+        self.fragsize = 1020
+        os.makedirs(self.blastdir)
+
+    def test_put_get(self):
+        """stores and retrieves files, persisting between sessions."""
+        store = pyani_store.ArtefactStore(self.storedir)
+        key, components = pyani_store.make_key('a', 'fragments',
+                                               {'fragsize': 1020})
+        assert_equal(store.get(key), None)
+        store.put(key, components, {'seq.fna': self.infiles[0]})
+        store.close()
+        store = pyani_store.ArtefactStore(self.storedir)
+        with open(os.path.join(store.get(key), 'seq.fna'), 'rb') as ifh, \
+                open(self.infiles[0], 'rb') as tfh:
+            assert_equal(ifh.read(), tfh.read())
+        assert_equal(store.info()['size'], os.path.getsize(self.infiles[0]))
+
+    def test_get_shared(self):
+        """lookups leave the store writable by another session."""
+        store = pyani_store.ArtefactStore(self.storedir)
+        keys = [pyani_store.make_key(genome, 'fragments', {}) for
+                genome in 'ab']
+        store.put(keys[0][0], keys[0][1], {'seq.fna': self.infiles[0]})
+        store.commit()
+        before = time.time()
+        assert store.get(keys[0][0]) is not None
+        assert not store.conn.in_transaction
+        other = pyani_store.ArtefactStore(self.storedir)
+        other.conn.execute('PRAGMA busy_timeout = 0')
+        other.put(keys[1][0], keys[1][1], {'seq.fna': self.infiles[0]})
+        other.close()
+        # Access times are written at commit
+        store.close()
+        store = pyani_store.ArtefactStore(self.storedir)
+        accessed = dict(store.conn.execute('SELECT key, accessed FROM ' +
+                                           'artefacts').fetchall())
+        assert accessed[keys[0][0]] >= before
+        store.close()
+
+    def test_prune(self):
+        """evicts least recently used entries beyond the size limit."""
+        store = pyani_store.ArtefactStore(self.storedir)
+        fname = os.path.join(self.outdir, 'data.txt')
+        with open(fname, 'w') as ofh:
+            ofh.write('x' * 100)
+        keys = []
+        for genome in 'abcd':
+            key, components = pyani_store.make_key(genome, 'fragments', {})
+            store.put(key, components, {'data.txt': fname})
+            keys.append(key)
+        store.commit()
+        store.get(keys[0])  # most recently used
+        assert_equal(store.prune(200), 2)
+        assert_equal([store.get(key) is None for key in keys],
+                     [False, True, True, False])
+        assert_equal(sorted(name for name in os.listdir(self.storedir) if
+                            os.path.isdir(os.path.join(self.storedir,
+                                                       name))),
+                     sorted([keys[0], keys[3]]))
+
+    def test_fragments(self):
+        """links stored fragment files and lengths into place."""
+        store = pyani_store.ArtefactStore(self.storedir)
+        fragfiles, fraglengths = anib.fragment_fasta_files(self.infiles,
+                                                           self.blastdir,
+                                                           self.fragsize)
+        _, _, missing = pyani_store.fetch_fragments(store, self.infiles,
+                                                    self.hashes,
+                                                    self.blastdir,
+                                                    self.fragsize)
+        assert_equal(missing, self.infiles)
+        pyani_store.store_fragments(store, fragfiles, fraglengths,
+                                    self.hashes, self.fragsize)
+        rundir = os.path.join(self.outdir, 'rerun')
+        stored, storedlengths, missing = pyani_store.fetch_fragments(
+            store, self.infiles, self.hashes, rundir, self.fragsize)
+        assert_equal(missing, [])
+        assert_equal({stem: lengths.tolist() for stem, lengths in
+                      storedlengths.items()},
+                     {stem: lengths.tolist() for stem, lengths in
+                      fraglengths.items()})
+        for fragfile in fragfiles:
+            stem = anib.get_fragment_stem(fragfile)
+            assert_equal(os.path.split(stored[stem])[-1],
+                         os.path.split(fragfile)[-1])
+            with open(stored[stem], 'r') as ifh, open(fragfile, 'r') as tfh:
+                assert_equal(ifh.read(), tfh.read())
+        # Other fragment sizes are not found
+        assert_equal(pyani_store.fetch_fragments(store, self.infiles,
+                                                 self.hashes, rundir,
+                                                 500)[2], self.infiles)
+
+    def test_blastdbs(self):
+        """links stored BLAST databases into place, skipping their jobs."""
+        store = pyani_store.ArtefactStore(self.storedir)
+        blastcmds = anib.make_blastcmd_builder("ANIb", self.blastdir)
+        for fname in self.infiles:
+            for ext in ('.nhr', '.nin', '.nsq'):
+                with open(blastcmds.get_db_name(fname) + ext, 'w') as ofh:
+                    ofh.write(ext)
+        assert_equal(pyani_store.store_blastdbs(store, self.infiles,
+                                                self.hashes, blastcmds,
+                                                "ANIb", "2.6.0"),
+                     len(self.infiles))
+        shutil.rmtree(self.blastdir)
+        assert_equal(pyani_store.fetch_blastdbs(store, self.infiles,
+                                                self.hashes, blastcmds,
+                                                "ANIb", "2.7.1"), set())
+        prebuilt = pyani_store.fetch_blastdbs(store, self.infiles,
+                                              self.hashes, blastcmds,
+                                              "ANIb", "2.6.0")
+        assert_equal(prebuilt, set(blastcmds.get_db_name(fname) for fname in
+                                   self.infiles))
+        for dbname in prebuilt:
+            assert os.path.isfile(dbname + '.nin')
+        fragfiles = [os.path.join(self.blastdir, "%s-fragments.fna" %
+                                  pyani_files.get_file_stem(fname))
+                     for fname in self.infiles]
+        jobgraph = anib.make_job_graph(self.infiles, fragfiles, blastcmds,
+                                       prebuilt=prebuilt)
+        assert_equal(len(jobgraph), 2)
+        for job in jobgraph:
+            assert_equal(job.dependencies, [])
@@ -51,10 +51,13 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 """
 
+import collections
 import json
 import os
+import shutil
 import unittest
 
+import numpy as np
 import pandas as pd
 
 from nose.tools import (assert_equal, assert_false, assert_true)
@@ -97,6 +100,46 @@ class TestTETRA(unittest.TestCase):
             target = json.load(ifh)
         assert_equal(ordered(tetra_z), ordered(target))
 
+    def test_zscores_parallel(self):
+        """TETRA Z-scores calculated in worker processes."""
+        zscores = tetra.calculate_tetra_zscore_array(self.infile)
+        assert_equal(zscores.shape, (256,))
+        target = tetra.calculate_tetra_zscore(self.infile)
+        assert_equal(tetra.get_zscore_dict(zscores), target)
+        for workers in (1, 2):
+            result = tetra.calculate_tetra_zscores([self.infile] * 2,
+                                                   workers)
+            assert_equal(result, {'NC_002696': target})
+
+    def test_kmer_counts(self):
+        """counts oligonucleotides on both strands, skipping ambiguities."""
+        outdir = os.path.join('tests', 'test_output', 'tetra')
+        os.makedirs(outdir, exist_ok=True)
+        fname = os.path.join(outdir, 'kmers.fna')
+        seqs = ['ACGTNacgtTTGCA', 'GGC', 'ATTAGCCGAT']
+        # Sequences are split over lines, with text before the first header
+        with open(fname, 'w', newline='') as ofh:
+            ofh.write('preamble ACGT\r\n')
+            ofh.writelines('>seq%d desc>\r\n%s\r\n%s\r\n' %
+                           (idx, seq[:5], seq[5:]) for idx, seq in
+                           enumerate(seqs))
+        revcomp = str.maketrans('ACGT', 'TGCA')
+        for blocksize in (1, 3, 7, tetra.TETRA_BLOCKSIZE):
+            counts = tetra.get_kmer_counts(fname, blocksize)
+            for size, result in zip((2, 3, 4), counts):
+                expected = collections.Counter()
+                for seq in [seq.upper() for seq in seqs]:
+                    for strand in (seq, seq.translate(revcomp)[::-1]):
+                        # The last tetranucleotide of each strand is not
+                        # counted
+                        nwindows = len(strand) - size + (size < 4)
+                        expected.update(strand[idx:idx + size] for idx in
+                                        range(nwindows))
+                for code, count in enumerate(result):
+                    oligo = tetra.TETRANUCLEOTIDES[code][4 - size:]
+                    assert_equal((blocksize, oligo, count),
+                                 (blocksize, oligo, expected[oligo]))
+
     def test_correlations(self):
         """TETRA correlation calculated correctly."""
         infiles = ordered(self.infiles)[:2]  # only test a single correlation
@@ -104,3 +147,86 @@ class TestTETRA(unittest.TestCase):
         target = pd.read_csv(os.path.join(self.tgtdir, 'correlation.tab'), sep='\t',
                              index_col=0)
         assert_frame_equal(corr, target)
+
+    def test_correlations_blocked(self):
+        """TETRA correlation matrix is independent of block size."""
+        orgs = ['org%d' % idx for idx in range(7)]
+        zscores = np.random.RandomState(1).randn(len(orgs), 256)
+        tetra_z = {org: dict(zip(tetra.TETRANUCLEOTIDES, row)) for
+                   org, row in zip(orgs, zscores)}
+        target = pd.DataFrame(np.corrcoef(zscores), index=orgs, columns=orgs)
+        for blocksize in (1, 3, 1024):
+            corr = tetra.calculate_correlations(tetra_z, blocksize)
+            assert_frame_equal(corr, target)
+            assert_true((corr.values == corr.values.T).all())
+
+    def test_correlations_from_arrays(self):
+        """TETRA correlations calculated from arrays of Z-scores."""
+        orgs = ['org%d' % idx for idx in range(4)]
+        zscores = np.random.RandomState(3).randn(len(orgs), 256)
+        zscores[:, [0, 17]] = np.nan  # unobserved in any sequence
+        tetra_z = {org: tetra.get_zscore_dict(row) for org, row in
+                   zip(orgs, zscores)}
+        assert_frame_equal(tetra.calculate_correlation_matrix(orgs, zscores),
+                           tetra.calculate_correlations(tetra_z))
+        # Z-scores missing for only some sequences
+        zscores[2, 5] = np.nan
+        with self.assertRaises(ValueError):
+            tetra.calculate_correlation_matrix(orgs, zscores)
+
+    def test_index_query(self):
+        """TETRA index returns the most correlated indexed sequences."""
+        indexdir = os.path.join('tests', 'test_output', 'tetra', 'index')
+        if os.path.isdir(indexdir):
+            shutil.rmtree(indexdir)
+        zscores = np.random.RandomState(5).randn(50, 256)
+        index = tetra.TetraIndex(indexdir)
+        for idx, row in enumerate(zscores):
+            index.add('org%d' % idx, row)
+        index.add('org3', zscores[7])  # replaced labels keep their row
+        zscores[3] = zscores[7]
+        index = tetra.TetraIndex(indexdir)  # reopened from disk
+        assert_equal(len(index), 50)
+        query = zscores[0] + np.random.RandomState(6).randn(256)
+        corrs = np.corrcoef(np.vstack([query, zscores]))[0, 1:]
+        order = sorted(range(50), key=lambda idx: (-corrs[idx], idx))[:5]
+        for blocksize in (1, 4, 64):
+            result = index.query(query, 5, blocksize)
+            assert_equal([label for label, corr in result],
+                         ['org%d' % idx for idx in order])
+            assert_true(np.allclose([corr for label, corr in result],
+                                    corrs[order]))
+        query[17] = np.nan
+        with self.assertRaises(ValueError):
+            index.query(query)
+        with self.assertRaises(ValueError):
+            index.add('unobserved', query)
+
+    def test_index_concurrent_add(self):
+        """TETRA index gives distinct rows to concurrently added sequences."""
+        indexdir = os.path.join('tests', 'test_output', 'tetra', 'index')
+        if os.path.isdir(indexdir):
+            shutil.rmtree(indexdir)
+        zscores = np.random.RandomState(7).randn(3, 256)
+        first = tetra.TetraIndex(indexdir)
+        second = tetra.TetraIndex(indexdir)
+        assert_equal([first.add('org0', zscores[0]),
+                      second.add('org1', zscores[1]),
+                      first.add('org2', zscores[2])], [0, 1, 2])
+        assert_equal(first.labels, ['org0', 'org1', 'org2'])
+        for idx in range(3):
+            assert_equal(second.query(zscores[idx], 1)[0][0], 'org%d' % idx)
+        first.close()
+        second.close()
+
+    def test_filter_pairs(self):
+        """splits comparisons by TETRA correlation threshold."""
+        orgs = ['org%d' % idx for idx in range(3)]
+        corr = pd.DataFrame([[1, 0.995, 0.9], [0.995, 1, np.nan],
+                             [0.9, np.nan, 1]], index=orgs, columns=orgs)
+        pairs = [('org0', 'org1'), ('org0', 'org2'), ('org2', 'org0'),
+                 ('org1', 'org2')]
+        assert_equal(tetra.filter_pairs(pairs, corr, 0.99),
+                     ([('org0', 'org1'), ('org1', 'org2')],
+                      [('org0', 'org2'), ('org2', 'org0')]))
+        assert_equal(tetra.filter_pairs([], corr, 0.99), ([], []))